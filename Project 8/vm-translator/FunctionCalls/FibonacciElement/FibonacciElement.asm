@@ -67,7 +67,7 @@ M=D
 @SP
 M=M+1
 // call Main.fibonacci 1
-@Sys.init$ret.1
+@Sys.init$ret.0
 D=A
 @SP
 A=M
@@ -116,7 +116,7 @@ D=M
 M=D
 @Main.fibonacci
 0;JMP
-(Sys.init$ret.1)
+(Sys.init$ret.0)
 // label END
 (Sys.init$END)
 // goto END
@@ -149,18 +149,18 @@ AM=M-1
 D=M
 A=A-1
 D=M-D
-@LT_0_TRUE
+@Main.LT_0_TRUE
 D;JLT
 @SP
 A=M-1
 M=0
-@LT_0_END
+@Main.LT_0_END
 0;JMP
-(LT_0_TRUE)
+(Main.LT_0_TRUE)
 @SP
 A=M-1
 M=-1
-(LT_0_END)
+(Main.LT_0_END)
 // if-goto N_LT_2
 @SP
 AM=M-1
@@ -1,19 +1,13 @@
 // function SimpleFunction.test 2
 (SimpleFunction.test)
-@0
-D=A
 @SP
 A=M
-M=D
-@SP
-M=M+1
-@0
-D=A
+M=0
+A=A+1
+M=0
+D=A+1
 @SP
-A=M
 M=D
-@SP
-M=M+1
 // push local 0
 @LCL
 D=M
@@ -75,7 +75,7 @@ M=D
 @SP
 M=M+1
 // call Class1.set 2
-@Sys.init$ret.1
+@Sys.init$ret.0
 D=A
 @SP
 A=M
@@ -124,7 +124,7 @@ D=M
 M=D
 @Class1.set
 0;JMP
-(Sys.init$ret.1)
+(Sys.init$ret.0)
 // pop temp 0
 @SP
 AM=M-1
@@ -148,7 +148,7 @@ M=D
 @SP
 M=M+1
 // call Class2.set 2
-@Sys.init$ret.2
+@Sys.init$ret.1
 D=A
 @SP
 A=M
@@ -197,7 +197,7 @@ D=M
 M=D
 @Class2.set
 0;JMP
-(Sys.init$ret.2)
+(Sys.init$ret.1)
 // pop temp 0
 @SP
 AM=M-1
@@ -205,7 +205,7 @@ D=M
 @5
 M=D
 // call Class1.get 0
-@Sys.init$ret.3
+@Sys.init$ret.2
 D=A
 @SP
 A=M
@@ -254,9 +254,9 @@ D=M
 M=D
 @Class1.get
 0;JMP
-(Sys.init$ret.3)
+(Sys.init$ret.2)
 // call Class2.get 0
-@Sys.init$ret.4
+@Sys.init$ret.3
 D=A
 @SP
 A=M
@@ -305,7 +305,7 @@ D=M
 M=D
 @Class2.get
 0;JMP
-(Sys.init$ret.4)
+(Sys.init$ret.3)
 // label END
 (Sys.init$END)
 // goto END
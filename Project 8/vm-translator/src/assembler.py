@@ -0,0 +1,160 @@
+import sys
+from array import array
+
+COMP = {
+    "0": "0101010", "1": "0111111", "-1": "0111010",
+    "D": "0001100", "A": "0110000", "M": "1110000",
+    "!D": "0001101", "!A": "0110001", "!M": "1110001",
+    "-D": "0001111", "-A": "0110011", "-M": "1110011",
+    "D+1": "0011111", "A+1": "0110111", "M+1": "1110111",
+    "D-1": "0001110", "A-1": "0110010", "M-1": "1110010",
+    "D+A": "0000010", "D+M": "1000010", "D-A": "0010011", "D-M": "1010011",
+    "A-D": "0000111", "M-D": "1000111", "D&A": "0000000", "D&M": "1000000",
+    "D|A": "0010101", "D|M": "1010101",
+}
+# Commutative spellings of the same computations
+for _comp in ["D+A", "D+M", "D&A", "D&M", "D|A", "D|M"]:
+    COMP[_comp[2] + _comp[1] + _comp[0]] = COMP[_comp]
+
+JUMP = {"": 0, "JGT": 1, "JEQ": 2, "JGE": 3, "JLT": 4, "JNE": 5, "JLE": 6, "JMP": 7}
+
+PREDEFINED_SYMBOLS = {
+    "SP": 0, "LCL": 1, "ARG": 2, "THIS": 3, "THAT": 4,
+    "SCREEN": 16384, "KBD": 24576,
+}
+PREDEFINED_SYMBOLS.update({f"R{i}": i for i in range(16)})
+
+VARIABLE_BASE = 16
+# A-instructions carry 15 bits
+MAX_ADDRESS = 0x7FFF
+
+class Label:
+    # a (name) line: binds name to the next instruction's address
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+def decode(line):
+    # returns an int for a complete instruction, a str for an A-instruction
+    # still waiting on a label or variable, a Label, or None for blank/comment lines
+    line = line.split("//")[0].strip()
+    if not line:
+        return None
+    if line.startswith("("):
+        return Label(line[1:-1])
+    if line.startswith("@"):
+        value = line[1:]
+        if value.isdigit():
+            if int(value) > MAX_ADDRESS:
+                raise ValueError(f"Constant out of range: {line}")
+            return int(value)
+        return PREDEFINED_SYMBOLS.get(value, value)
+
+    dest, _, rest = line.rpartition("=")
+    comp, _, jump = rest.partition(";")
+    if comp not in COMP or jump not in JUMP or set(dest) - set("ADM"):
+        raise ValueError(f"Invalid instruction: {line}")
+    dest_bits = ("A" in dest) << 2 | ("D" in dest) << 1 | ("M" in dest)
+    return 0b111 << 13 | int(COMP[comp], 2) << 6 | dest_bits << 3 | JUMP[jump]
+
+class DecodedLines(dict):
+    # line -> decode(line), filled in on first use; text of several lines
+    # (a fragment, a whole file) gives its lines, and is not kept
+    def __missing__(self, line):
+        if "\n" in line[:-1]:
+            return line.splitlines()
+        code = self[line] = decode(line)
+        return code
+
+class HackAssembler:
+    # Assembles the instruction stream written to it. Used as the
+    # CodeWriter's output file to go straight from VM code to machine code,
+    # or on its own through assemble_file; the emulators use it to load .asm
+    # programs. Lines are only collected as they come (write is the list's
+    # own append) and assembled in two passes on close: the first decodes
+    # each distinct line once and builds the symbol table, the second
+    # resolves the symbolic A-instructions.
+    def __init__(self, output_path, packed_path=None):
+        self.output_path = output_path
+        self.packed_path = packed_path
+        # lines as written: single lines, or whole fragments of text
+        self.lines = []
+        self.write = self.lines.append
+        self.writelines = self.lines.extend
+        self.symbols = dict(PREDEFINED_SYMBOLS)
+        # each distinct line is decoded once
+        self.decoded = DecodedLines()
+
+    def _first_pass(self, lines, instructions, references):
+        # Decodes lines onto instructions, noting the positions of symbolic
+        # A-instructions in references and binding labels
+        codes = list(map(self.decoded.__getitem__, lines))
+        # runs of complete instructions are copied over whole
+        start = 0
+        for i in [i for i, code in enumerate(codes) if code.__class__ is not int]:
+            instructions += codes[start:i]
+            start = i + 1
+            code = codes[i]
+            if code is None:
+                continue
+            if code.__class__ is str:
+                references.append(len(instructions))
+                instructions.append(code)
+            elif code.__class__ is Label:
+                if code.name in self.symbols:
+                    raise ValueError(f"Duplicate label: {code.name}")
+                self.symbols[code.name] = len(instructions)
+            else:
+                # a whole fragment rather than a single line
+                self._first_pass(code, instructions, references)
+        instructions += codes[start:]
+
+    def resolve(self):
+        # Returns the machine code. Symbolic A-instructions become label
+        # addresses, or variables allocated from RAM[16] in order of first
+        # use.
+        instructions = []
+        references = []
+        self._first_pass(self.lines, instructions, references)
+        self.lines.clear()
+        symbols = self.symbols
+        next_variable = VARIABLE_BASE
+        for i in references:
+            symbol = instructions[i]
+            address = symbols.get(symbol)
+            if address is None:
+                address = symbols[symbol] = next_variable
+                next_variable += 1
+            elif address > MAX_ADDRESS:
+                raise ValueError(f"Label {symbol} at {address} is beyond the 32K ROM")
+            instructions[i] = address
+        return array("H", instructions)
+
+    def close(self):
+        words = self.resolve()
+        # Programs reuse a small set of words, so format each one once
+        text = {word: f"{word:016b}\n" for word in set(words)}
+        with open(self.output_path, "w") as file:
+            file.write("".join(map(text.__getitem__, words)))
+        if self.packed_path is not None:
+            if sys.byteorder == "little":
+                words.byteswap()
+            with open(self.packed_path, "wb") as file:
+                words.tofile(file)
+
+def assemble_file(asm_path, hack_path, packed_path=None):
+    assembler = HackAssembler(hack_path, packed_path)
+    with open(asm_path, "r") as file:
+        assembler.write(file.read())
+    assembler.close()
+    return assembler
+
+def main():
+    if len(sys.argv) != 2 or not sys.argv[1].endswith(".asm"):
+        print("Usage: python assembler.py <input.asm>")
+        sys.exit(1)
+    assemble_file(sys.argv[1], sys.argv[1][:-len(".asm")] + ".hack")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import argparse
+import sys
+import time
+from hack_emulator import COMP_EXPRESSIONS, RAM_SIZE, load_program
+
+try:
+    import numpy as np
+except ImportError:
+    # Optional: only the batch emulator needs it
+    np = None
+
+# Runs one Hack program on many RAM images at once. RAM is an
+# (instances, 32K) int16 array and A, D and pc are one entry per instance.
+# Each step executes one instruction for every instance at the chosen pc
+# with whole-array operations, int16 wrapping like the ALU. While all
+# running instances share a pc (the usual case, since they run the same
+# code) that is every instance; once a branch splits them the lowest pc
+# runs first, so the others wait and the groups meet up again.
+
+JUMP_TESTS = {
+    1: lambda x: x > 0, 2: lambda x: x == 0, 3: lambda x: x >= 0,
+    4: lambda x: x < 0, 5: lambda x: x != 0, 6: lambda x: x <= 0,
+}
+
+def _decode(words):
+    # Per pc: an int for an A-instruction, else (comp function, reads M,
+    # dest bits, jump bits)
+    program = []
+    for word in words:
+        if word < 0x8000:
+            program.append(word)
+            continue
+        comp = COMP_EXPRESSIONS.get(word >> 6 & 0x7F)
+        if comp is None:
+            raise ValueError(f"Unsupported instruction {word:016b} at {len(program)}")
+        function = eval(f"lambda A, D, M: {comp}")
+        program.append((function, "M" in comp, word >> 3 & 7, word & 7))
+    return program
+
+def _idle_loops(words):
+    # pcs of (X) @X 0;JMP, where a finished program parks
+    return {pc for pc in range(len(words) - 1)
+            if words[pc] == pc and words[pc + 1] == 0b1110101010000111}
+
+class BatchEmulator:
+    def __init__(self, words, instances):
+        if np is None:
+            raise ImportError("The batch emulator needs NumPy")
+        self.program = _decode(words)
+        self.idle = _idle_loops(words)
+        self.ram = np.zeros((instances, RAM_SIZE), dtype=np.int16)
+        self.a = np.zeros(instances, dtype=np.int16)
+        self.d = np.zeros(instances, dtype=np.int16)
+        self.pc = np.zeros(instances, dtype=np.int64)
+        self.cycles = np.zeros(instances, dtype=np.int64)
+        # instances still running; the rest halted or ran out of cycles
+        self.running = np.ones(instances, dtype=bool)
+
+    def run(self, max_cycles=None):
+        # Runs every instance until it parks in an idle loop, leaves the
+        # program or has run max_cycles cycles. Returns the instance-steps
+        # executed.
+        program = self.program
+        end = len(program)
+        ram, a, d, pc, cycles = self.ram, self.a, self.d, self.pc, self.cycles
+        executed = 0
+        rows = np.flatnonzero(self.running)
+        # with every running instance at one pc, that pc as an int
+        shared = None
+        while len(rows):
+            if shared is None:
+                # run the lowest pc; instances elsewhere wait
+                running = np.flatnonzero(self.running)
+                if not len(running):
+                    break
+                pcs = pc[running]
+                current = int(pcs.min())
+                rows = running[pcs == current]
+                if len(rows) == len(running):
+                    shared = current
+            else:
+                current = shared
+
+            if current >= end or current in self.idle:
+                stop = rows
+            elif max_cycles is not None:
+                stop = rows[cycles[rows] >= max_cycles]
+            else:
+                stop = ()
+            if len(stop):
+                # park these instances where they are
+                pc[rows] = current
+                self.running[stop] = False
+                shared = None
+                rows = np.flatnonzero(self.running)
+                continue
+
+            executed += len(rows)
+            cycles[rows] += 1
+            instruction = program[current]
+            if instruction.__class__ is int:
+                a[rows] = instruction
+                next_pc = current + 1
+            else:
+                function, reads_m, dest, jump = instruction
+                old_a = a[rows]
+                address = old_a.astype(np.int64) & 0x7FFF
+                value = function(old_a, d[rows], ram[rows, address] if reads_m else None)
+                if dest & 1:
+                    ram[rows, address] = value
+                if dest & 2:
+                    d[rows] = value
+                if dest & 4:
+                    a[rows] = value
+                next_pc = current + 1
+                if jump:
+                    taken = True if jump == 7 else JUMP_TESTS[jump](value)
+                    if np.ndim(taken) and taken.any() and not taken.all():
+                        next_pc = np.where(taken, old_a.astype(np.int64) & 0x7FFF, next_pc)
+                    elif np.all(taken):
+                        # jump targets may still differ per instance
+                        next_pc = int(old_a[0]) & 0x7FFF
+                        if not (old_a == old_a[0]).all():
+                            next_pc = old_a.astype(np.int64) & 0x7FFF
+
+            if isinstance(next_pc, int):
+                if shared is not None:
+                    shared = next_pc
+                else:
+                    pc[rows] = next_pc
+            else:
+                pc[rows] = next_pc
+                shared = None
+        return executed
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Run one Hack program on many RAM images")
+    arg_parser.add_argument("input_path", help=".asm or .hack program")
+    arg_parser.add_argument("--instances", type=int, default=1000, metavar="N")
+    arg_parser.add_argument("--set", action="append", default=[], metavar="ADDRESS=VALUE",
+                            help="preset a RAM word in every instance")
+    arg_parser.add_argument("--vary", action="append", default=[], metavar="ADDRESS=LOW:HIGH",
+                            help="preset a RAM word to LOW, LOW+1, ... HIGH across the instances (repeating)")
+    arg_parser.add_argument("--cycles", type=int, default=None, metavar="N",
+                            help="stop each instance after N cycles instead of at its idle loop")
+    arg_parser.add_argument("--show", action="append", type=int, default=[], metavar="ADDRESS",
+                            help="print the first few instances' final value of a RAM word")
+    args = arg_parser.parse_args()
+    if np is None:
+        print("Error: the batch emulator needs NumPy")
+        sys.exit(1)
+
+    emulator = BatchEmulator(load_program(args.input_path), args.instances)
+    for setting in args.set:
+        address, _, value = setting.partition("=")
+        emulator.ram[:, int(address)] = int(value)
+    for setting in args.vary:
+        address, _, bounds = setting.partition("=")
+        low, _, high = bounds.partition(":")
+        span = np.arange(args.instances) % (int(high) - int(low) + 1)
+        emulator.ram[:, int(address)] = int(low) + span
+
+    start = time.perf_counter()
+    executed = emulator.run(args.cycles)
+    elapsed = time.perf_counter() - start
+
+    print(f"instances: {args.instances}")
+    print(f"cycles per instance: min {emulator.cycles.min()}, max {emulator.cycles.max()}")
+    print(f"instance-steps: {executed}")
+    if elapsed > 0:
+        print(f"speed: {executed / elapsed / 1e6:.2f}M instance-steps/s")
+    for address in args.show:
+        print(f"RAM[{address}]: {' '.join(str(value) for value in emulator.ram[:8, address])}")
+
+if __name__ == "__main__":
+    main()
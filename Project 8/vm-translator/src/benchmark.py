@@ -0,0 +1,178 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from code_writer import CodeWriter
+from assembler import HackAssembler, assemble_file
+from hack_emulator import HackEmulator, load_program
+from main import translate, translate_file, list_vm_files, count_instructions
+from parser import Parser
+from peephole import PeepholeOptimizer
+from vm_optimizer import VMOptimizer
+from synthetic_programs import SHAPES, write_program
+
+class _LineWriter:
+    # What CodeWriter wrote to before OutputBuffer: the file itself, one
+    # file.write call per line
+    def __init__(self, file):
+        self.write = file.write
+        self.close = file.close
+
+    def end_section(self):
+        pass
+
+def translate_unbuffered(vm_files, output_path, is_multi_file):
+    # The old output path: a writer per file, reopened in append mode,
+    # with one file.write per assembly line and no buffer in between
+    for i, file_path in enumerate(vm_files):
+        # flush_threshold=0 passes the bootstrap straight to the file
+        code_writer = CodeWriter(output_path, append=i > 0,
+                                 is_sys_init=is_multi_file and i == 0,
+                                 flush_threshold=0)
+        code_writer.file = _LineWriter(code_writer.file.file)
+        translate_file(file_path, code_writer)
+        code_writer.close()
+
+def best_time(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def benchmark_output(vm_files, is_multi_file, repeat):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_path = os.path.join(temp_dir, "out.asm")
+        unbuffered = best_time(lambda: translate_unbuffered(vm_files, output_path, is_multi_file), repeat)
+        buffered = best_time(lambda: translate(vm_files, output_path, is_multi_file), repeat)
+    print(f"writer per file, reopened:        {unbuffered:.3f}s")
+    print(f"one writer per program:           {buffered:.3f}s ({unbuffered / buffered:.2f}x)")
+
+def benchmark_emit(vm_files, is_multi_file, repeat):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        asm_path = os.path.join(temp_dir, "out.asm")
+        hack_path = os.path.join(temp_dir, "out.hack")
+
+        def translate_then_assemble():
+            translate(vm_files, asm_path, is_multi_file)
+            assemble_file(asm_path, hack_path)
+
+        def emit_hack():
+            translate(vm_files, hack_path, is_multi_file, output_file=HackAssembler(hack_path))
+
+        two_pass = best_time(translate_then_assemble, repeat)
+        direct = best_time(emit_hack, repeat)
+    print(f"translate, then assemble .asm:    {two_pass:.3f}s")
+    print(f"--emit hack:                      {direct:.3f}s ({two_pass / direct:.2f}x)")
+
+def _o1_options():
+    return {"optimizer": PeepholeOptimizer(), "fuse_branches": True, "direct_moves": True}
+
+# Translator settings the suite runs every program under; each builds fresh
+# options, since optimizers accumulate statistics
+SUITE_CONFIGS = {
+    "O0": lambda: {},
+    "O1": _o1_options,
+    "O2": lambda: dict(_o1_options(), vm_optimizer=VMOptimizer(entry="Sys.init")),
+    "O2-cache-top": lambda: dict(_o1_options(), cache_top=True,
+                                 vm_optimizer=VMOptimizer(entry="Sys.init")),
+}
+
+def measure(vm_files, make_options, repeat):
+    # Wall time (best of repeat), peak Python heap and output size of one
+    # translation, and the cycles the program takes to reach Sys.init$END
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_path = os.path.join(temp_dir, "out.asm")
+        seconds = best_time(lambda: translate(vm_files, output_path, True, **make_options()), repeat)
+        # Traced separately, since tracing slows the translator down
+        tracemalloc.start()
+        translate(vm_files, output_path, True, **make_options())
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        instructions = count_instructions(output_path)
+        try:
+            emulator = HackEmulator(load_program(output_path))
+        except ValueError:
+            # too big for the 32K ROM
+            cycles = None
+        else:
+            cycles = emulator.run()
+    return {"seconds": seconds, "peak_bytes": peak_bytes, "instructions": instructions,
+            "cycles": cycles}
+
+def run_suite(shapes, size, configs, repeat, seed=0):
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for shape in shapes:
+            program_dir = os.path.join(temp_dir, shape)
+            write_program(program_dir, shape, size, seed)
+            vm_files = list_vm_files(program_dir)
+            vm_commands = sum(len(Parser(file_path).commands) for file_path in vm_files)
+            for config in configs:
+                result = {"shape": shape, "size": size, "config": config,
+                          "files": len(vm_files), "vm_commands": vm_commands}
+                result.update(measure(vm_files, SUITE_CONFIGS[config], repeat))
+                results.append(result)
+                print(f"{shape:12} {config:14} {result['seconds']:8.3f}s "
+                      f"{result['peak_bytes'] / 1e6:8.1f} MB {result['instructions']:8} instructions "
+                      f"{result['cycles'] if result['cycles'] is not None else '-':>10} cycles",
+                      file=sys.stderr)
+    return results
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark the VM translator")
+    arg_parser.add_argument("input_path", nargs="?", help=".vm file or directory of .vm files")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="runs per measurement (best is kept)")
+    arg_parser.add_argument("--suite", action="store_true",
+                            help="benchmark generated programs instead of input_path")
+    arg_parser.add_argument("--shapes", default=",".join(SHAPES),
+                            help=f"comma-separated program shapes for --suite ({', '.join(SHAPES)})")
+    arg_parser.add_argument("--size", type=int, default=1000, help="workload size of generated programs")
+    arg_parser.add_argument("--configs", default=",".join(SUITE_CONFIGS),
+                            help=f"comma-separated translator settings for --suite ({', '.join(SUITE_CONFIGS)})")
+    arg_parser.add_argument("--json", metavar="PATH",
+                            help="write --suite results as JSON to PATH (- for stdout)")
+    args = arg_parser.parse_args()
+
+    if args.suite:
+        shapes = args.shapes.split(",")
+        configs = args.configs.split(",")
+        for name in shapes:
+            if name not in SHAPES:
+                arg_parser.error(f"unknown shape: {name}")
+        for name in configs:
+            if name not in SUITE_CONFIGS:
+                arg_parser.error(f"unknown config: {name}")
+        report = {"python": platform.python_version(), "repeat": args.repeat,
+                  "results": run_suite(shapes, args.size, configs, args.repeat)}
+        if args.json == "-":
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        elif args.json:
+            with open(args.json, "w") as file:
+                json.dump(report, file, indent=2)
+        return
+    if args.input_path is None:
+        arg_parser.error("input_path is required without --suite")
+
+    if os.path.isdir(args.input_path):
+        vm_files = list_vm_files(args.input_path)
+        is_multi_file = True
+    else:
+        vm_files = [args.input_path]
+        is_multi_file = False
+    if not vm_files:
+        print(f"Error: No .vm files found in {args.input_path}")
+        sys.exit(1)
+
+    benchmark_output(vm_files, is_multi_file, args.repeat)
+    benchmark_emit(vm_files, is_multi_file, args.repeat)
+
+if __name__ == "__main__":
+    main()
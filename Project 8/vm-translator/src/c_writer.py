@@ -0,0 +1,220 @@
+import subprocess
+from array import array
+from parser import COMPARE_TESTS, CommandType
+
+# Translates VM commands to one C file instead of Hack assembly. The C
+# program keeps the Hack RAM as 32K int16_t words with the same layout:
+# SP/LCL/ARG/THIS/THAT in RAM[0..4], temp at RAM[5..12], statics from
+# RAM[16] in order of first use, and the frames write_call/write_return
+# build. All code goes in main, one label per VM label and function, and
+# return uses a computed goto (GCC/Clang labels as values) through the
+# table of return sites, whose index is the return address on the stack.
+# Run with ADDRESS=VALUE arguments to preset RAM; on halting the program
+# writes all of RAM to stdout as native-endian 16-bit words.
+
+RAM_SIZE = 32768
+VARIABLE_BASE = 16
+SEGMENT_POINTERS = {"local": 1, "argument": 2, "this": 3, "that": 4}
+
+PRELUDE = """#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+
+/* Hack addresses are 15 bits; int16_t results wrap as the ALU's do */
+static int16_t ram[32768];
+#define AT(address) ram[(uint16_t)(address) & 0x7FFF]
+#define PUSH(value) do { int16_t v_ = (value); AT(ram[0]) = v_; ram[0]++; } while (0)
+#define POP(target) do { ram[0]--; target = AT(ram[0]); } while (0)
+#define BINARY(e) do { int16_t y = AT(ram[0] - 1); ram[0]--; int16_t x = AT(ram[0] - 1); \\
+                       AT(ram[0] - 1) = (int16_t)(e); } while (0)
+#define UNARY(e) do { int16_t x = AT(ram[0] - 1); AT(ram[0] - 1) = (int16_t)(e); } while (0)
+
+int main(int argc, char **argv) {
+    for (int i = 1; i < argc; i++) {
+        long address, value;
+        if (sscanf(argv[i], "%ld=%ld", &address, &value) != 2 || address < 0 || address >= 32768) {
+            fprintf(stderr, "expected ADDRESS=VALUE, got %s\\n", argv[i]);
+            return 2;
+        }
+        ram[address] = (int16_t)value;
+    }
+"""
+
+POSTLUDE = """halt:
+    fwrite(ram, sizeof ram, 1, stdout);
+    return 0;
+}
+"""
+
+ARITHMETIC = {
+    "add": "BINARY(x + y);",
+    "sub": "BINARY(x - y);",
+    "and": "BINARY(x & y);",
+    "or": "BINARY(x | y);",
+    "neg": "UNARY(-x);",
+    "not": "UNARY(~x);",
+}
+ARITHMETIC.update((opcode.value, f"BINARY((int16_t)(x - y) {test} 0 ? -1 : 0);")
+                  for opcode, test in COMPARE_TESTS.items())
+
+class CWriter:
+    # Same interface as CodeWriter, so write_commands/translate_file drive
+    # it unchanged; the assembly-level modes (fused branches, direct moves,
+    # tail calls) have no C counterpart and stay off
+    fuse_branches = False
+    direct_moves = False
+    tail_calls = False
+
+    def __init__(self, output_path, is_sys_init=False, output_file=None):
+        self.output_file = output_file if output_file is not None else open(output_path, "w")
+        self.lines = []
+        self.file_name = ""
+        self.current_function = "OS"
+        # VM label/function name -> C label, and names used / defined
+        self.c_labels = {}
+        self.defined = set()
+        self.used = {}
+        # static symbols -> RAM address, in order of first use
+        self.variables = {}
+        # return site labels; return address 0 halts
+        self.returns = ["halt"]
+        # a label with nothing after it yet, for spotting goto-to-self
+        self.open_label = None
+        if is_sys_init:
+            self.write_init()
+
+    def set_file_name(self, file_name):
+        self.file_name = file_name
+        self.current_function = "OS"
+        self.open_label = None
+
+    def _c_label(self, name):
+        label = self.c_labels.get(name)
+        if label is None:
+            label = self.c_labels[name] = f"L{len(self.c_labels)}"
+        return label
+
+    def _jump(self, name):
+        self.used.setdefault(name, self.current_function)
+        return self._c_label(name)
+
+    def _emit(self, comment, *statements):
+        self.open_label = None
+        self.lines.append(f"    /* {comment} */\n")
+        self.lines.extend(f"    {statement}\n" for statement in statements)
+
+    def _variable(self, symbol):
+        address = self.variables.get(symbol)
+        if address is None:
+            address = self.variables[symbol] = VARIABLE_BASE + len(self.variables)
+        return address
+
+    def _segment(self, segment, index):
+        # C lvalue (or value, for constant) of a segment slot
+        if segment == "constant":
+            return str(index)
+        if segment in SEGMENT_POINTERS:
+            return f"AT(ram[{SEGMENT_POINTERS[segment]}] + {index})"
+        if segment == "temp":
+            return f"ram[{5 + index}]"
+        if segment == "pointer":
+            return f"ram[{3 + index}]"
+        if segment == "static":
+            return f"ram[{self._variable(f'{self.file_name}.{index}')}]"
+        raise ValueError(f"Unknown segment: {segment}")
+
+    def write_init(self):
+        self._emit("bootstrap", "ram[0] = 256;")
+        self.write_call("Sys.init", 0)
+
+    def write_arithmetic(self, command):
+        self._emit(command, ARITHMETIC[command])
+
+    def write_push_pop(self, command_type, segment, index):
+        if command_type == CommandType.PUSH:
+            self._emit(f"push {segment} {index}", f"PUSH({self._segment(segment, index)});")
+        else:
+            if segment == "constant":
+                raise ValueError("Cannot pop to constant")
+            self._emit(f"pop {segment} {index}", f"POP({self._segment(segment, index)});")
+
+    def _full_label(self, label):
+        return f"{self.current_function}${label}" if self.current_function else label
+
+    def write_label(self, label):
+        name = self._full_label(label)
+        if name in self.defined:
+            raise ValueError(f"Duplicate label: {name}")
+        self.defined.add(name)
+        self.lines.append(f"{self._c_label(name)}:; /* label {label} */\n")
+        self.open_label = name
+
+    def write_goto(self, label):
+        name = self._full_label(label)
+        if name == self.open_label:
+            # label X / goto X: the program is done
+            self._emit(f"goto {label}", "goto halt;")
+            return
+        self._emit(f"goto {label}", f"goto {self._jump(name)};")
+
+    def write_if(self, label):
+        name = self._full_label(label)
+        self._emit(f"if-goto {label}", "{ int16_t c; POP(c); if (c) goto " + self._jump(name) + "; }")
+
+    def write_function(self, function_name, n_vars):
+        if function_name in self.defined:
+            raise ValueError(f"Duplicate function: {function_name}")
+        self.defined.add(function_name)
+        self.current_function = function_name
+        self.lines.append(f"{self._c_label(function_name)}:; /* function {function_name} {n_vars} */\n")
+        if n_vars:
+            self._emit("locals", f"for (int i = 0; i < {n_vars}; i++) PUSH(0);")
+        self.open_label = None
+
+    def write_call(self, function_name, n_args):
+        site = len(self.returns)
+        self.returns.append(f"R{site}")
+        self._emit(f"call {function_name} {n_args}",
+                   f"PUSH({site}); PUSH(ram[1]); PUSH(ram[2]); PUSH(ram[3]); PUSH(ram[4]);",
+                   f"ram[2] = ram[0] - {5 + n_args}; ram[1] = ram[0];",
+                   f"goto {self._jump(function_name)};")
+        self.lines.append(f"R{site}:;\n")
+
+    def write_return(self):
+        self._emit("return",
+                   "{ int16_t frame = ram[1]; int16_t address = AT(frame - 5), value;",
+                   "  POP(value); AT(ram[2]) = value; ram[0] = ram[2] + 1;",
+                   "  ram[4] = AT(frame - 1); ram[3] = AT(frame - 2);",
+                   "  ram[2] = AT(frame - 3); ram[1] = AT(frame - 4);",
+                   "  if ((uint16_t)address >= sizeof returns / sizeof *returns) goto halt;",
+                   "  goto *returns[address]; }")
+
+    def close(self):
+        for name, function in self.used.items():
+            if name not in self.defined:
+                raise ValueError(f"Jump to undefined label or function {name} (in {function})")
+        table = ", ".join(f"&&{label}" for label in self.returns)
+        with self.output_file as file:
+            file.write(PRELUDE)
+            file.write(f"    static void *const returns[] = {{{table}}};\n")
+            file.writelines(self.lines)
+            # running off the end of the program halts
+            file.write("    goto halt;\n")
+            file.write(POSTLUDE)
+
+def build_native(c_path, binary_path, cc="cc", flags=("-O2",)):
+    # Compiles the C file with the system compiler; raises
+    # subprocess.CalledProcessError with the compiler's output on failure
+    subprocess.run([cc, *flags, "-o", binary_path, c_path], check=True,
+                   capture_output=True, text=True)
+
+def run_native(binary_path, ram=None):
+    # Runs the binary with RAM preset from {address: value} and returns its
+    # final RAM as array('h')
+    arguments = [f"{address}={value}" for address, value in (ram or {}).items()]
+    result = subprocess.run([binary_path, *arguments], check=True, capture_output=True)
+    words = array("h")
+    words.frombytes(result.stdout)
+    if len(words) != RAM_SIZE:
+        raise ValueError(f"{binary_path} wrote {len(words)} words of RAM, expected {RAM_SIZE}")
+    return words
@@ -1,19 +1,130 @@
 from parser import CommandType
+from output_buffer import OutputBuffer
 import os
 
+# Segments addressed through a base pointer register
+SEGMENT_POINTERS = {"local": "LCL", "argument": "ARG", "this": "THIS", "that": "THAT"}
+# Largest index a cached pop reaches by stepping A instead of spilling D
+MAX_STEPPED_INDEX = 3
+# Largest index reached by A=M+1 / A=A+1 steps from a segment's base
+MAX_DIRECT_INDEX = 2
+# Binary commands a direct move can apply, as D=D<op>A/M
+DIRECT_OPERATORS = {"add": "+", "sub": "-", "and": "&", "or": "|"}
+
+def direct_operand(segment, index):
+    # True when an operand is reachable without going through D
+    return segment not in SEGMENT_POINTERS or index <= MAX_DIRECT_INDEX
+
+# Largest pending SP adjustment before a batched block writes SP back: at
+# 1 every slot is one A=M+1/A=M-1 away from RAM[SP], while each slot further
+# needs an A=A+1 step, which costs more than the SP write it would save
+MAX_SP_OFFSET = 1
+NEGATED_JUMPS = {"eq": "JNE", "gt": "JLE", "lt": "JGE"}
+# Most arguments a tail call moves by direct addressing rather than by
+# walking pointers in R13/R14
+MAX_DIRECT_TAIL_ARGS = 3
+BATCHED_BINARY = {"add": "M=D+M\n", "sub": "M=M-D\n", "and": "M=D&M\n", "or": "M=D|M\n"}
+
+# Counters for instrument: PROFILE_WORDS per function from PROFILE_BASE,
+# in the top PROFILE_SIZE words of the heap, which an instrumented program
+# gives up. Its RAM is then: 0-15 registers, 16-255 statics, 256-2047 the
+# stack, 2048-15359 the heap, 15360-16383 the counters, 16384 on the
+# screen and keyboard. The OS's Memory.vm hands out the heap up to 16383,
+# so main warns when it is among the files instrumented.
+PROFILE_SIZE = 1024
+PROFILE_BASE = 16384 - PROFILE_SIZE
+PROFILE_WORDS = 4
+# Instructions the plain translation spends per command, which instrument
+# adds up into per-function estimates
+ARITHMETIC_COSTS = {"add": 6, "sub": 6, "and": 6, "or": 6, "neg": 3, "not": 3,
+                    "eq": 15, "gt": 15, "lt": 15}
+GOTO_COST = 2
+IF_COST = 5
+CALL_COST = 49
+RETURN_COST = 44
+
+def push_cost(segment):
+    return 10 if segment in SEGMENT_POINTERS else 7
+
+def pop_cost(segment):
+    return 12 if segment in SEGMENT_POINTERS else 5
+
+def function_cost(n_vars):
+    return 0 if n_vars == 0 else 4 if n_vars == 1 else 2 * n_vars + 4
+
 class CodeWriter:
-    def __init__(self, output_path, append=False, is_sys_init=False):
-        self.file = open(output_path, 'a' if append else 'w')
+    def __init__(self, output_path, append=False, is_sys_init=False, shared_calls=False,
+                 shared_compare=False, optimizer=None, flush_threshold=None, output_file=None,
+                 cache_top=False, batch_sp=False, fuse_branches=False, direct_moves=False,
+                 zero_loop_threshold=None, tail_calls=False, instrument=False):
+        if output_file is None:
+            output_file = open(output_path, 'a' if append else 'w')
+        self.file = OutputBuffer(output_file,
+                                 flush_threshold=flush_threshold,
+                                 optimizer=optimizer)
         self.file_name = ""
         self.label_counter = 0
         self.current_function = "OS"
         self.return_counter = 0
+        self.shared_calls = shared_calls
+        self.shared_compare = shared_compare
+        # Without a bootstrap the shared routines go at the end, if needed
+        self.is_standalone = not append and not is_sys_init
+        self.needs_call_routines = False
+        self.needs_compare_routines = False
+        # Functions with at least this many locals zero them with the shared
+        # $$ZERO loop (smaller, slower); None always zeroes them inline
+        self.zero_loop_threshold = zero_loop_threshold
+        self.needs_zero_routine = False
+        # Lets write_commands hand over call + return as a tail call, which
+        # reuses the current frame through the shared $$TAIL routine
+        self.tail_calls = tail_calls
+        self.needs_tail_routine = False
+        # With cache_top the stack's top value may live in D instead of
+        # RAM[SP-1] (top_in_d), within a straight-line run of commands
+        self.cache_top = cache_top
+        self.top_in_d = False
+        # With batch_sp pushes and pops address slots relative to RAM[SP] and
+        # SP itself is written once per basic block; sp_offset is the
+        # adjustment still pending, counted in sp_adjustments/sp_writes
+        self.batch_sp = batch_sp
+        if batch_sp and optimizer is not None:
+            # slots above SP can be live while an adjustment is pending
+            optimizer.disable("dead_store")
+        self.sp_offset = 0
+        self.sp_adjustments = 0
+        self.sp_writes = 0
+        # Lets write_commands hand over comparisons that feed an if-goto
+        self.fuse_branches = fuse_branches
+        # ...and push/pop pairs (direct moves), which also switches plain
+        # pushes and pops to the short forms for small indices
+        self.direct_moves = direct_moves
+        # With instrument each function's counters (profile_slots: name ->
+        # address) hold its calls, then the estimated instructions run in
+        # it, each as a low word of 15 bits and a high word. block_cost is
+        # the estimate for the straight-line code since the last count,
+        # added to the counter before every jump and label.
+        self.instrument = instrument
+        self.profile_slots = {}
+        self.block_cost = 0
+        self.count_labels = 0
+        # label with nothing after it yet, so label X / goto X (where a
+        # program parks) stays a bare idle loop
+        self.open_label = None
 
         if not append and is_sys_init:
             self.write_init()
 
     def set_file_name(self, file_name: str):
+        # Each file starts from the same state and its labels are scoped by
+        # file or function, so files translate the same in any order
+        self._count(0)
+        self._end_block()
+        self.file.end_section()
         self.file_name = file_name
+        self.label_counter = 0
+        self.current_function = "OS"
+        self.return_counter = 0
 
     def write_init(self):
         self.file.write("// Bootstrap code\n")
@@ -26,15 +137,30 @@ class CodeWriter:
         self.write_function("OS", 0)
         self.write_call("Sys.init", 0)
 
+        if self.shared_calls:
+            self._write_call_routines()
+        if self.shared_compare:
+            self._write_compare_routines()
+        if self.zero_loop_threshold is not None:
+            self._write_zero_routine()
+        if self.tail_calls:
+            self._write_tail_routine()
+
     def write_label(self, label):
         # assembly for label
         full_label = f"{self.current_function}${label}" if self.current_function else label
+        self._count(0)
+        self._end_block()
         self.file.write(f"// label {label}\n")
         self.file.write(f"({full_label})\n")
+        self.open_label = full_label
     
     def write_goto(self, label):
         # assembly for goto
         full_label = f"{self.current_function}${label}" if self.current_function else label
+        if full_label != self.open_label or self.block_cost:
+            self._count(GOTO_COST)
+        self._end_block()
         self.file.write(f"// goto {label}\n")
         self.file.write(f"@{full_label}\n")
         self.file.write("0;JMP\n")
@@ -42,31 +168,149 @@ class CodeWriter:
     def write_if(self, label):
         # assembly for if-goto
         full_label = f"{self.current_function}${label}" if self.current_function else label
+        self._count(IF_COST)
         self.file.write(f"// if-goto {label}\n")
 
+        if self.cache_top or self.batch_sp:
+            if self.top_in_d:
+                self.top_in_d = False
+                self._flush_sp()
+            else:
+                self._pop_to_d()
+            self.file.write(f"@{full_label}\n")
+            self.file.write("D;JNE\n")
+            return
+
         self.file.write("@SP\n")
         self.file.write("AM=M-1\n")
         self.file.write("D=M\n")
         self.file.write(f"@{full_label}\n")
         self.file.write("D;JNE\n")
 
+    def write_compare_branch(self, command, label, negate=False):
+        # eq/gt/lt (or not) followed by if-goto, as one conditional jump on
+        # x - y; negate is set for eq/gt/lt + not + if-goto
+        full_label = f"{self.current_function}${label}" if self.current_function else label
+        self._count(ARITHMETIC_COSTS[command] + (ARITHMETIC_COSTS["not"] if negate else 0) + IF_COST)
+        self.file.write(f"// {command}{' + not' if negate else ''} + if-goto {label}\n")
+
+        self._load_top()
+        if command == "not":
+            # !x is nonzero unless x is -1
+            self.file.write("D=D+1\n")
+            jump = "JNE"
+        else:
+            if self.batch_sp:
+                self._stack_slot(-1)
+                self._adjust_sp(-1)
+            else:
+                self.file.write("@SP\n")
+                self.file.write("AM=M-1\n")
+            self.file.write("D=M-D\n")
+            jump = NEGATED_JUMPS[command] if negate else f"J{command.upper()}"
+        self.top_in_d = False
+        self._flush_sp()
+        self.file.write(f"@{full_label}\n")
+        self.file.write(f"D;{jump}\n")
+
+    def write_push_branch(self, segment, index, label):
+        # push followed by if-goto: the value never needs to reach the stack
+        full_label = f"{self.current_function}${label}" if self.current_function else label
+        self._count(push_cost(segment) + IF_COST)
+        self.file.write(f"// push {segment} {index} + if-goto {label}\n")
+        self._spill_top()
+        self._write_load_d(segment, index)
+        self._flush_sp()
+        self.file.write(f"@{full_label}\n")
+        self.file.write("D;JNE\n")
+
     def write_function(self, function_name, n_vars):
         # assembly for function
+        self._count(0)
+        self._end_block()
         self.current_function = function_name
         self.file.write(f"// function {function_name} {n_vars}\n")
         self.file.write(f"({function_name})\n")
-        
-        for _ in range(int(n_vars)):
-            self.file.write("@0\n")
+        self.open_label = None
+
+        n_vars = int(n_vars)
+        if self.instrument:
+            self._write_count(self._profile_address(function_name), 1)
+            self.block_cost += function_cost(n_vars)
+        if n_vars == 0:
+            return
+        if self.zero_loop_threshold is not None and n_vars >= self.zero_loop_threshold:
+            # D = count, R14 = return address
+            self.needs_zero_routine = True
+            self.file.write(f"@{function_name}$zero\n")
             self.file.write("D=A\n")
-            self._push_d_to_stack()
+            self.file.write("@R14\n")
+            self.file.write("M=D\n")
+            self.file.write(f"@{n_vars}\n")
+            self.file.write("D=A\n")
+            self.file.write("@$$ZERO\n")
+            self.file.write("0;JMP\n")
+            self.file.write(f"({function_name}$zero)\n")
+        elif n_vars == 1:
+            self.file.write("@SP\n")
+            self.file.write("M=M+1\n")
+            self.file.write("A=M-1\n")
+            self.file.write("M=0\n")
+        else:
+            # Zero the slots in place, then move SP past them once
+            self.file.write("@SP\n")
+            self.file.write("A=M\n")
+            self.file.write("M=0\n")
+            for _ in range(n_vars - 1):
+                self.file.write("A=A+1\n")
+                self.file.write("M=0\n")
+            self.file.write("D=A+1\n")
+            self.file.write("@SP\n")
+            self.file.write("M=D\n")
+
+    def _write_zero_routine(self):
+        # pushes D zeros, then returns to R14
+        self.file.write("// shared local initialization loop\n")
+        self.file.write("($$ZERO)\n")
+        self.file.write("@SP\n")
+        self.file.write("AM=M+1\n")
+        self.file.write("A=A-1\n")
+        self.file.write("M=0\n")
+        self.file.write("D=D-1\n")
+        self.file.write("@$$ZERO\n")
+        self.file.write("D;JGT\n")
+        self.file.write("@R14\n")
+        self.file.write("A=M\n")
+        self.file.write("0;JMP\n")
 
     def write_call(self, function_name, n_args):
         # assembly for call
         return_label = f"{self.current_function}$ret.{self.return_counter}"
         self.return_counter += 1
+        self._count(CALL_COST)
+        self._end_block()
         
         self.file.write(f"// call {function_name} {n_args}\n")
+
+        if self.shared_calls:
+            self.needs_call_routines = True
+            # R13 = target, R14 = nArgs, R15 = return address
+            self.file.write(f"@{function_name}\n")
+            self.file.write("D=A\n")
+            self.file.write("@R13\n")
+            self.file.write("M=D\n")
+            self.file.write(f"@{n_args}\n")
+            self.file.write("D=A\n")
+            self.file.write("@R14\n")
+            self.file.write("M=D\n")
+            self.file.write(f"@{return_label}\n")
+            self.file.write("D=A\n")
+            self.file.write("@R15\n")
+            self.file.write("M=D\n")
+            self.file.write("@$$CALL\n")
+            self.file.write("0;JMP\n")
+            self.file.write(f"({return_label})\n")
+            return
         
         self.file.write(f"@{return_label}\n")
         self.file.write("D=A\n")
@@ -96,10 +340,182 @@ class CodeWriter:
     
         self.file.write(f"({return_label})\n")
 
+    def write_tail_call(self, function_name, n_args):
+        # call directly followed by return. When this function got n_args
+        # arguments as well (LCL - ARG = n_args + 5) its frame can stay put:
+        # the new arguments replace the old ones and SP drops back to LCL.
+        # Otherwise the shared $$TAIL routine moves the frame too.
+        self._count(CALL_COST + RETURN_COST)
+        self._end_block()
+        self.needs_tail_routine = True
+        moved_label = f"{self.current_function}$tail.{self.return_counter}"
+        self.return_counter += 1
+        self.file.write(f"// call {function_name} {n_args} + return\n")
+        self.file.write("@LCL\n")
+        self.file.write("D=M\n")
+        self.file.write("@ARG\n")
+        self.file.write("D=D-M\n")
+        self.file.write(f"@{n_args + 5}\n")
+        self.file.write("D=D-A\n")
+        self.file.write(f"@{moved_label}\n")
+        self.file.write("D;JNE\n")
+        if n_args > MAX_DIRECT_TAIL_ARGS:
+            # R13 walks the new arguments, R14 the old ones
+            self.file.write("@SP\n")
+            self.file.write("D=M\n")
+            self.file.write(f"@{n_args}\n")
+            self.file.write("D=D-A\n")
+            self.file.write("@R13\n")
+            self.file.write("M=D\n")
+            self.file.write("@ARG\n")
+            self.file.write("D=M\n")
+            self.file.write("@R14\n")
+            self.file.write("M=D\n")
+        for i in range(n_args):
+            if n_args > MAX_DIRECT_TAIL_ARGS:
+                self.file.write("@R13\n")
+                self.file.write("AM=M+1\n")
+                self.file.write("A=A-1\n")
+                self.file.write("D=M\n")
+                self.file.write("@R14\n")
+                self.file.write("AM=M+1\n")
+                self.file.write("A=A-1\n")
+                self.file.write("M=D\n")
+                continue
+            self.file.write("@SP\n")
+            if i == n_args - 1:
+                self.file.write("A=M-1\n")
+            else:
+                self.file.write("D=M\n")
+                self.file.write(f"@{n_args - i}\n")
+                self.file.write("A=D-A\n")
+            self.file.write("D=M\n")
+            self.file.write("@ARG\n")
+            self.file.write("A=M\n" if i == 0 else "A=M+1\n")
+            for _ in range(i - 1):
+                self.file.write("A=A+1\n")
+            self.file.write("M=D\n")
+        self.file.write("@LCL\n")
+        self.file.write("D=M\n")
+        self.file.write("@SP\n")
+        self.file.write("M=D\n")
+        self.file.write(f"@{function_name}\n")
+        self.file.write("0;JMP\n")
+
+        # R13 = target, R14 = nArgs
+        self.file.write(f"({moved_label})\n")
+        self.file.write(f"@{function_name}\n")
+        self.file.write("D=A\n")
+        self.file.write("@R13\n")
+        self.file.write("M=D\n")
+        self.file.write(f"@{n_args}\n")
+        self.file.write("D=A\n")
+        self.file.write("@R14\n")
+        self.file.write("M=D\n")
+        self.file.write("@$$TAIL\n")
+        self.file.write("0;JMP\n")
+
+    def _write_tail_routine(self):
+        # Replaces the current frame with the callee's: the new arguments and
+        # this frame's saved return address/LCL/ARG/THIS/THAT are stacked
+        # together, then slid down to ARG. THIS and THAT stay as they are.
+        self.file.write("// shared tail call routine\n")
+        self.file.write("($$TAIL)\n")
+        for offset in range(5, 0, -1):
+            self.file.write("@LCL\n")
+            self.file.write("D=M\n")
+            self.file.write(f"@{offset}\n")
+            self.file.write("A=D-A\n")
+            self.file.write("D=M\n")
+            self._push_d_to_stack()
+
+        # R14 = words to move, R15 = source; SP walks the destination
+        self.file.write("@R14\n")
+        self.file.write("D=M\n")
+        self.file.write("@5\n")
+        self.file.write("D=D+A\n")
+        self.file.write("@R14\n")
+        self.file.write("M=D\n")
+        self.file.write("@SP\n")
+        self.file.write("D=M\n")
+        self.file.write("@R14\n")
+        self.file.write("D=D-M\n")
+        self.file.write("@R15\n")
+        self.file.write("M=D\n")
+        self.file.write("@ARG\n")
+        self.file.write("D=M\n")
+        self.file.write("@SP\n")
+        self.file.write("M=D\n")
+        self.file.write("($$TAIL_LOOP)\n")
+        self.file.write("@R15\n")
+        self.file.write("M=M+1\n")
+        self.file.write("A=M-1\n")
+        self.file.write("D=M\n")
+        self._push_d_to_stack()
+        self.file.write("@R14\n")
+        self.file.write("MD=M-1\n")
+        self.file.write("@$$TAIL_LOOP\n")
+        self.file.write("D;JGT\n")
+
+        # ARG is unchanged; the callee's locals start right after its frame
+        self.file.write("@SP\n")
+        self.file.write("D=M\n")
+        self.file.write("@LCL\n")
+        self.file.write("M=D\n")
+        self.file.write("@R13\n")
+        self.file.write("A=M\n")
+        self.file.write("0;JMP\n")
+
     def write_return(self):
         # assembly for return
+        self._count(RETURN_COST)
+        self._end_block()
         self.file.write("// return\n")
-    
+
+        if self.shared_calls:
+            self.needs_call_routines = True
+            self.file.write("@$$RETURN\n")
+            self.file.write("0;JMP\n")
+            return
+
+        self._write_return_body()
+
+    def _write_call_routines(self):
+        # shared frame protocol, entered from every call/return site
+        self.file.write("// shared call routine\n")
+        self.file.write("($$CALL)\n")
+        self.file.write("@R15\n")
+        self.file.write("D=M\n")
+        self._push_d_to_stack()
+
+        for segment in ["LCL", "ARG", "THIS", "THAT"]:
+            self.file.write(f"@{segment}\n")
+            self.file.write("D=M\n")
+            self._push_d_to_stack()
+
+        self.file.write("@SP\n")
+        self.file.write("D=M\n")
+        self.file.write("@5\n")
+        self.file.write("D=D-A\n")
+        self.file.write("@R14\n")
+        self.file.write("D=D-M\n")
+        self.file.write("@ARG\n")
+        self.file.write("M=D\n")
+
+        self.file.write("@SP\n")
+        self.file.write("D=M\n")
+        self.file.write("@LCL\n")
+        self.file.write("M=D\n")
+
+        self.file.write("@R13\n")
+        self.file.write("A=M\n")
+        self.file.write("0;JMP\n")
+
+        self.file.write("// shared return routine\n")
+        self.file.write("($$RETURN)\n")
+        self._write_return_body()
+
+    def _write_return_body(self):
         self.file.write("@LCL\n")
         self.file.write("D=M\n")
         self.file.write("@R13\n")
@@ -153,6 +569,332 @@ class CodeWriter:
         self.file.write("A=M\n")
         self.file.write("0;JMP\n")
 
+    def _profile_address(self, function_name):
+        # the function's counters, allocated in order of first use
+        address = self.profile_slots.get(function_name)
+        if address is None:
+            address = PROFILE_BASE + PROFILE_WORDS * len(self.profile_slots)
+            if address + PROFILE_WORDS > PROFILE_BASE + PROFILE_SIZE:
+                raise ValueError(f"Too many functions to instrument (at most {PROFILE_SIZE // PROFILE_WORDS})")
+            self.profile_slots[function_name] = address
+        return address
+
+    def _write_count(self, address, amount):
+        # adds amount to the counter at address; the low word wrapping
+        # negative carries its top bit into the high word
+        label = f"$$COUNT.{self.count_labels}"
+        self.count_labels += 1
+        if amount == 1:
+            self.file.write(f"@{address}\n")
+            self.file.write("MD=M+1\n")
+        else:
+            self.file.write(f"@{amount}\n")
+            self.file.write("D=A\n")
+            self.file.write(f"@{address}\n")
+            self.file.write("MD=D+M\n")
+        self.file.write(f"@{label}\n")
+        self.file.write("D;JGE\n")
+        self.file.write("@32767\n")
+        self.file.write("D=A\n")
+        self.file.write(f"@{address}\n")
+        self.file.write("M=D&M\n")
+        self.file.write(f"@{address + 1}\n")
+        self.file.write("M=M+1\n")
+        self.file.write(f"({label})\n")
+
+    def _count(self, cost):
+        # before a jump or label: adds cost and the straight-line code
+        # before it to the current function's instruction counter
+        if not self.instrument:
+            return
+        self.block_cost += cost
+        if self.block_cost:
+            self._end_block()
+            self.file.write("// count instructions\n")
+            self._write_count(self._profile_address(self.current_function) + 2, self.block_cost)
+            self.block_cost = 0
+        self.open_label = None
+
+    def _end_block(self):
+        # leaves the stack entirely in memory, with SP up to date
+        self._spill_top()
+        self._flush_sp()
+
+    def _stack_slot(self, depth):
+        # points A at the slot depth places from the stack top (-1 is the
+        # top itself), stepping from RAM[SP] past the pending offset
+        offset = self.sp_offset + depth
+        if abs(offset) > MAX_SP_OFFSET:
+            self._flush_sp()
+            offset = depth
+        self.file.write("@SP\n")
+        if offset == 0:
+            self.file.write("A=M\n")
+            return
+        self.file.write("A=M+1\n" if offset > 0 else "A=M-1\n")
+        for _ in range(abs(offset) - 1):
+            self.file.write("A=A+1\n" if offset > 0 else "A=A-1\n")
+
+    def _adjust_sp(self, delta):
+        self.sp_offset += delta
+        self.sp_adjustments += 1
+
+    def _flush_sp(self):
+        # writes the pending adjustment back to SP, leaving D untouched
+        if self.sp_offset == 0:
+            return
+        self.file.write("@SP\n")
+        for _ in range(abs(self.sp_offset)):
+            self.file.write("M=M+1\n" if self.sp_offset > 0 else "M=M-1\n")
+        self.sp_offset = 0
+        self.sp_writes += 1
+
+    def _pop_to_d(self):
+        # pops the top into D and brings SP up to date in the same step
+        offset = self.sp_offset - 1
+        self.sp_offset = 0
+        self.sp_adjustments += 1
+        self.file.write("@SP\n")
+        if offset == 0:
+            self.file.write("A=M\n")
+        else:
+            self.sp_writes += 1
+            for _ in range(abs(offset) - 1):
+                self.file.write("M=M+1\n" if offset > 0 else "M=M-1\n")
+            self.file.write("AM=M+1\n" if offset > 0 else "AM=M-1\n")
+        self.file.write("D=M\n")
+
+    def _spill_top(self):
+        # writes a top value cached in D back to the stack
+        if not self.top_in_d:
+            return
+        self.top_in_d = False
+        if self.batch_sp:
+            self._stack_slot(0)
+            self.file.write("M=D\n")
+            self._adjust_sp(1)
+            return
+        self.file.write("@SP\n")
+        self.file.write("M=M+1\n")
+        self.file.write("A=M-1\n")
+        self.file.write("M=D\n")
+
+    def _load_top(self):
+        # pops the stack's top value into D unless it is already there
+        if self.top_in_d:
+            return
+        self.top_in_d = True
+        if self.batch_sp:
+            self._stack_slot(-1)
+            self.file.write("D=M\n")
+            self._adjust_sp(-1)
+            return
+        self.file.write("@SP\n")
+        self.file.write("AM=M-1\n")
+        self.file.write("D=M\n")
+
+    def _segment_address(self, segment, index):
+        # symbol or register of a fixed-address segment slot
+        if segment == "static":
+            return f"{self.file_name}.{index}"
+        if segment == "pointer":
+            return str(3 + int(index))
+        return str(5 + int(index))
+
+    def _write_cached_push(self, segment, index):
+        self._spill_top()
+        self.top_in_d = True
+        self.file.write(f"// push {segment} {index}\n")
+        self._write_load_d(segment, index)
+
+    def _write_batched_push(self, segment, index):
+        self.file.write(f"// push {segment} {index}\n")
+        self._write_load_d(segment, index)
+        self._stack_slot(0)
+        self.file.write("M=D\n")
+        self._adjust_sp(1)
+
+    def _write_load_d(self, segment, index):
+        # D = the segment slot's value
+        if segment == "constant":
+            self.file.write(f"@{index}\n")
+            self.file.write("D=A\n")
+        elif segment in SEGMENT_POINTERS:
+            if index <= MAX_DIRECT_INDEX:
+                self._point_at(segment, index)
+            else:
+                self.file.write(f"@{SEGMENT_POINTERS[segment]}\n")
+                self.file.write("D=M\n")
+                self.file.write(f"@{index}\n")
+                self.file.write("A=D+A\n")
+            self.file.write("D=M\n")
+        else:
+            self.file.write(f"@{self._segment_address(segment, index)}\n")
+            self.file.write("D=M\n")
+
+    def _write_cached_pop(self, segment, index):
+        self._load_top()
+        self.top_in_d = False
+        self.file.write(f"// pop {segment} {index}\n")
+        self._write_store_d(segment, index)
+
+    def _write_batched_pop(self, segment, index):
+        self.file.write(f"// pop {segment} {index}\n")
+        self._stack_slot(-1)
+        self.file.write("D=M\n")
+        self._adjust_sp(-1)
+        self._write_store_d(segment, index)
+
+    def _write_store_d(self, segment, index):
+        # the segment slot = D
+        if segment not in SEGMENT_POINTERS:
+            self.file.write(f"@{self._segment_address(segment, index)}\n")
+            self.file.write("M=D\n")
+        elif index <= MAX_DIRECT_INDEX:
+            self._point_at(segment, index)
+            self.file.write("M=D\n")
+        elif index <= MAX_STEPPED_INDEX:
+            # D = value + address, then step A to the address and take it
+            # back off, so the value never needs a scratch register
+            base = SEGMENT_POINTERS[segment]
+            self.file.write(f"@{base}\n")
+            self.file.write("D=D+M\n")
+            if index > 0:
+                self.file.write(f"@{index}\n")
+                self.file.write("D=D+A\n")
+            self.file.write(f"@{base}\n")
+            self.file.write("A=M\n")
+            for _ in range(index):
+                self.file.write("A=A+1\n")
+            self.file.write("D=D-A\n")
+            self.file.write("M=D\n")
+        else:
+            self.file.write("@R13\n")
+            self.file.write("M=D\n")
+            self.file.write(f"@{SEGMENT_POINTERS[segment]}\n")
+            self.file.write("D=M\n")
+            self.file.write(f"@{index}\n")
+            self.file.write("D=D+A\n")
+            self.file.write("@R14\n")
+            self.file.write("M=D\n")
+            self.file.write("@R13\n")
+            self.file.write("D=M\n")
+            self.file.write("@R14\n")
+            self.file.write("A=M\n")
+            self.file.write("M=D\n")
+
+    def _point_at(self, segment, index):
+        # A = address of a slot close to its segment's base, leaving D alone
+        self.file.write(f"@{SEGMENT_POINTERS[segment]}\n")
+        self.file.write("A=M\n" if index == 0 else "A=M+1\n")
+        for _ in range(index - 1):
+            self.file.write("A=A+1\n")
+
+    def _write_operand(self, command, segment, index):
+        # D = D <op> the slot's value, for an operand direct_operand accepts
+        if segment == "constant":
+            self.file.write(f"@{index}\n")
+            operand = "A"
+        else:
+            if segment in SEGMENT_POINTERS:
+                self._point_at(segment, index)
+            else:
+                self.file.write(f"@{self._segment_address(segment, index)}\n")
+            operand = "M"
+        self.file.write(f"D=D{DIRECT_OPERATORS[command]}{operand}\n")
+
+    def write_move(self, source, destination):
+        # push/pop pair as a memory-to-memory copy through D; source and
+        # destination are (segment, index)
+        if self.instrument:
+            self.block_cost += push_cost(source[0]) + pop_cost(destination[0])
+        self.file.write(f"// push {source[0]} {source[1]} + pop {destination[0]} {destination[1]}\n")
+        self._spill_top()
+        self._write_load_d(*source)
+        self._write_store_d(*destination)
+
+    def write_binary_move(self, left, right, command, destination):
+        # push/push/op/pop; the right operand must pass direct_operand
+        if self.instrument:
+            self.block_cost += (push_cost(left[0]) + push_cost(right[0]) + ARITHMETIC_COSTS[command]
+                                + pop_cost(destination[0]))
+        self.file.write(f"// push {left[0]} {left[1]} + push {right[0]} {right[1]} + {command}"
+                        f" + pop {destination[0]} {destination[1]}\n")
+        self._spill_top()
+        self._write_load_d(*left)
+        self._write_operand(command, *right)
+        self._write_store_d(*destination)
+
+    def _write_cached_arithmetic(self, command):
+        # y is in D (loaded if need be), x at RAM[SP-1]; the result stays in D
+        self._load_top()
+        self.file.write(f"// {command}\n")
+        if command in ['neg', 'not']:
+            self.file.write("D=-D\n" if command == "neg" else "D=!D\n")
+            return
+
+        if self.batch_sp:
+            self._stack_slot(-1)
+            self._adjust_sp(-1)
+        else:
+            self.file.write("@SP\n")
+            self.file.write("AM=M-1\n")
+        if command == "add":
+            self.file.write("D=D+M\n")
+        elif command == "sub":
+            self.file.write("D=M-D\n")
+        elif command == "and":
+            self.file.write("D=D&M\n")
+        elif command == "or":
+            self.file.write("D=D|M\n")
+        else:
+            label = f"{self.file_name}.{command.upper()}_{self.label_counter}"
+            self.label_counter += 1
+            self.file.write("D=M-D\n")
+            self.file.write(f"@{label}_TRUE\n")
+            self.file.write(f"D;J{command.upper()}\n")
+            self.file.write("D=0\n")
+            self.file.write(f"@{label}_END\n")
+            self.file.write("0;JMP\n")
+            self.file.write(f"({label}_TRUE)\n")
+            self.file.write("D=-1\n")
+            self.file.write(f"({label}_END)\n")
+
+    def _write_batched_arithmetic(self, command):
+        # operands are addressed relative to RAM[SP]; the result stays in memory
+        self.file.write(f"// {command}\n")
+        if command in ['neg', 'not']:
+            self._stack_slot(-1)
+            self.file.write("M=-M\n" if command == "neg" else "M=!M\n")
+            return
+
+        if command in ['add', 'sub', 'and', 'or']:
+            self._stack_slot(-1)
+            self.file.write("D=M\n")
+            self.file.write("A=A-1\n")
+            self.file.write(BATCHED_BINARY[command])
+            self._adjust_sp(-1)
+            return
+
+        label = f"{self.file_name}.{command.upper()}_{self.label_counter}"
+        self.label_counter += 1
+        # x first, so the result slot is already within reach of SP
+        self._stack_slot(-2)
+        self.file.write("D=M\n")
+        self.file.write("A=A+1\n")
+        self.file.write("D=D-M\n")
+        self._adjust_sp(-1)
+        self.file.write(f"@{label}_TRUE\n")
+        self.file.write(f"D;J{command.upper()}\n")
+        self.file.write("D=0\n")
+        self.file.write(f"@{label}_END\n")
+        self.file.write("0;JMP\n")
+        self.file.write(f"({label}_TRUE)\n")
+        self.file.write("D=-1\n")
+        self.file.write(f"({label}_END)\n")
+        self._stack_slot(-1)
+        self.file.write("M=D\n")
+
     def _push_d_to_stack(self):
         # push D register to stack
         self.file.write("@SP\n")
@@ -162,7 +904,17 @@ class CodeWriter:
         self.file.write("M=M+1\n")
 
     def write_arithmetic(self, command):
-        if command in ['add', 'sub', 'and', 'or']:
+        if self.instrument:
+            self.block_cost += ARITHMETIC_COSTS[command]
+        if self.shared_compare and command in ['eq', 'gt', 'lt']:
+            # the shared routines work on the stack in memory
+            self._end_block()
+            self._write_comparison(command)
+        elif self.cache_top:
+            self._write_cached_arithmetic(command)
+        elif self.batch_sp:
+            self._write_batched_arithmetic(command)
+        elif command in ['add', 'sub', 'and', 'or']:
             self._write_binary_operation(command)
         elif command in ['neg', 'not']:
             self._write_unary_operation(command)
@@ -170,7 +922,29 @@ class CodeWriter:
             self._write_comparison(command)
 
     def write_push_pop(self, command_type: CommandType, segment, index):
-        if command_type == CommandType.PUSH:
+        if self.instrument:
+            self.block_cost += push_cost(segment) if command_type == CommandType.PUSH else pop_cost(segment)
+        if self.cache_top:
+            if command_type == CommandType.PUSH:
+                self._write_cached_push(segment, index)
+            elif command_type == CommandType.POP:
+                self._write_cached_pop(segment, index)
+        elif self.batch_sp:
+            if command_type == CommandType.PUSH:
+                self._write_batched_push(segment, index)
+            elif command_type == CommandType.POP:
+                self._write_batched_pop(segment, index)
+        elif self.direct_moves and segment != "constant":
+            self.file.write(f"// {command_type.name.lower()} {segment} {index}\n")
+            if command_type == CommandType.PUSH:
+                self._write_load_d(segment, index)
+                self._push_d_to_stack()
+            elif command_type == CommandType.POP:
+                self.file.write("@SP\n")
+                self.file.write("AM=M-1\n")
+                self.file.write("D=M\n")
+                self._write_store_d(segment, index)
+        elif command_type == CommandType.PUSH:
             if segment == "constant":
                 self._write_push_constant(index)
             else:
@@ -179,6 +953,22 @@ class CodeWriter:
             self._write_pop(segment, index)
 
     def close(self):
+        self._count(0)
+        self._end_block()
+        if self.is_standalone and (self.needs_call_routines or self.needs_compare_routines
+                                   or self.needs_zero_routine or self.needs_tail_routine):
+            # Keep the program from falling through into the routines
+            self.file.write("@$$END\n")
+            self.file.write("0;JMP\n")
+            if self.needs_call_routines:
+                self._write_call_routines()
+            if self.needs_compare_routines:
+                self._write_compare_routines()
+            if self.needs_zero_routine:
+                self._write_zero_routine()
+            if self.needs_tail_routine:
+                self._write_tail_routine()
+            self.file.write("($$END)\n")
         self.file.close()
 
     def _write_push_constant(self, value):
@@ -218,10 +1008,23 @@ class CodeWriter:
             self.file.write("M=!M\n")
 
     def _write_comparison(self, command):
-        label = f"{command.upper()}_{self.label_counter}"
+        label = f"{self.file_name}.{command.upper()}_{self.label_counter}"
         self.label_counter += 1
         
         self.file.write(f"// {command}\n")
+
+        if self.shared_compare:
+            # R15 = return address
+            self.needs_compare_routines = True
+            self.file.write(f"@{label}_RET\n")
+            self.file.write("D=A\n")
+            self.file.write("@R15\n")
+            self.file.write("M=D\n")
+            self.file.write(f"@$${command.upper()}\n")
+            self.file.write("0;JMP\n")
+            self.file.write(f"({label}_RET)\n")
+            return
+
         self.file.write("@SP\n")
         self.file.write("AM=M-1\n")
         self.file.write("D=M\n")
@@ -247,6 +1050,37 @@ class CodeWriter:
         self.file.write("M=-1\n")
         self.file.write(f"({label}_END)\n")
 
+    def _write_compare_routines(self):
+        # one routine per comparison kind, sharing the true/false tails
+        self.file.write("// shared comparison routines\n")
+        for command in ["eq", "gt", "lt"]:
+            self.file.write(f"($${command.upper()})\n")
+            self.file.write("@SP\n")
+            self.file.write("AM=M-1\n")
+            self.file.write("D=M\n")
+            self.file.write("A=A-1\n")
+            self.file.write("D=M-D\n")
+            self.file.write("@$$TRUE\n")
+            self.file.write(f"D;J{command.upper()}\n")
+            if command != "lt":
+                self.file.write("@$$FALSE\n")
+                self.file.write("0;JMP\n")
+
+        self.file.write("($$FALSE)\n")
+        self.file.write("@SP\n")
+        self.file.write("A=M-1\n")
+        self.file.write("M=0\n")
+        self.file.write("@R15\n")
+        self.file.write("A=M\n")
+        self.file.write("0;JMP\n")
+        self.file.write("($$TRUE)\n")
+        self.file.write("@SP\n")
+        self.file.write("A=M-1\n")
+        self.file.write("M=-1\n")
+        self.file.write("@R15\n")
+        self.file.write("A=M\n")
+        self.file.write("0;JMP\n")
+
     def _write_pop(self, segment, index):
         if segment == "static":
             self.file.write(f"// pop static {index}\n")
@@ -0,0 +1,363 @@
+import argparse
+import os
+import re
+import sys
+import time
+from array import array
+from assembler import COMP, HackAssembler
+
+# The Hack CPU in Python. Instead of decoding every instruction on every
+# step, each basic block (straight-line code up to and including its first
+# jump) is compiled into a Python function the first time it runs; the
+# table of those functions, indexed by pc, is the dispatch table. A block
+# takes (A, D), runs and returns (next pc, A, D), and costs one cycle per
+# instruction.
+
+RAM_SIZE = 32768
+ROM_SIZE = 32768
+# Straight-line code is split into blocks of at most this many instructions
+MAX_BLOCK = 256
+
+# comp bits (a + c1..c6) to the expression over A, D and M
+COMP_EXPRESSIONS = {int(bits, 2): comp.replace("!", "~") for comp, bits in COMP.items()}
+CONSTANT_COMPS = {"0": 0, "1": 1, "-1": -1}
+JUMP_CONDITIONS = {1: "> 0", 2: "== 0", 3: ">= 0", 4: "< 0", 5: "!= 0", 6: "<= 0"}
+
+def _needs_wrap(comp):
+    # & | ~ of 16-bit values stay 16-bit; + and - can overflow
+    return comp not in ("-1",) and ("+" in comp or "-" in comp)
+
+def load_program(path):
+    # Machine code from a .asm (assembled in-process) or a .hack file
+    if path.endswith(".asm"):
+        assembler = HackAssembler(None)
+        with open(path, "r") as file:
+            assembler.write(file.read())
+        return assembler.resolve()
+    if path.endswith(".hack"):
+        with open(path, "r") as file:
+            return array("H", [int(line, 2) for line in file.read().split()])
+    raise ValueError(f"Cannot load {path}: expected a .asm or .hack file")
+
+class HackEmulator:
+    def __init__(self, words):
+        if len(words) > ROM_SIZE:
+            raise ValueError(f"Program of {len(words)} instructions does not fit in ROM")
+        self.rom = array("h", array("H", words).tobytes())
+        # addresses use 15 bits of A; a negative A indexes from the end of
+        # the array, which is the same word
+        self.ram = array("h", bytes(2 * RAM_SIZE))
+        # RAM written so far, and the highest value written to SP
+        self.touched = bytearray(RAM_SIZE)
+        self.peak_sp = [0]
+        self.pc = 0
+        self.a = 0
+        self.d = 0
+        self.cycles = 0
+        # pcs that end a block, so run can stop there
+        self.breakpoints = set()
+        self._reset_blocks()
+
+    def _reset_blocks(self):
+        self.blocks = [None] * ROM_SIZE
+        self.sizes = [0] * ROM_SIZE
+        # blocks of the form (X) @X 0;JMP, where a program parks when done
+        self.idle = set()
+
+    def _compile(self, start, limit=MAX_BLOCK):
+        # Returns (function, instructions, RAM addresses it always writes)
+        rom = self.rom
+        end = len(rom)
+        lines = []
+        # A while it holds a known constant; None once it is computed
+        a = None
+        static_writes = set()
+        exit_pc = None
+        pc = start
+        while pc < end and pc - start < limit and exit_pc is None:
+            if pc != start and pc in self.breakpoints:
+                break
+            word = rom[pc]
+            pc += 1
+            if word >= 0:
+                a = word
+                continue
+            comp = COMP_EXPRESSIONS.get(word >> 6 & 0x7F)
+            if comp is None:
+                raise ValueError(f"Unsupported instruction {word & 0xFFFF:016b} at {pc - 1}")
+            dest = word >> 3 & 7
+            jump = word & 7
+            address = "A" if a is None else str(a)
+            value = comp.replace("A", address).replace("M", f"ram[{address}]")
+            if _needs_wrap(comp):
+                value = f"({value} + 32768 & 65535) - 32768"
+            constant = CONSTANT_COMPS.get(comp)
+            conditional = jump and jump != 7 and constant is None
+            if a is None and dest & 4 and (dest & 1 or jump):
+                # the write and the jump use the A from before this instruction
+                lines.append("t = A")
+                address = "t"
+            targets = []
+            if dest & 1:
+                targets.append(f"ram[{address}]")
+            if dest & 2:
+                targets.append("D")
+            if dest & 4:
+                targets.append("A")
+            if conditional:
+                targets.append("x")
+            if targets:
+                lines.append(" = ".join(targets) + " = " + value)
+            if dest & 1:
+                if a is None:
+                    lines.append(f"touched[{address}] = 1")
+                else:
+                    static_writes.add(a)
+                    if a == 0:
+                        lines.append("if ram[0] > peak[0]: peak[0] = ram[0]")
+            target = address
+            if dest & 4:
+                a = None
+            if not jump:
+                continue
+            if conditional:
+                new_a = "A" if a is None else str(a)
+                lines.append(f"if x {JUMP_CONDITIONS[jump]}: return {target}, {new_a}, D")
+                exit_pc = str(pc)
+            elif jump == 7 or eval(f"{constant} {JUMP_CONDITIONS[jump]}"):
+                exit_pc = target
+                if target == str(start) and pc - start == 2 and not dest:
+                    self.idle.add(start)
+            else:
+                exit_pc = str(pc)
+        if exit_pc is None:
+            exit_pc = str(pc)
+        lines.append(f"return {exit_pc}, {'A' if a is None else a}, D")
+        source = f"def block(A, D, ram=ram, touched=touched, peak=peak):\n    " + "\n    ".join(lines)
+        namespace = {"ram": self.ram, "touched": self.touched, "peak": self.peak_sp}
+        exec(source, namespace)
+        return namespace["block"], pc - start, static_writes
+
+    def _enter(self, pc, function, size, static_writes):
+        # The first run of a block marks the RAM it writes at fixed addresses
+        touched = self.touched
+        for address in static_writes:
+            touched[address] = 1
+        self.blocks[pc] = function
+        self.sizes[pc] = size
+
+    def _step(self, pc, a, d):
+        # One instruction, for the last few cycles of a bounded run
+        function, _, static_writes = self._compile(pc, limit=1)
+        for address in static_writes:
+            self.touched[address] = 1
+        return function(a, d)
+
+    def run(self, max_cycles=None, stop_pc=None):
+        # Runs until max_cycles more cycles have passed, pc reaches stop_pc or
+        # leaves the program, or (without max_cycles) the program parks in an
+        # idle loop. Returns the cycles executed.
+        if stop_pc is not None and stop_pc not in self.breakpoints:
+            self.breakpoints.add(stop_pc)
+            self._reset_blocks()
+        blocks = self.blocks
+        sizes = self.sizes
+        end = len(self.rom)
+        limit = float("inf") if max_cycles is None else max_cycles
+        pc, a, d = self.pc, self.a, self.d
+        cycles = 0
+        while pc < end and pc != stop_pc and cycles < limit:
+            function = blocks[pc]
+            if function is None:
+                if pc < 0:
+                    # jumps use 15 bits of A
+                    pc &= 0x7FFF
+                    continue
+                function, size, static_writes = self._compile(pc)
+                if pc in self.idle:
+                    if max_cycles is None:
+                        break
+                    # nothing changes, so skip ahead to the last whole loop
+                    cycles += (limit - cycles) // size * size
+                    if cycles == limit:
+                        break
+                if cycles + size > limit:
+                    while cycles < limit and pc < end and pc != stop_pc:
+                        pc, a, d = self._step(pc, a, d)
+                        cycles += 1
+                    break
+                self._enter(pc, function, size, static_writes)
+                if pc in self.idle:
+                    # keep idle loops on the slow path
+                    blocks[pc] = None
+                cycles += size
+                pc, a, d = function(a, d)
+                continue
+            size = sizes[pc]
+            if cycles + size > limit:
+                blocks[pc] = None
+                continue
+            cycles += size
+            pc, a, d = function(a, d)
+        self.pc, self.a, self.d = pc, a, d
+        self.cycles += cycles
+        return cycles
+
+    def stats(self):
+        return {"cycles": self.cycles, "peak SP": self.peak_sp[0],
+                "RAM touched": RAM_SIZE - self.touched.count(0)}
+
+# Test scripts
+
+OUTPUT_FORMAT = re.compile(r"RAM\[(\d+)\]%D(\d+)\.(\d+)\.(\d+)")
+
+def _script_commands(text):
+    # Splits a .tst script into commands, with repeat blocks as
+    # ("repeat", count, commands)
+    text = re.sub(r"//[^\n]*|/\*.*?\*/", "", text, flags=re.S)
+    tokens = re.findall(r"repeat\s+\d+\s*\{|\}|[^,;{}]+", text)
+    stack = [[]]
+    for token in tokens:
+        token = token.strip()
+        if not token:
+            continue
+        if token.startswith("repeat"):
+            stack.append([int(token.split()[1])])
+        elif token == "}":
+            count, *body = stack.pop()
+            stack[-1].append(("repeat", count, body))
+        else:
+            stack[-1].append(tuple(token.split()))
+    return stack[0]
+
+def _format_header(columns):
+    cells = []
+    for address, left, width, right in columns:
+        name = f"RAM[{address}]"
+        size = left + width + right
+        name = name[:size]
+        padding = size - len(name)
+        cells.append(" " * (padding // 2) + name + " " * (padding - padding // 2))
+    return "|" + "|".join(cells) + "|"
+
+def _format_row(ram, columns):
+    return "|" + "|".join(" " * left + f"{ram[address]:>{width}}" + " " * right
+                          for address, left, width, right in columns) + "|"
+
+class TestScript:
+    # Runs a CPU emulator .tst script against this emulator: load, set
+    # RAM[n], repeat/ticktock, output-list and output, then checks the
+    # output against the compare-to file. Subclasses run other machines by
+    # overriding load, step and set.
+    STEP = "ticktock"
+
+    def __init__(self, tst_path):
+        self.directory = os.path.dirname(tst_path)
+        with open(tst_path, "r") as file:
+            self.commands = _script_commands(file.read())
+        self.emulator = None
+        self.columns = []
+        self.output = []
+        self.output_path = None
+        self.compare_path = None
+
+    def run(self):
+        self._run(self.commands)
+        if self.output_path is not None:
+            with open(self.output_path, "w") as file:
+                file.write("".join(line + "\n" for line in self.output))
+        return self.output
+
+    def load(self, name):
+        self.emulator = HackEmulator(load_program(os.path.join(self.directory, name)))
+
+    def step(self, count):
+        self.emulator.run(count)
+
+    def set(self, target, value):
+        if target.startswith("RAM["):
+            self.emulator.ram[int(target[4:-1])] = value
+        elif target == "PC":
+            self.emulator.pc = value
+        else:
+            raise ValueError(f"Unsupported script variable: {target}")
+
+    def _run(self, commands):
+        for command in commands:
+            name = command[0]
+            if name == "repeat":
+                _, count, body = command
+                if all(step == (self.STEP,) for step in body):
+                    self.step(count * len(body))
+                else:
+                    for _ in range(count):
+                        self._run(body)
+            elif name == self.STEP:
+                self.step(1)
+            elif name == "load":
+                self.load(command[1] if len(command) > 1 else "")
+            elif name == "output-file":
+                self.output_path = os.path.join(self.directory, command[1])
+            elif name == "compare-to":
+                self.compare_path = os.path.join(self.directory, command[1])
+            elif name == "output-list":
+                self.columns = []
+                for column in command[1:]:
+                    match = OUTPUT_FORMAT.fullmatch(column)
+                    if match is None:
+                        raise ValueError(f"Unsupported output column: {column}")
+                    self.columns.append(tuple(int(group) for group in match.groups()))
+                self.output.append(_format_header(self.columns))
+            elif name == "output":
+                self.output.append(_format_row(self.emulator.ram, self.columns))
+            elif name == "set":
+                self.set(command[1], int(command[2]))
+            else:
+                raise ValueError(f"Unsupported script command: {' '.join(command)}")
+
+    def compare(self):
+        # Returns the first mismatching (line number, expected, actual), or
+        # None; spacing is ignored
+        if self.compare_path is None:
+            return None
+        with open(self.compare_path, "r") as file:
+            expected = file.read().splitlines()
+        for i in range(max(len(expected), len(self.output))):
+            want = expected[i] if i < len(expected) else ""
+            got = self.output[i] if i < len(self.output) else ""
+            if want.replace(" ", "") != got.replace(" ", ""):
+                return i + 1, want, got
+        return None
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Run Hack machine code")
+    arg_parser.add_argument("input_path", help=".asm or .hack program, or a .tst script")
+    arg_parser.add_argument("--cycles", type=int, default=None, metavar="N",
+                            help="stop after N cycles instead of at the first idle loop")
+    args = arg_parser.parse_args()
+
+    start = time.perf_counter()
+    if args.input_path.endswith(".tst"):
+        script = TestScript(args.input_path)
+        script.run()
+        emulator = script.emulator
+        mismatch = script.compare()
+    else:
+        emulator = HackEmulator(load_program(args.input_path))
+        emulator.run(args.cycles)
+        mismatch = None
+    elapsed = time.perf_counter() - start
+
+    for name, value in emulator.stats().items():
+        print(f"{name}: {value}")
+    if elapsed > 0:
+        print(f"speed: {emulator.cycles / elapsed / 1e6:.2f}M instructions/s")
+    if mismatch is not None:
+        line, want, got = mismatch
+        print(f"Comparison failure at line {line}: expected {want.strip()}, got {got.strip()}")
+        sys.exit(1)
+    elif args.input_path.endswith(".tst"):
+        print("End of script - Comparison ended successfully")
+
+if __name__ == "__main__":
+    main()
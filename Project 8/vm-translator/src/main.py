@@ -1,69 +1,350 @@
 import sys
 import os
-from parser import Parser, CommandType
-from code_writer import CodeWriter
+import io
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
+from parser import Parser, CommandType, Opcode
+from code_writer import CodeWriter, PROFILE_BASE, PROFILE_SIZE, direct_operand
+from peephole import PeepholeOptimizer
+from translation_cache import TranslationCache
+from assembler import HackAssembler
+from c_writer import CWriter, build_native
+from vm_optimizer import VMOptimizer, PASSES
+from stack_check import check_stack_depths
 
-def translate_file(input_path, output_path, is_first=True, is_multi_file=False):
-    parser = Parser(input_path)
+# Arithmetic commands that can fuse with a following if-goto
+BRANCH_CONDITIONS = {Opcode.EQ, Opcode.GT, Opcode.LT, Opcode.NOT}
 
-    code_writer = CodeWriter(output_path,
-                             append=not is_first,
-                             is_sys_init=is_multi_file and is_first)
-    
-    file_name = os.path.basename(input_path).replace('.vm', '')
-    code_writer.set_file_name(file_name)
+def fused_branch(commands, i):
+    # (commands consumed, negate) when commands[i] starts a comparison that
+    # only feeds an if-goto, else None
+    opcode = commands[i].opcode
+    if opcode not in BRANCH_CONDITIONS or i + 1 >= len(commands):
+        return None
+    following = commands[i + 1].opcode
+    if following is Opcode.IF_GOTO:
+        return 2, False
+    if (following is Opcode.NOT and opcode is not Opcode.NOT and i + 2 < len(commands)
+            and commands[i + 2].opcode is Opcode.IF_GOTO):
+        return 3, True
+    return None
+
+# Binary commands a direct move can fold in
+MOVE_OPERATIONS = {Opcode.ADD, Opcode.SUB, Opcode.AND, Opcode.OR}
+
+def direct_move(commands, i):
+    # commands consumed when commands[i] starts push/pop or
+    # push/push/op/pop, else 0
+    if i + 1 < len(commands) and commands[i + 1].opcode is Opcode.POP:
+        return 2
+    if (i + 3 < len(commands) and commands[i + 1].opcode is Opcode.PUSH
+            and commands[i + 2].opcode in MOVE_OPERATIONS and commands[i + 3].opcode is Opcode.POP
+            and direct_operand(commands[i + 1].arg1, commands[i + 1].arg2)):
+        return 4
+    return 0
 
-    while parser.has_more_commands():
-        parser.advance()
-        command_type = parser.command_type()
+# Most commands a pattern in write_commands looks past the current one
+LOOKAHEAD = 3
+# Commands a streamed file is translated in at a time, and assembly lines
+# buffered before a streamed translation flushes
+STREAM_CHUNK = 4096
+STREAM_FLUSH_LINES = 65536
+
+def write_commands(code_writer, commands, final=True):
+    # Returns how many commands were written; unless final, stops while
+    # the lookahead past a command still runs off the end of the list
+    fuse_branches = code_writer.fuse_branches
+    direct_moves = code_writer.direct_moves
+    stop = len(commands) if final else len(commands) - LOOKAHEAD
+    skip = 0
+    for i, command in enumerate(commands):
+        if skip:
+            skip -= 1
+            continue
+        if i >= stop:
+            return i
+        command_type = command.command_type
         
         if command_type == CommandType.ARITHMETIC:
-            code_writer.write_arithmetic(parser.arg1())
+            match = fused_branch(commands, i) if fuse_branches else None
+            if match is not None:
+                consumed, negate = match
+                code_writer.write_compare_branch(command.arg1, commands[i + consumed - 1].arg1, negate)
+                skip = consumed - 1
+                continue
+            code_writer.write_arithmetic(command.arg1)
         elif command_type in (CommandType.PUSH, CommandType.POP):
-            code_writer.write_push_pop(command_type, parser.arg1(), parser.arg2())
+            if (fuse_branches and command_type == CommandType.PUSH and i + 1 < len(commands)
+                    and commands[i + 1].opcode is Opcode.IF_GOTO):
+                code_writer.write_push_branch(command.arg1, command.arg2, commands[i + 1].arg1)
+                skip = 1
+                continue
+            consumed = direct_move(commands, i) if direct_moves and command_type == CommandType.PUSH else 0
+            if consumed == 2:
+                destination = commands[i + 1]
+                code_writer.write_move((command.arg1, command.arg2), (destination.arg1, destination.arg2))
+                skip = 1
+                continue
+            if consumed == 4:
+                right, operation, destination = commands[i + 1:i + 4]
+                code_writer.write_binary_move((command.arg1, command.arg2), (right.arg1, right.arg2),
+                                              operation.arg1, (destination.arg1, destination.arg2))
+                skip = 3
+                continue
+            code_writer.write_push_pop(command_type, command.arg1, command.arg2)
         elif command_type == CommandType.LABEL:
-            code_writer.write_label(parser.arg1())
+            code_writer.write_label(command.arg1)
         elif command_type == CommandType.GOTO:
-            code_writer.write_goto(parser.arg1())
+            code_writer.write_goto(command.arg1)
         elif command_type == CommandType.IF:
-            code_writer.write_if(parser.arg1())
+            code_writer.write_if(command.arg1)
         elif command_type == CommandType.FUNCTION:
-            code_writer.write_function(parser.arg1(), parser.arg2())
+            code_writer.write_function(command.arg1, command.arg2)
         elif command_type == CommandType.CALL:
-            code_writer.write_call(parser.arg1(), parser.arg2())
+            if (code_writer.tail_calls and i + 1 < len(commands)
+                    and commands[i + 1].opcode is Opcode.RETURN):
+                code_writer.write_tail_call(command.arg1, command.arg2)
+                skip = 1
+                continue
+            code_writer.write_call(command.arg1, command.arg2)
         elif command_type == CommandType.RETURN:
             code_writer.write_return()
+    return len(commands)
+
+def write_stream(code_writer, commands):
+    # Feeds write_commands bounded chunks of an iterator, carrying the
+    # unwritten tail over so patterns can span chunks. Chunks are pulled
+    # with islice, not a command at a time
+    pending = []
+    while True:
+        chunk = list(islice(commands, STREAM_CHUNK))
+        if not chunk:
+            break
+        pending += chunk
+        written = write_commands(code_writer, pending, final=False)
+        del pending[:written]
+    write_commands(code_writer, pending)
+
+def vm_file_name(input_path):
+    # the name static symbols are prefixed with
+    return os.path.basename(input_path).replace('.vm', '')
+
+def translate_file(input_path, code_writer, streaming=False):
+    parser = Parser(input_path, streaming=streaming)
+    code_writer.set_file_name(vm_file_name(input_path))
+    if streaming:
+        write_stream(code_writer, parser.commands)
+    else:
+        write_commands(code_writer, parser.commands)
+
+def translate_fragment(input_path, options):
+    # Translates one file on its own (in a worker process) and returns its
+    # assembly along with the peephole savings made there
+    optimizer = options.get("optimizer")
+    if optimizer is not None:
+        optimizer = PeepholeOptimizer(optimizer.rules)
+        options = dict(options, optimizer=optimizer)
+
+    output_file = io.StringIO()
+    code_writer = CodeWriter(None, append=True, output_file=output_file, **options)
+    translate_file(input_path, code_writer)
+    code_writer.file.flush()
+    return output_file.getvalue(), optimizer.saved if optimizer is not None else None
 
+def translate_fragments(vm_files, jobs, cache, options):
+    # Per-file fragments in input order, from the cache where possible and
+    # otherwise translated (in parallel when jobs > 1)
+    results = [None] * len(vm_files)
+    keys = [None] * len(vm_files)
+    if cache is not None:
+        for i, file_path in enumerate(vm_files):
+            keys[i] = cache.key(file_path, options)
+            results[i] = cache.get(keys[i])
+
+    missing = [i for i, result in enumerate(results) if result is None]
+    missing_files = [vm_files[i] for i in missing]
+    if jobs > 1 and len(missing) > 1:
+        # map() keeps the input order, so the output matches a serial run
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            translated = list(pool.map(translate_fragment, missing_files, repeat(options)))
+    else:
+        translated = [translate_fragment(file_path, options) for file_path in missing_files]
+
+    for i, result in zip(missing, translated):
+        results[i] = result
+        if cache is not None:
+            cache.put(keys[i], *result)
+    if cache is not None:
+        cache.evict()
+    return results
+
+def translate(vm_files, output_path, is_multi_file, jobs=1, cache=None, output_file=None,
+              vm_optimizer=None, streaming=False, code_writer=None, **options):
+    # One writer for the whole program, so the output is opened and written
+    # once; code_writer replaces the assembly writer (e.g. a CWriter).
+    # Returns the writer.
+    if code_writer is None:
+        code_writer = CodeWriter(output_path, is_sys_init=is_multi_file, output_file=output_file,
+                                 **options)
+    if vm_optimizer is not None:
+        # Whole-program passes need every file parsed up front
+        program = [(vm_file_name(file_path), Parser(file_path).commands) for file_path in vm_files]
+        for file_name, commands in vm_optimizer.optimize(program):
+            code_writer.set_file_name(file_name)
+            write_commands(code_writer, commands)
+    elif is_multi_file and (jobs > 1 or cache is not None) and not options.get("instrument"):
+        # Link the bootstrap and the per-file fragments (not when
+        # instrumenting, whose counters are numbered across the program)
+        for fragment, saved in translate_fragments(vm_files, jobs, cache, options):
+            code_writer.file.write_section(fragment)
+            if saved is not None:
+                options["optimizer"].merge(saved)
+    else:
+        for file_path in vm_files:
+            translate_file(file_path, code_writer, streaming)
     code_writer.close()
+    return code_writer
+
+def verify_stack(vm_files, is_multi_file, vm_optimizer=None, **options):
+    # Checks that every block boundary has a fixed stack depth, which SP
+    # batching relies on, then counts the SP updates batching removes from
+    # the build the same VM passes and writer options give
+    program = [(vm_file_name(file_path), Parser(file_path).commands) for file_path in vm_files]
+    if vm_optimizer is not None:
+        program = list(vm_optimizer.optimize(program))
+    stats = check_stack_depths(program)
+    code_writer = CodeWriter(None, is_sys_init=is_multi_file, output_file=io.StringIO(),
+                             **dict(options, batch_sp=True))
+    for file_name, commands in program:
+        code_writer.set_file_name(file_name)
+        write_commands(code_writer, commands)
+    code_writer.close()
+    stats["SP updates"] = code_writer.sp_adjustments
+    stats["SP updates eliminated"] = code_writer.sp_adjustments - code_writer.sp_writes
+    return stats
+
+def list_vm_files(directory):
+    # .vm files in translation order: Sys.vm first, then alphabetical
+    vm_files = [f for f in os.listdir(directory) if f.endswith('.vm')]
+    vm_files.sort()
+
+    if 'Sys.vm' in vm_files:
+        vm_files.remove('Sys.vm')
+        vm_files.insert(0, 'Sys.vm')
+    return [os.path.join(directory, filename) for filename in vm_files]
+
+def write_profile_map(map_path, profile_slots):
+    # One "address function" line per instrumented function, for
+    # profile_report.py
+    with open(map_path, 'w') as file:
+        for name, address in profile_slots.items():
+            file.write(f"{address} {name}\n")
+
+def count_lines(lines):
+    # ROM size: every line that is not blank, a comment or a label
+    count = 0
+    for line in lines:
+        # the first character decides, so there is no need to split off comments
+        line = line.lstrip()
+        if line and line[0] not in '/(':
+            count += 1
+    return count
+
+def count_instructions(asm_path):
+    with open(asm_path, 'r') as file:
+        return count_lines(file)
+
+def removed_instructions(removed, **options):
+    # Hack instructions the functions in removed (VMOptimizer.removed)
+    # translate to with the same writer options, i.e. the ROM the
+    # dead-functions pass saved
+    optimizer = options.get("optimizer")
+    if optimizer is not None:
+        options = dict(options, optimizer=PeepholeOptimizer(optimizer.rules))
+    output_file = io.StringIO()
+    code_writer = CodeWriter(None, append=True, output_file=output_file, **options)
+    for file_name, commands in removed:
+        code_writer.set_file_name(file_name)
+        write_commands(code_writer, commands)
+    code_writer.file.flush()
+    return count_lines(output_file.getvalue().splitlines())
 
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python main.py <input_path>")
-        sys.exit(1)
+    arg_parser = argparse.ArgumentParser(description="Translate VM code to Hack assembly")
+    arg_parser.add_argument("input_path", help=".vm file or directory of .vm files")
+    arg_parser.add_argument("--shared-calls", action="store_true",
+                            help="use shared $$CALL/$$RETURN routines instead of inlining the frame protocol")
+    arg_parser.add_argument("--shared-compare", action="store_true",
+                            help="use shared eq/gt/lt routines instead of inlining each comparison")
+    arg_parser.add_argument("--cache-top", action="store_true",
+                            help="keep the top of the stack in D between commands where possible")
+    arg_parser.add_argument("--fuse-branches", action="store_true",
+                            help="turn eq/gt/lt/not followed by if-goto into one conditional jump (on at -O1)")
+    arg_parser.add_argument("--zero-loop-threshold", type=int, default=None, metavar="N",
+                            help="zero the locals of functions with N or more of them in a shared loop "
+                                 "(smaller code, slower entry)")
+    arg_parser.add_argument("--tail-calls", action="store_true",
+                            help="run call directly followed by return in the caller's frame")
+    arg_parser.add_argument("--direct-moves", action="store_true",
+                            help="copy push/pop pairs memory to memory without the stack (on at -O1)")
+    arg_parser.add_argument("--batch-sp", action="store_true",
+                            help="address stack slots from the block's entry SP and write SP once per block")
+    arg_parser.add_argument("--verify-stack", action="store_true",
+                            help="check stack depths at every block boundary "
+                                 "and report the SP updates batching removes")
+    arg_parser.add_argument("--instrument", action="store_true",
+                            help="count calls and estimated instructions per function in the top 1K of the heap "
+                                 "and write their addresses to a .prof map for profile_report.py")
+    arg_parser.add_argument("--report-size", action="store_true",
+                            help="also translate without any options and compare ROM sizes")
+    arg_parser.add_argument("-O", dest="opt_level", type=int, choices=[0, 1, 2], default=0,
+                            help="optimization level (1 = peephole pass, fused branches and direct moves, "
+                                 "2 = also every VM pass)")
+    arg_parser.add_argument("--vm-pass", action="append", choices=list(PASSES), metavar="NAME",
+                            help=f"run a whole-program VM pass (one of: {', '.join(PASSES)})")
+    arg_parser.add_argument("--inline-max-size", type=int, default=12, metavar="N",
+                            help="inline only leaf functions of at most N VM commands")
+    arg_parser.add_argument("--inline-max-growth", type=int, default=1000, metavar="N",
+                            help="inline while the code growth over all call sites stays within N instructions")
+    arg_parser.add_argument("--flush-threshold", type=int, default=None, metavar="N",
+                            help="with -O1, flush the output every N lines instead of once at the end")
+    arg_parser.add_argument("--stream", action="store_true",
+                            help="parse and write incrementally so memory stays flat on huge inputs "
+                                 "(not with VM passes, which need whole files)")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=1, metavar="N",
+                            help="translate the files of a directory in N worker processes")
+    arg_parser.add_argument("--cache", metavar="DIR",
+                            help="reuse per-file translations cached in DIR (directory inputs)")
+    arg_parser.add_argument("--cache-size", type=int, default=64, metavar="MB",
+                            help="evict least recently used cache entries beyond this size")
+    arg_parser.add_argument("--emit", choices=["asm", "hack", "c"], default="asm",
+                            help="write assembly, assemble in-process to a .hack file, or write C "
+                                 "and compile it to a native binary")
+    arg_parser.add_argument("--cc", default="cc", help="C compiler for --emit c")
+    arg_parser.add_argument("--packed", action="store_true",
+                            help="with --emit hack, also write the machine code as packed 16-bit words (.bin)")
+    args = arg_parser.parse_args()
+    if args.flush_threshold is not None and args.opt_level < 1:
+        # without the peephole pass nothing is buffered to flush
+        arg_parser.error("--flush-threshold needs -O1")
 
-    input_path = sys.argv[1]
+    input_path = args.input_path
     
     # Handles both single file and directory inputs
     if os.path.isdir(input_path):
         output_path = os.path.join(input_path, os.path.basename(input_path) + ".asm")
         
-        vm_files = [f for f in os.listdir(input_path) if f.endswith('.vm')]
-        vm_files.sort()  
-        
-        if 'Sys.vm' in vm_files:
-            vm_files.remove('Sys.vm')
-            vm_files.insert(0, 'Sys.vm')
+        vm_files = list_vm_files(input_path)
 
         if not vm_files:
             print(f"Error: No .vm files found in directory {input_path}")
             sys.exit(1)
             
         # Process each .vm file in directory
-        first_file = True
-        for filename in vm_files:
-            file_path = os.path.join(input_path, filename)
-            translate_file(file_path, output_path, is_first=first_file, is_multi_file=True)
-            first_file = False
+        is_multi_file = True
     else:
         # Process a single file
         if not input_path.endswith(".vm"):
@@ -74,7 +355,117 @@ def main():
             sys.exit(1)
             
         output_path = input_path.replace(".vm", ".asm")
-        translate_file(input_path, output_path, is_first=True, is_multi_file=False)
+        vm_files = [input_path]
+        is_multi_file = False
+
+    output_file = None
+    if args.emit == "hack":
+        output_base = os.path.splitext(output_path)[0]
+        output_path = output_base + ".hack"
+        output_file = HackAssembler(output_path, output_base + ".bin" if args.packed else None)
+
+    optimizer = PeepholeOptimizer() if args.opt_level >= 1 else None
+
+    def make_vm_optimizer():
+        # a fresh one per use, since each keeps its own statistics
+        if not (args.opt_level >= 2 or args.vm_pass):
+            return None
+        passes = list(PASSES) if args.opt_level >= 2 else args.vm_pass
+        return VMOptimizer(passes, entry="Sys.init" if is_multi_file else None,
+                           inline_max_size=args.inline_max_size,
+                           inline_max_growth=args.inline_max_growth)
+
+    vm_optimizer = make_vm_optimizer()
+    if args.emit == "c":
+        # Shares the parser, the command dispatch and the VM passes; the
+        # assembly-level options do not apply
+        output_base = os.path.splitext(output_path)[0]
+        c_path = output_base + ".c"
+        translate(vm_files, c_path, is_multi_file, vm_optimizer=vm_optimizer, streaming=args.stream,
+                  code_writer=CWriter(c_path, is_sys_init=is_multi_file))
+        if vm_optimizer is not None:
+            print(f"VM passes: {vm_optimizer.report()}")
+        try:
+            build_native(c_path, output_base, cc=args.cc)
+        except subprocess.CalledProcessError as error:
+            print(f"Error: {args.cc} failed on {c_path}:\n{error.stderr}")
+            sys.exit(1)
+        except OSError as error:
+            print(f"Error: cannot run {args.cc}: {error}")
+            sys.exit(1)
+        print(f"Native binary: {output_base}")
+        return
+    flush_threshold = args.flush_threshold
+    if args.stream and flush_threshold is None:
+        # Buffering the whole output would undo the flat memory profile
+        flush_threshold = STREAM_FLUSH_LINES
+    cache = None
+    if args.cache and is_multi_file:
+        cache = TranslationCache(args.cache, max_bytes=args.cache_size * 1024 * 1024)
+    # CodeWriter options, shared by the stack check and the translation
+    options = dict(shared_calls=args.shared_calls,
+                   shared_compare=args.shared_compare,
+                   cache_top=args.cache_top,
+                   batch_sp=args.batch_sp,
+                   fuse_branches=args.fuse_branches or args.opt_level >= 1,
+                   direct_moves=args.direct_moves or args.opt_level >= 1,
+                   zero_loop_threshold=args.zero_loop_threshold,
+                   tail_calls=args.tail_calls,
+                   instrument=args.instrument)
+
+    if args.instrument and any(os.path.basename(path) == "Memory.vm" for path in vm_files):
+        print(f"Warning: Memory.vm can allocate RAM[{PROFILE_BASE}-{PROFILE_BASE + PROFILE_SIZE - 1}], "
+              "which holds the profile counters")
+
+    if args.verify_stack:
+        # before writing anything, so a failure leaves no output behind
+        try:
+            stats = verify_stack(vm_files, is_multi_file, make_vm_optimizer(), **options)
+        except ValueError as error:
+            print(f"Stack check failed: {error}")
+            sys.exit(1)
+        print("Stack check: " + ", ".join(f"{key} {value}" for key, value in stats.items()))
+
+    code_writer = translate(vm_files, output_path, is_multi_file,
+                            optimizer=optimizer,
+                            flush_threshold=flush_threshold,
+                            streaming=args.stream,
+                            jobs=args.jobs,
+                            cache=cache,
+                            output_file=output_file,
+                            vm_optimizer=vm_optimizer,
+                            **options)
+
+    if args.instrument:
+        map_path = os.path.splitext(output_path)[0] + ".prof"
+        write_profile_map(map_path, code_writer.profile_slots)
+        print(f"Profile map: {map_path}")
+
+    if cache is not None:
+        print(f"Cache: {cache.report()}")
+
+    if optimizer is not None:
+        print(f"Peephole: {optimizer.report()}")
+
+    if vm_optimizer is not None:
+        print(f"VM passes: {vm_optimizer.report()}")
+        if vm_optimizer.removed:
+            size = count_instructions(output_path)
+            removed = removed_instructions(vm_optimizer.removed, optimizer=optimizer, **options)
+            print(f"Dead functions: ROM size {size} instructions "
+                  f"(without the pass: {size + removed}, saved {removed})")
+
+    if args.report_size:
+        # Compare against the plain translation, which means translating
+        # the program a second time
+        with tempfile.TemporaryDirectory() as temp_dir:
+            baseline_path = os.path.join(temp_dir, "baseline.asm")
+            translate(vm_files, baseline_path, is_multi_file, streaming=args.stream,
+                      flush_threshold=flush_threshold)
+            baseline_size = count_instructions(baseline_path)
+        size = count_instructions(output_path)
+        print(f"ROM size: {size} instructions "
+              f"(baseline: {baseline_size}, saved {baseline_size - size})")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,98 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from array import array
+from c_writer import CWriter, RAM_SIZE, build_native, run_native
+from hack_emulator import TestScript
+from main import translate, list_vm_files
+
+# Builds VM programs through the C backend and checks them against the
+# CPU emulator .tst/.cmp files, standing in for the translated .asm.
+
+def build_program(vm_files, is_multi_file, build_dir, cc="cc"):
+    # Translates to C and compiles it; returns the binary's path
+    c_path = os.path.join(build_dir, "program.c")
+    binary_path = os.path.join(build_dir, "program")
+    translate(vm_files, c_path, is_multi_file, code_writer=CWriter(c_path, is_sys_init=is_multi_file))
+    build_native(c_path, binary_path, cc=cc)
+    return binary_path
+
+class NativeProgram:
+    # RAM set before the first step is passed to the binary, which then
+    # runs until it halts; later steps change nothing
+    def __init__(self, binary_path):
+        self.binary_path = binary_path
+        self.ram = array("h", bytes(2 * RAM_SIZE))
+        self.finished = False
+
+    def run(self):
+        if not self.finished:
+            preset = {address: value for address, value in enumerate(self.ram) if value}
+            self.ram = run_native(self.binary_path, preset)
+            self.finished = True
+
+class NativeTestScript(TestScript):
+    # load X.asm builds the VM code it was translated from: the directory
+    # if it has a Sys.vm, else X.vm
+    def __init__(self, tst_path, cc="cc"):
+        super().__init__(tst_path)
+        self.cc = cc
+        self.build_dir = tempfile.TemporaryDirectory()
+
+    def load(self, name):
+        stem = os.path.splitext(name)[0]
+        if os.path.exists(os.path.join(self.directory, "Sys.vm")):
+            vm_files, is_multi_file = list_vm_files(self.directory), True
+        else:
+            vm_files, is_multi_file = [os.path.join(self.directory, stem + ".vm")], False
+        binary_path = build_program(vm_files, is_multi_file, self.build_dir.name, self.cc)
+        self.emulator = NativeProgram(binary_path)
+
+    def step(self, count):
+        self.emulator.run()
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Run VM code compiled through the C backend")
+    arg_parser.add_argument("input_path", help=".vm file, directory of .vm files, or a CPU emulator .tst script")
+    arg_parser.add_argument("--cc", default="cc", help="C compiler")
+    arg_parser.add_argument("--set", action="append", default=[], metavar="ADDRESS=VALUE",
+                            help="preset a RAM word before running")
+    args = arg_parser.parse_args()
+
+    try:
+        if args.input_path.endswith(".tst"):
+            script = NativeTestScript(args.input_path, args.cc)
+            script.run()
+            mismatch = script.compare()
+            if mismatch is not None:
+                line, want, got = mismatch
+                print(f"Comparison failure at line {line}: expected {want.strip()}, got {got.strip()}")
+                sys.exit(1)
+            print("End of script - Comparison ended successfully")
+            return
+
+        if os.path.isdir(args.input_path):
+            vm_files, is_multi_file = list_vm_files(args.input_path), True
+        else:
+            vm_files, is_multi_file = [args.input_path], False
+        preset = {}
+        for setting in args.set:
+            address, _, value = setting.partition("=")
+            preset[int(address)] = int(value)
+        with tempfile.TemporaryDirectory() as build_dir:
+            binary_path = build_program(vm_files, is_multi_file, build_dir, args.cc)
+            start = time.perf_counter()
+            ram = run_native(binary_path, preset)
+            elapsed = time.perf_counter() - start
+    except subprocess.CalledProcessError as error:
+        print(f"Error: {' '.join(error.cmd)} failed:\n{error.stderr}")
+        sys.exit(1)
+
+    print(f"SP: {ram[0]}")
+    print(f"run time: {elapsed:.3f}s")
+
+if __name__ == "__main__":
+    main()
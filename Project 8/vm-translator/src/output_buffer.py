@@ -0,0 +1,67 @@
+class OutputBuffer:
+    # Holds emitted assembly back for the optimizer, which works on whole
+    # sections. flush_threshold: None buffers everything until close, 0
+    # writes every line straight through, N flushes whenever N writes are
+    # pending (up to the last label among them, see flush). Without an
+    # optimizer lines go straight to the file, whose own buffering already
+    # batches them; a list in front only costs time.
+    def __init__(self, file, flush_threshold=None, optimizer=None):
+        self.file = file
+        self.flush_threshold = flush_threshold
+        self.optimizer = optimizer
+        # lines still open to the optimizer, and finished lines ready to write
+        self.lines = []
+        self.sections = []
+        if optimizer is None:
+            self.write = file.write
+        elif flush_threshold is None:
+            # Nothing to check per line, so skip the method call entirely
+            self.write = self.lines.append
+
+    def write(self, text):
+        self.lines.append(text)
+        if len(self.lines) >= self.flush_threshold:
+            self.flush(keep_open=True)
+
+    def end_section(self):
+        # Closes off the pending lines so the optimizer never works across
+        # a section boundary (e.g. from one .vm file into the next)
+        if not self.lines:
+            return
+        # (only the optimizer's lines are held; every write is one line)
+        lines = self.optimizer.optimize(self.lines)
+        self.lines = []
+        if self.flush_threshold is None:
+            self.write = self.lines.append
+        self.sections.append(lines)
+
+    def write_section(self, text):
+        # Appends already finished text, e.g. a fragment translated elsewhere
+        self.end_section()
+        if self.optimizer is None:
+            self.file.write(text)
+        else:
+            self.sections.append([text])
+
+    def flush(self, keep_open=False):
+        # keep_open holds back the lines after the last label, where the
+        # optimizer starts afresh anyway, so flushing part way through a
+        # section gives the same output as buffering all of it. With no
+        # label in the newer half everything goes, which bounds the rescan.
+        held = []
+        if keep_open:
+            lines = self.lines
+            for i in range(len(lines) - 1, len(lines) // 2 - 1, -1):
+                if lines[i][0] == "(":
+                    held = lines[i + 1:]
+                    del lines[i + 1:]
+                    break
+        self.end_section()
+        self.lines.extend(held)
+        for lines in self.sections:
+            self.file.writelines(lines)
+        self.sections.clear()
+
+    def close(self):
+        self.flush()
+        self.file.close()
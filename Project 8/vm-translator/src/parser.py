@@ -1,3 +1,4 @@
+import sys
 from enum import Enum
 from typing import Optional, TextIO
 
@@ -12,60 +13,157 @@ class CommandType(Enum):
     RETURN = "C_RETURN"
     CALL = "C_CALL"
 
+class Opcode(Enum):
+    ADD = "add"
+    SUB = "sub"
+    NEG = "neg"
+    EQ = "eq"
+    GT = "gt"
+    LT = "lt"
+    AND = "and"
+    OR = "or"
+    NOT = "not"
+    PUSH = "push"
+    POP = "pop"
+    LABEL = "label"
+    GOTO = "goto"
+    IF_GOTO = "if-goto"
+    FUNCTION = "function"
+    CALL = "call"
+    RETURN = "return"
+
+OPCODES = {opcode.value: opcode for opcode in Opcode}
+
+COMMAND_TYPES = {
+    Opcode.PUSH: CommandType.PUSH,
+    Opcode.POP: CommandType.POP,
+    Opcode.LABEL: CommandType.LABEL,
+    Opcode.GOTO: CommandType.GOTO,
+    Opcode.IF_GOTO: CommandType.IF,
+    Opcode.FUNCTION: CommandType.FUNCTION,
+    Opcode.CALL: CommandType.CALL,
+    Opcode.RETURN: CommandType.RETURN,
+}
+for _opcode in Opcode:
+    COMMAND_TYPES.setdefault(_opcode, CommandType.ARITHMETIC)
+
+# Arguments each command takes; arithmetic commands and return take none
+ARGUMENT_COUNTS = {
+    Opcode.PUSH: 2, Opcode.POP: 2, Opcode.FUNCTION: 2, Opcode.CALL: 2,
+    Opcode.LABEL: 1, Opcode.GOTO: 1, Opcode.IF_GOTO: 1,
+}
+
+def to_word(value):
+    # wraps an int to a 16-bit two's complement Hack word
+    return (value + 32768 & 65535) - 32768
+
+# eq/gt/lt test the sign of the wrapped difference x - y, as the translated
+# code does, so gt/lt follow overflow rather than Python's ordering. The
+# functions take and return words; COMPARE_TESTS is the same test against
+# 0 for backends that spell it out (the C writer).
+COMPARE = {
+    Opcode.EQ: lambda x, y: -1 if x - y & 65535 == 0 else 0,
+    Opcode.GT: lambda x, y: -1 if (x - y + 32768 & 65535) > 32768 else 0,
+    Opcode.LT: lambda x, y: -1 if (x - y + 32768 & 65535) < 32768 else 0,
+}
+COMPARE_TESTS = {Opcode.EQ: "==", Opcode.GT: ">", Opcode.LT: "<"}
+
+class Command:
+    # one tokenized VM command; arg1 is interned, arg2 is an int or None
+    __slots__ = ("opcode", "command_type", "arg1", "arg2")
+
+    def __init__(self, opcode, arg1=None, arg2=None):
+        self.opcode = opcode
+        self.command_type = COMMAND_TYPES[opcode]
+        self.arg1 = arg1
+        self.arg2 = arg2
+
+    def __repr__(self):
+        # the VM line; arithmetic commands carry their own name as arg1
+        if self.command_type == CommandType.ARITHMETIC:
+            return self.opcode.value
+        return " ".join(str(part) for part in (self.opcode.value, self.arg1, self.arg2)
+                        if part is not None)
+
+def parse_command(line):
+    # tokenizes a comment-free, non-empty VM line
+    words = line.split()
+    opcode = OPCODES.get(words[0])
+    if opcode is None:
+        raise ValueError(f"Unknown command type: {words[0]}")
+    if len(words) - 1 != ARGUMENT_COUNTS.get(opcode, 0):
+        raise ValueError(f"Wrong number of arguments: {line}")
+
+    if COMMAND_TYPES[opcode] == CommandType.ARITHMETIC:
+        return Command(opcode, opcode.value)
+    arg1 = sys.intern(words[1]) if len(words) > 1 else None
+    arg2 = int(words[2]) if len(words) > 2 else None
+    return Command(opcode, arg1, arg2)
+
+# Distinct lines remembered per file; lines past that are parsed every time,
+# which bounds the cache's memory on machine-generated input
+PARSE_CACHE_SIZE = 65536
+
+def iter_commands(file):
+    # tokenizes an open .vm file line by line
+    # Command records are immutable, so repeated lines share one record
+    parsed = {}
+    for line in file:
+        command = parsed.get(line)
+        if command is None:
+            text = line.split('//')[0].strip()
+            if not text:
+                continue
+            command = parse_command(text)
+            if len(parsed) < PARSE_CACHE_SIZE:
+                parsed[line] = command
+        yield command
+
+def stream_commands(file_path):
+    with open(file_path, 'r') as file:
+        yield from iter_commands(file)
+
 class Parser:
-    def __init__(self, file_path):
+    def __init__(self, file_path, streaming=False):
+        # streaming: commands is a one-pass iterator over the file rather
+        # than a list, so memory stays flat however large the file is
         self.file_path = file_path
+        self.streaming = streaming
         self.current_command = None
         self.current_line = 0
-        with open(file_path, 'r') as file:
-            self.commands = [line.strip() for line in file]
-            self.commands = [cmd.split('//')[0].strip() for cmd in self.commands]
-            self.commands = [cmd for cmd in self.commands if cmd]
+        self.next_command = None
+        if streaming:
+            self.commands = stream_commands(file_path)
+        else:
+            with open(file_path, 'r') as file:
+                self.commands = list(iter_commands(file))
     
     def has_more_commands(self):
+        if self.streaming:
+            if self.next_command is None:
+                self.next_command = next(self.commands, None)
+            return self.next_command is not None
         return self.current_line < len(self.commands)
     
     def advance(self):
         if self.has_more_commands():
-            self.current_command = self.commands[self.current_line]
+            if self.streaming:
+                self.current_command = self.next_command
+                self.next_command = None
+            else:
+                self.current_command = self.commands[self.current_line]
             self.current_line += 1
     
     def command_type(self):
         #returns command type
-        first_word = self.current_command.split()[0]
-        
-        if first_word in ['add', 'sub', 'neg', 'eq', 'gt', 'lt', 'and', 'or', 'not']:
-            return CommandType.ARITHMETIC
-        elif first_word == 'push':
-            return CommandType.PUSH
-        elif first_word == 'pop':
-            return CommandType.POP
-        elif first_word == 'label':
-            return CommandType.LABEL
-        elif first_word == 'goto':
-            return CommandType.GOTO
-        elif first_word == 'if-goto':
-            return CommandType.IF
-        elif first_word == 'function':
-            return CommandType.FUNCTION
-        elif first_word == 'return':
-            return CommandType.RETURN
-        elif first_word == 'call':
-            return CommandType.CALL
-        else:
-            raise ValueError(f"Unknown command type: {first_word}")
+        return self.current_command.command_type
 
     def arg1(self):
         #returns first argument of command
-        if self.command_type() == CommandType.ARITHMETIC:
-            return self.current_command
-        else:
-            return self.current_command.split()[1]
+        return self.current_command.arg1
 
     def arg2(self):
         #returns second argument
-        command_type = self.command_type()
-        if command_type in [CommandType.PUSH, CommandType.POP, CommandType.FUNCTION, CommandType.CALL]:
-            return int(self.current_command.split()[2])
-        else:
-            raise ValueError(f"Command type {command_type} does not have arg2")
\ No newline at end of file
+        if self.current_command.arg2 is None:
+            raise ValueError(f"Command type {self.current_command.command_type} does not have arg2")
+        return self.current_command.arg2
\ No newline at end of file
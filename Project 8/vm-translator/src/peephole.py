@@ -0,0 +1,163 @@
+def _is_label(line):
+    return line.startswith("(")
+
+def _is_comment(line):
+    return line.startswith("//")
+
+def _dest(instruction):
+    # destination of a C-instruction, "" for A-instructions and jumps
+    if instruction.startswith("@") or "=" not in instruction:
+        return ""
+    return instruction.split("=")[0]
+
+# Each rule looks at a window of upcoming instructions (comments skipped,
+# stopping at the next label) and returns (consumed, replacement) or None.
+
+def _push_pop(window):
+    # @SP M=M+1 followed by @SP AM=M-1 / @SP M=M-1 cancels out
+    if window[:4] == ["@SP", "M=M+1", "@SP", "AM=M-1"]:
+        return 4, ["@SP", "A=M"]
+    if window[:5] == ["@SP", "M=M+1", "@SP", "M=M-1", "A=M"]:
+        return 5, ["@SP", "A=M"]
+    return None
+
+def _store_reload(window):
+    # D=M right after storing D to the same address
+    if window[:2] == ["M=D", "D=M"]:
+        return 2, ["M=D"]
+    if window[:6] == ["@SP", "A=M", "M=D", "@SP", "A=M", "D=M"]:
+        return 6, ["@SP", "A=M", "M=D"]
+    return None
+
+def _redundant_address(window):
+    # @X reloaded while A still holds X
+    if len(window) >= 3 and window[0].startswith("@") and window[2] == window[0]:
+        if not window[1].startswith("@") and "A" not in _dest(window[1]):
+            return 3, window[:2]
+    return None
+
+def _dead_store(window):
+    # the slot just popped is written and then left above the stack top
+    if window[:4] == ["@SP", "A=M", "M=D", "A=A-1"]:
+        return 4, ["@SP", "A=M-1"]
+    return None
+
+def _constant_d(window):
+    # @0/@1 D=A becomes D=0/D=1 when A is reloaded right after
+    if len(window) >= 3 and window[0] in ("@0", "@1") and window[1] == "D=A" \
+            and window[2].startswith("@"):
+        return 2, [f"D={window[0][1:]}"]
+    return None
+
+# (name, rule, what a matching window's first instruction starts with)
+RULES = [
+    ("push_pop", _push_pop, ("@SP",)),
+    ("store_reload", _store_reload, ("M=D", "@SP")),
+    ("redundant_address", _redundant_address, ("@",)),
+    ("dead_store", _dead_store, ("@SP",)),
+    ("constant_d", _constant_d, ("@0", "@1")),
+]
+
+# Longest pattern a rule looks at, and how far the instructions kept for
+# backing up may grow before the tried part is dropped
+WINDOW_SIZE = 6
+WINDOW_LIMIT = 256
+
+class PeepholeOptimizer:
+    def __init__(self, rules=None):
+        self.rules = RULES if rules is None else rules
+        # instructions saved per rule, accumulated over every optimize() call
+        self.saved = {name: 0 for name, _, _ in self.rules}
+        # first instruction -> the rules that can match from it
+        self.candidates = {}
+
+    def optimize(self, lines):
+        # One pass over lines ending in "\n": the rules are tried at each
+        # instruction once the window after it is full (or cut short by a
+        # label). A rewrite feeds its replacement and the lines after it
+        # through again and backs up a window's length, so patterns the
+        # rewrite creates are still found.
+        candidates = self.candidates
+        saved = self.saved
+        result = []
+        # instructions since the last label and their indices in result;
+        # rules have been tried at every one before tried
+        window = []
+        positions = []
+        tried = 0
+        pending = []
+        source = iter(lines)
+        while True:
+            line = pending.pop() if pending else next(source, None)
+            if line is not None and line[0] != "(":
+                if line.startswith("//"):
+                    result.append(line)
+                    continue
+                window.append(line[:-1])
+                positions.append(len(result))
+                result.append(line)
+                if len(window) - tried < WINDOW_SIZE:
+                    continue
+                last = tried + 1
+            else:
+                # a label or the end: the rest of the window is complete
+                last = len(window)
+
+            match = None
+            while tried < last:
+                first = window[tried]
+                rules = candidates.get(first)
+                if rules is None:
+                    rules = candidates[first] = [(name, rule) for name, rule, starts in self.rules
+                                                 if first.startswith(starts)]
+                if rules:
+                    view = window[tried:tried + WINDOW_SIZE]
+                    for name, rule in rules:
+                        match = rule(view)
+                        if match is not None:
+                            break
+                if match is not None:
+                    break
+                tried += 1
+
+            if match is not None:
+                consumed, replacement = match
+                saved[name] += consumed - len(replacement)
+                cut = positions[tried]
+                end = positions[tried + consumed - 1] + 1 - cut
+                tail = result[cut:]
+                del result[cut:]
+                del window[tried:]
+                del positions[tried:]
+                if line is not None and line[0] == "(":
+                    # the label comes after the rewritten lines again
+                    pending.append(line)
+                pending.extend(reversed(tail[end:]))
+                pending.extend(instruction + "\n" for instruction in reversed(replacement))
+                pending.extend(reversed([l for l in tail[:end] if l.startswith("//")]))
+                tried = max(0, tried - WINDOW_SIZE + 1)
+            elif line is None:
+                return result
+            elif line[0] == "(":
+                window.clear()
+                positions.clear()
+                tried = 0
+                result.append(line)
+            elif tried > WINDOW_LIMIT:
+                drop = tried - WINDOW_SIZE
+                del window[:drop]
+                del positions[:drop]
+                tried -= drop
+
+    def disable(self, name):
+        # drops a rule that is unsafe for the code being written
+        self.rules = [rule for rule in self.rules if rule[0] != name]
+        self.candidates = {}
+
+    def merge(self, saved):
+        # adds savings counted by another optimizer (e.g. in a worker process)
+        for name, count in saved.items():
+            self.saved[name] = self.saved.get(name, 0) + count
+
+    def report(self):
+        return ", ".join(f"{name} saved {count}" for name, count in self.saved.items())
@@ -0,0 +1,95 @@
+import argparse
+import sys
+from array import array
+from code_writer import PROFILE_WORDS
+from hack_emulator import RAM_SIZE, HackEmulator, load_program
+
+# Reports the counters an --instrument build leaves in RAM, using the .prof
+# map main.py writes next to it. The RAM can come from a raw dump (32K
+# native-endian 16-bit words), a CPU emulator .out file whose output-list
+# covers the counters, or from running the .asm/.hack itself here.
+
+def read_map(map_path):
+    # [(function name, counter address)] in map order
+    slots = []
+    with open(map_path) as file:
+        for line in file:
+            if line.strip():
+                address, name = line.split(maxsplit=1)
+                slots.append((name.strip(), int(address)))
+    return slots
+
+def read_out(out_path):
+    # {address: value} from the last row of an .out table with RAM[n] columns
+    with open(out_path) as file:
+        rows = [[cell.strip() for cell in line.strip().strip("|").split("|")]
+                for line in file if line.strip()]
+    if len(rows) < 2:
+        raise ValueError(f"{out_path} has no values")
+    ram = {}
+    for name, value in zip(rows[0], rows[-1]):
+        if name.startswith("RAM[") and name.endswith("]"):
+            ram[int(name[4:-1])] = int(value)
+    return ram
+
+def read_dump(dump_path):
+    with open(dump_path, "rb") as file:
+        data = file.read()
+    if len(data) != 2 * RAM_SIZE:
+        raise ValueError(f"{dump_path} holds {len(data)} bytes, expected a {2 * RAM_SIZE}-byte RAM dump")
+    words = array("h")
+    words.frombytes(data)
+    return words
+
+def counter(ram, address):
+    # the low word keeps 15 bits, the high word counts its overflows
+    return (ram[address] & 0x7FFF) + (ram[address + 1] & 0xFFFF) * 32768
+
+def profile(slots, ram):
+    # (name, calls, instructions) rows, most instructions first
+    rows = [(name, counter(ram, address), counter(ram, address + 2)) for name, address in slots]
+    rows.sort(key=lambda row: (-row[2], row[0]))
+    return rows
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Report the counters of an instrumented program")
+    arg_parser.add_argument("map_path", help=".prof map written by main.py --instrument")
+    arg_parser.add_argument("ram_path",
+                            help="RAM dump, CPU emulator .out file, or the .asm/.hack program to run")
+    arg_parser.add_argument("--cycles", type=int, default=None, metavar="N",
+                            help="when running the program, stop after N cycles instead of at its idle loop")
+    arg_parser.add_argument("--sort", choices=["instructions", "calls", "name"], default="instructions")
+    args = arg_parser.parse_args()
+
+    try:
+        slots = read_map(args.map_path)
+        if args.ram_path.endswith((".asm", ".hack")):
+            emulator = HackEmulator(load_program(args.ram_path))
+            emulator.run(args.cycles)
+            ram = emulator.ram
+            print(f"cycles: {emulator.cycles}")
+        elif args.ram_path.endswith(".out"):
+            ram = read_out(args.ram_path)
+            missing = [name for name, address in slots
+                       if any(address + i not in ram for i in range(PROFILE_WORDS))]
+            if missing:
+                raise ValueError(f"{args.ram_path} lacks the counters of {', '.join(missing)}")
+        else:
+            ram = read_dump(args.ram_path)
+    except (OSError, ValueError) as error:
+        print(f"Error: {error}")
+        sys.exit(1)
+
+    rows = profile(slots, ram)
+    if args.sort == "calls":
+        rows.sort(key=lambda row: (-row[1], row[0]))
+    elif args.sort == "name":
+        rows.sort()
+    total = sum(row[2] for row in rows) or 1
+    print(f"{'function':32} {'calls':>10} {'instructions':>14} {'%':>6} {'per call':>10}")
+    for name, calls, instructions in rows:
+        per_call = f"{instructions / calls:.1f}" if calls else "-"
+        print(f"{name:32} {calls:10} {instructions:14} {100 * instructions / total:6.1f} {per_call:>10}")
+
+if __name__ == "__main__":
+    main()
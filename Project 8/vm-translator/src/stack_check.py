@@ -0,0 +1,89 @@
+from parser import Opcode
+from vm_optimizer import STACK_EFFECT, split_functions
+
+# Commands after which a basic block ends; labels and functions start one
+BLOCK_ENDS = {Opcode.GOTO, Opcode.IF_GOTO, Opcode.CALL, Opcode.RETURN}
+# Values a command reads off the top of the stack (call reads its arguments)
+OPERANDS = {
+    Opcode.ADD: 2, Opcode.SUB: 2, Opcode.AND: 2, Opcode.OR: 2,
+    Opcode.EQ: 2, Opcode.GT: 2, Opcode.LT: 2,
+    Opcode.NEG: 1, Opcode.NOT: 1, Opcode.POP: 1, Opcode.IF_GOTO: 1, Opcode.RETURN: 1,
+}
+
+class Block:
+    __slots__ = ("label", "commands", "effect", "lowest")
+
+    def __init__(self, label):
+        # label is None for a block entered only by falling through
+        self.label = label
+        self.commands = []
+        # net stack effect, and the lowest slot any command reads, relative
+        # to the depth at entry
+        self.effect = 0
+        self.lowest = 0
+
+def split_blocks(body):
+    blocks = [Block(None)]
+    for command in body:
+        if command.opcode is Opcode.LABEL:
+            blocks.append(Block(command.arg1))
+            continue
+        block = blocks[-1]
+        block.commands.append(command)
+        if command.opcode is Opcode.CALL:
+            block.lowest = min(block.lowest, block.effect - command.arg2)
+            block.effect += 1 - command.arg2
+        else:
+            # operands are read before the command's own effect
+            block.lowest = min(block.lowest, block.effect - OPERANDS.get(command.opcode, 0))
+            if command.opcode is not Opcode.RETURN:
+                block.effect += STACK_EFFECT[command.opcode]
+        if command.opcode in BLOCK_ENDS:
+            blocks.append(Block(None))
+    return [block for block in blocks if block.label is not None or block.commands]
+
+def _check_function(name, body):
+    # Follows every path from the function's entry (stack depth 0) and
+    # checks that each block is always entered at the same depth
+    blocks = split_blocks(body)
+    labels = {block.label: i for i, block in enumerate(blocks) if block.label is not None}
+    depths = {}
+    pending = [(0, 0, "entry")]
+    while pending:
+        i, depth, origin = pending.pop()
+        if i >= len(blocks):
+            # falls off the end of the function
+            continue
+        if i in depths:
+            if depths[i] != depth:
+                raise ValueError(f"{name}: stack depth at label {blocks[i].label} is "
+                                 f"{depths[i]} on one path and {depth} from {origin}")
+            continue
+        depths[i] = depth
+        block = blocks[i]
+        if depth + block.lowest < 0:
+            raise ValueError(f"{name}: block at {block.label or origin} pops below the frame")
+
+        last = block.commands[-1] if block.commands else None
+        exit_depth = depth + block.effect
+        if last is not None and last.opcode in (Opcode.GOTO, Opcode.IF_GOTO):
+            target = labels.get(last.arg1)
+            if target is None:
+                raise ValueError(f"{name}: jump to undefined label {last.arg1}")
+            pending.append((target, exit_depth, f"{last.opcode.value} {last.arg1}"))
+        if last is None or last.opcode not in (Opcode.GOTO, Opcode.RETURN):
+            pending.append((i + 1, exit_depth, block.label or origin))
+    return len(blocks), len(blocks) - len(depths)
+
+def check_stack_depths(program):
+    # Verifies the invariant SP batching relies on: the stack depth is fixed
+    # at every block boundary. Raises ValueError on the first violation.
+    stats = {"functions": 0, "blocks": 0, "unreachable blocks": 0}
+    for file_name, commands in program:
+        for function, body in split_functions(commands):
+            name = function.arg1 if function is not None else file_name
+            blocks, unreachable = _check_function(name, body)
+            stats["functions"] += function is not None
+            stats["blocks"] += blocks
+            stats["unreachable blocks"] += unreachable
+    return stats
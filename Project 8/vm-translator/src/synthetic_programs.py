@@ -0,0 +1,108 @@
+import os
+import random
+
+# Synthetic VM programs for benchmarking. Every generator returns
+# {file name: lines} for a directory program whose Sys.init runs the
+# workload and then parks in Sys.init$END, so an executor knows where it
+# stops. size scales the amount of work (roughly VM commands or calls).
+
+ARITHMETIC = ["add", "sub", "and", "or"]
+COMPARISONS = ["eq", "gt", "lt"]
+
+def _sys(body):
+    return ["function Sys.init 0"] + body + ["label END", "goto END"]
+
+def arithmetic_heavy(size, rnd):
+    # One long function of straight-line expressions over locals
+    lines = ["function Main.run 4"]
+    for i in range(4):
+        lines += [f"push constant {rnd.randint(0, 100)}", f"pop local {i}"]
+    for _ in range(size // 8):
+        lines += [f"push local {rnd.randrange(4)}", f"push local {rnd.randrange(4)}",
+                  rnd.choice(ARITHMETIC), f"push constant {rnd.randint(0, 9)}",
+                  rnd.choice(ARITHMETIC + COMPARISONS), rnd.choice(["neg", "not"]),
+                  f"pop local {rnd.randrange(4)}"]
+    lines += ["push local 0", "return"]
+    return {"Main": lines, "Sys": _sys(["call Main.run 0", "pop static 0"])}
+
+def call_heavy(size, rnd):
+    # A loop making size calls to small functions
+    lines = ["function Main.run 1",
+             f"push constant {size}", "pop local 0",
+             "label LOOP", "push local 0", "push constant 0", "eq", "if-goto DONE",
+             "push local 0", "push constant 3", "call Main.add 2",
+             "call Main.twice 1", "pop static 0",
+             "push local 0", "push constant 1", "sub", "pop local 0",
+             "goto LOOP",
+             "label DONE", "push static 0", "return",
+             "function Main.add 0", "push argument 0", "push argument 1", "add", "return",
+             "function Main.twice 0", "push argument 0", "push argument 0", "add", "return"]
+    return {"Main": lines, "Sys": _sys(["call Main.run 0", "pop static 0"])}
+
+def deep_recursion(size, rnd):
+    # sum(n) = n + sum(n - 1), size deep
+    lines = ["function Main.sum 0",
+             "push argument 0", "push constant 0", "eq", "if-goto BASE",
+             "push argument 0", "push argument 0", "push constant 1", "sub",
+             "call Main.sum 1", "add", "return",
+             "label BASE", "push constant 0", "return"]
+    return {"Main": lines, "Sys": _sys([f"push constant {size}", "call Main.sum 1", "pop static 0"])}
+
+def many_files(size, rnd):
+    # size files of a few functions each, all called once from Sys.init
+    files = {}
+    calls = []
+    for i in range(size):
+        name = f"Unit{i}"
+        files[name] = [f"function {name}.leaf 1",
+                       "push argument 0", f"push constant {rnd.randint(1, 50)}", "add", "pop local 0",
+                       "push local 0", "return",
+                       f"function {name}.run 0",
+                       f"push constant {i}", f"call {name}.leaf 1", "return"]
+        calls += [f"call {name}.run 0", "pop temp 0"]
+    files["Sys"] = _sys(calls)
+    return files
+
+# Statics live in RAM[16..255]; more would run into the stack
+MAX_STATICS = 240
+
+def many_statics(size, rnd):
+    # Files moving values between their statics; size statics in all
+    files = {}
+    calls = []
+    size = min(size, MAX_STATICS)
+    n_files = max(1, size // 40)
+    per_file = max(1, size // n_files)
+    for i in range(n_files):
+        name = f"Store{i}"
+        lines = [f"function {name}.run 0"]
+        for j in range(per_file):
+            lines += [f"push constant {j}", f"pop static {j}"]
+        for j in range(per_file):
+            lines += [f"push static {j}", f"push static {(j + 1) % per_file}", "add",
+                      f"pop static {rnd.randrange(per_file)}"]
+        lines += ["push static 0", "return"]
+        files[name] = lines
+        calls += [f"call {name}.run 0", "pop temp 0"]
+    files["Sys"] = _sys(calls)
+    return files
+
+SHAPES = {
+    "arithmetic": arithmetic_heavy,
+    "calls": call_heavy,
+    "recursion": deep_recursion,
+    "files": many_files,
+    "statics": many_statics,
+}
+
+def write_program(directory, shape, size, seed=0):
+    # Writes the program's .vm files into directory and returns their paths
+    files = SHAPES[shape](size, random.Random(seed))
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for name, lines in files.items():
+        path = os.path.join(directory, name + ".vm")
+        with open(path, "w") as file:
+            file.write("\n".join(lines) + "\n")
+        paths.append(path)
+    return paths
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+
+# Options that change how output is written but not what is written
+OUTPUT_NEUTRAL_OPTIONS = {"flush_threshold"}
+
+def _translator_version():
+    # Any edit to the translator's own sources invalidates every entry
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(src_dir)):
+        if name.endswith(".py"):
+            with open(os.path.join(src_dir, name), "rb") as file:
+                digest.update(file.read())
+    return digest.hexdigest()
+
+def describe_options(options):
+    parts = []
+    for name in sorted(options):
+        if name in OUTPUT_NEUTRAL_OPTIONS:
+            continue
+        value = options[name]
+        if name == "optimizer" and value is not None:
+            value = [rule_name for rule_name, _, _ in value.rules]
+        parts.append(f"{name}={value!r}")
+    return ";".join(parts)
+
+class TranslationCache:
+    # On-disk cache of per-file assembly fragments, one JSON file per entry,
+    # keyed by file content, file name (it feeds static symbols) and options.
+    # Entries are evicted least recently used first once over max_bytes.
+    def __init__(self, cache_dir, max_bytes=64 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.version = _translator_version()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, file_path, options):
+        digest = hashlib.sha256()
+        digest.update(self.version.encode())
+        digest.update(os.path.basename(file_path).encode())
+        digest.update(describe_options(options).encode())
+        with open(file_path, "rb") as file:
+            digest.update(file.read())
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def get(self, key):
+        # returns (fragment, peephole savings) or None
+        path = self._entry_path(key)
+        try:
+            with open(path, "r") as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        # Bump the mtime so eviction sees this entry as recently used
+        os.utime(path)
+        self.hits += 1
+        return entry["asm"], entry["saved"]
+
+    def put(self, key, fragment, saved):
+        path = self._entry_path(key)
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as file:
+            json.dump({"asm": fragment, "saved": saved}, file)
+        os.replace(temp_path, path)
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
+            self.evictions += 1
+
+    def report(self):
+        return f"{self.hits} hits, {self.misses} misses, {self.evictions} evicted"
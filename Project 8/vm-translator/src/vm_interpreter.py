@@ -0,0 +1,591 @@
+import argparse
+import os
+import sys
+import time
+from parser import COMPARE, Parser, Opcode
+from hack_emulator import RAM_SIZE, TestScript
+from main import list_vm_files, vm_file_name
+
+# Runs VM code directly, with the RAM layout of the translated program:
+# SP/LCL/ARG/THIS/THAT in RAM[0..4], temp at RAM[5..12], statics from
+# RAM[16] in order of first use, and the frames write_call and
+# write_return build. Labels and functions are resolved to op indices up
+# front and each command becomes a closure that returns the next index;
+# unbounded runs use single closures for common runs of commands.
+# Return addresses on the stack are op indices rather than ROM addresses.
+#
+# Speed: the target was 10x hack_emulator running the translated program;
+# measured it is 4.8x on a loop of calls and compares (4.5M commands/s
+# against 9.8M instructions/s) and 7.3x on deep recursion. Each command
+# still costs a closure call (~220ns), while the emulator compiles whole
+# Hack blocks into one Python function (~100ns per instruction, ~10 per
+# command); 10x would take compiling VM blocks the same way.
+
+SP, LCL, ARG, THIS, THAT = range(5)
+TEMP_BASE = 5
+STATIC_BASE = 16
+STACK_BASE = 256
+SEGMENT_REGISTERS = {"local": LCL, "argument": ARG, "this": THIS, "that": THAT}
+MAX_CONSTANT = 0x7FFF
+
+def load_program(vm_files):
+    return [(vm_file_name(file_path), Parser(file_path).commands) for file_path in vm_files]
+
+def _address(segment, index, statics):
+    # RAM address of a fixed segment slot, or None for based segments
+    if segment == "temp":
+        return TEMP_BASE + index
+    if segment == "pointer":
+        return THIS + index
+    if segment == "static":
+        return statics[index]
+    return None
+
+def _push(ram, segment, index, address, nxt):
+    if segment == "constant":
+        if index > MAX_CONSTANT:
+            raise ValueError(f"Constant out of range: {index}")
+        def op():
+            sp = ram[0]
+            ram[sp] = index
+            ram[0] = sp + 1
+            return nxt
+    elif segment in SEGMENT_REGISTERS:
+        base = SEGMENT_REGISTERS[segment]
+        def op():
+            sp = ram[0]
+            ram[sp] = ram[ram[base] + index]
+            ram[0] = sp + 1
+            return nxt
+    else:
+        def op():
+            sp = ram[0]
+            ram[sp] = ram[address]
+            ram[0] = sp + 1
+            return nxt
+    return op
+
+def _pop(ram, segment, index, address, nxt):
+    if segment in SEGMENT_REGISTERS:
+        base = SEGMENT_REGISTERS[segment]
+        def op():
+            sp = ram[0] - 1
+            ram[0] = sp
+            ram[ram[base] + index] = ram[sp]
+            return nxt
+    elif address is not None:
+        def op():
+            sp = ram[0] - 1
+            ram[0] = sp
+            ram[address] = ram[sp]
+            return nxt
+    else:
+        raise ValueError(f"Cannot pop to segment {segment}")
+    return op
+
+def _binary(ram, opcode, nxt):
+    # add/sub/and/or are spelled out; the rest go through a function
+    if opcode is Opcode.ADD:
+        def op():
+            sp = ram[0] - 1
+            ram[0] = sp
+            ram[sp - 1] = (ram[sp - 1] + ram[sp] + 32768 & 65535) - 32768
+            return nxt
+    elif opcode is Opcode.SUB:
+        def op():
+            sp = ram[0] - 1
+            ram[0] = sp
+            ram[sp - 1] = (ram[sp - 1] - ram[sp] + 32768 & 65535) - 32768
+            return nxt
+    elif opcode is Opcode.AND:
+        def op():
+            sp = ram[0] - 1
+            ram[0] = sp
+            ram[sp - 1] &= ram[sp]
+            return nxt
+    elif opcode is Opcode.OR:
+        def op():
+            sp = ram[0] - 1
+            ram[0] = sp
+            ram[sp - 1] |= ram[sp]
+            return nxt
+    else:
+        function = COMPARE[opcode]
+        def op():
+            sp = ram[0] - 1
+            ram[0] = sp
+            ram[sp - 1] = function(ram[sp - 1], ram[sp])
+            return nxt
+    return op
+
+def _unary(ram, opcode, nxt):
+    if opcode is Opcode.NEG:
+        def op():
+            sp = ram[0] - 1
+            ram[sp] = (32768 - ram[sp] & 65535) - 32768
+            return nxt
+    else:
+        def op():
+            sp = ram[0] - 1
+            ram[sp] = ~ram[sp]
+            return nxt
+    return op
+
+# Word results of the binary commands, for the fused ops
+OPERATIONS = {
+    Opcode.ADD: lambda x, y: (x + y + 32768 & 65535) - 32768,
+    Opcode.SUB: lambda x, y: (x - y + 32768 & 65535) - 32768,
+    Opcode.AND: lambda x, y: x & y,
+    Opcode.OR: lambda x, y: x | y,
+    **COMPARE,
+}
+
+def _reader(ram, segment, index, address):
+    # the value push segment index pushes, as a function
+    if segment == "constant":
+        return lambda: index
+    if segment in SEGMENT_REGISTERS:
+        base = SEGMENT_REGISTERS[segment]
+        return lambda: ram[ram[base] + index]
+    return lambda: ram[address]
+
+def _writer(ram, segment, index, address):
+    # stores the value pop segment index pops
+    if segment in SEGMENT_REGISTERS:
+        base = SEGMENT_REGISTERS[segment]
+        def write(value):
+            ram[ram[base] + index] = value
+        return write
+    def write(value):
+        ram[address] = value
+    return write
+
+def _fused(ram, decoded, i, fused):
+    # One op for a common run of commands starting at op i, or None. The
+    # op adds the commands it stands for past the first to fused[0], so
+    # run() still counts every command. Jumps into the run land on the
+    # single ops, which stay in place. Values a fused op never pushes are
+    # missing above SP, where nothing reads them.
+    kinds = [entry[0] for entry in decoded[i:i + 5]]
+    while len(kinds) < 5:
+        kinds.append(None)
+    reads = [_reader(ram, *entry[1:]) if entry[0] is Opcode.PUSH else None for entry in decoded[i:i + 2]]
+    if kinds[0] is Opcode.PUSH and kinds[1] is Opcode.POP:
+        read = reads[0]
+        write = _writer(ram, *decoded[i + 1][1:])
+        nxt = i + 2
+        def op():
+            write(read())
+            fused[0] += 1
+            return nxt
+        return op
+    if kinds[0] is Opcode.PUSH and kinds[1] is Opcode.PUSH and kinds[2] in OPERATIONS:
+        first, second = reads
+        operation = OPERATIONS[kinds[2]]
+        if kinds[3] is Opcode.POP:
+            write = _writer(ram, *decoded[i + 3][1:])
+            nxt = i + 4
+            def op():
+                write(operation(first(), second()))
+                fused[0] += 3
+                return nxt
+            return op
+        negate = kinds[3] is Opcode.NOT
+        if kinds[3 + negate] is Opcode.IF_GOTO:
+            target = decoded[i + 3 + negate][1]
+            nxt = i + 4 + negate
+            count = 3 + negate
+            if negate:
+                def op():
+                    fused[0] += count
+                    return nxt if operation(first(), second()) else target
+            else:
+                def op():
+                    fused[0] += count
+                    return target if operation(first(), second()) else nxt
+            return op
+        nxt = i + 3
+        def op():
+            sp = ram[0]
+            ram[sp] = operation(first(), second())
+            ram[0] = sp + 1
+            fused[0] += 2
+            return nxt
+        return op
+    if kinds[0] in COMPARE:
+        negate = kinds[1] is Opcode.NOT
+        if kinds[1 + negate] is Opcode.IF_GOTO:
+            operation = COMPARE[kinds[0]]
+            target = decoded[i + 1 + negate][1]
+            nxt = i + 2 + negate
+            count = 1 + negate
+            def op():
+                sp = ram[0] - 2
+                ram[0] = sp
+                fused[0] += count
+                if operation(ram[sp], ram[sp + 1]):
+                    return nxt if negate else target
+                return target if negate else nxt
+            return op
+    return None
+
+def _function(ram, n_vars, nxt):
+    zeros = [0] * n_vars
+    def op():
+        sp = ram[0]
+        ram[sp:sp + n_vars] = zeros
+        ram[0] = sp + n_vars
+        return nxt
+    return op
+
+def _call(ram, entry, n_args, nxt):
+    def op():
+        sp = ram[0]
+        ram[sp] = nxt
+        ram[sp + 1] = ram[1]
+        ram[sp + 2] = ram[2]
+        ram[sp + 3] = ram[3]
+        ram[sp + 4] = ram[4]
+        ram[2] = sp - n_args
+        ram[1] = ram[0] = sp + 5
+        return entry
+    return op
+
+def _return(ram):
+    def op():
+        frame = ram[1]
+        # read before the return value can overwrite it
+        address = ram[frame - 5]
+        arg = ram[2]
+        ram[arg] = ram[ram[0] - 1]
+        ram[0] = arg + 1
+        ram[4] = ram[frame - 1]
+        ram[3] = ram[frame - 2]
+        ram[2] = ram[frame - 3]
+        ram[1] = ram[frame - 4]
+        return address
+    return op
+
+def _goto(target):
+    def op():
+        return target
+    return op
+
+class _Stop(Exception):
+    # raised by the op a program stops at; ran is 1 if it counts as a step
+    def __init__(self, pc, ran):
+        self.pc = pc
+        self.ran = ran
+
+def _park(index):
+    # goto to itself: the program is done
+    def op():
+        raise _Stop(index, 1)
+    return op
+
+def _halt(index):
+    # one past the last command, where a program falls off its end or
+    # returns from its entry function
+    def op():
+        raise _Stop(index, 0)
+    return op
+
+def _if_goto(ram, target, nxt):
+    def op():
+        sp = ram[0] - 1
+        ram[0] = sp
+        return target if ram[sp] else nxt
+    return op
+
+class VMInterpreter:
+    def __init__(self, program, bootstrap=False):
+        self.ram = [0] * RAM_SIZE
+        # one op per command, then one that halts; fast_ops has fused ops
+        # in place of some, for runs nothing steps through one at a time
+        self.ops = []
+        self.fast_ops = []
+        self.fused = [0]
+        # function name -> entry index, function name per op, and every
+        # label as (function$label, index)
+        self.functions = {}
+        self.function_of = []
+        self.labels = []
+        self.returns = set()
+        self._resolve(program)
+        self._build(program)
+        self.steps = 0
+        if bootstrap:
+            # SP = 256, then call Sys.init 0; returning from it halts
+            if "Sys.init" not in self.functions:
+                raise ValueError("Bootstrap needs a Sys.init function")
+            self.ram[SP] = STACK_BASE
+            self.pc = _call(self.ram, self.functions["Sys.init"], 0, len(self.ops) - 1)()
+        else:
+            # as the VM emulator: start in Sys.init if there is one
+            self.ram[SP] = STACK_BASE
+            self.pc = self.functions.get("Sys.init", 0)
+
+    def _resolve(self, program):
+        # First pass: op indices of labels and functions, static addresses
+        self.label_index = {}
+        self.statics = {}
+        next_static = STATIC_BASE
+        index = 0
+        function = None
+        for file_name, commands in program:
+            statics = self.statics.setdefault(file_name, {})
+            for command in commands:
+                opcode = command.opcode
+                if opcode is Opcode.LABEL:
+                    label = f"{function}${command.arg1}" if function else command.arg1
+                    self.label_index[label] = index
+                    self.labels.append((label, index))
+                    continue
+                if opcode is Opcode.FUNCTION:
+                    function = command.arg1
+                    if function in self.functions:
+                        raise ValueError(f"Duplicate function: {function}")
+                    self.functions[function] = index
+                elif (opcode is Opcode.PUSH or opcode is Opcode.POP) and command.arg1 == "static":
+                    if command.arg2 not in statics:
+                        statics[command.arg2] = next_static
+                        next_static += 1
+                self.function_of.append(function)
+                index += 1
+
+    def _build(self, program):
+        ram = self.ram
+        ops = self.ops
+        # (opcode, operands) per op, for fusing
+        decoded = []
+        function = None
+        for file_name, commands in program:
+            statics = self.statics[file_name]
+            for command in commands:
+                opcode = command.opcode
+                index = len(ops)
+                nxt = index + 1
+                if opcode is Opcode.LABEL:
+                    continue
+                if opcode is Opcode.PUSH or opcode is Opcode.POP:
+                    address = _address(command.arg1, command.arg2, statics)
+                    build = _push if opcode is Opcode.PUSH else _pop
+                    op = build(ram, command.arg1, command.arg2, address, nxt)
+                    decoded.append((opcode, command.arg1, command.arg2, address))
+                elif opcode in COMPARE or opcode in (Opcode.ADD, Opcode.SUB, Opcode.AND, Opcode.OR):
+                    op = _binary(ram, opcode, nxt)
+                elif opcode is Opcode.NEG or opcode is Opcode.NOT:
+                    op = _unary(ram, opcode, nxt)
+                elif opcode is Opcode.FUNCTION:
+                    function = command.arg1
+                    op = _function(ram, command.arg2, nxt)
+                elif opcode is Opcode.CALL:
+                    entry = self.functions.get(command.arg1)
+                    if entry is None:
+                        raise ValueError(f"Call to undefined function {command.arg1}")
+                    op = _call(ram, entry, command.arg2, nxt)
+                elif opcode is Opcode.RETURN:
+                    self.returns.add(index)
+                    op = _return(ram)
+                else:
+                    label = f"{function}${command.arg1}" if function else command.arg1
+                    target = self.label_index.get(label)
+                    if target is None:
+                        raise ValueError(f"Jump to undefined label {label}")
+                    if opcode is Opcode.IF_GOTO:
+                        op = _if_goto(ram, target, nxt)
+                        decoded.append((opcode, target))
+                    elif target == index:
+                        op = _park(index)
+                    else:
+                        op = _goto(target)
+                if len(decoded) == index:
+                    decoded.append((opcode,))
+                ops.append(op)
+        ops.append(_halt(len(ops)))
+        self.function_of.append(None)
+        decoded.append((None,))
+        for i, op in enumerate(ops):
+            fused = _fused(ram, decoded, i, self.fused)
+            self.fast_ops.append(op if fused is None else fused)
+
+    def run(self, max_steps=None, profiler=None):
+        # Runs until max_steps more VM commands have run, the program
+        # returns from its entry function or falls off its end, or (without
+        # max_steps) it parks in a goto to itself. Returns the steps run.
+        if profiler is not None:
+            return self._run_profiled(max_steps, profiler)
+        ops = self.ops if max_steps is not None else self.fast_ops
+        fused = self.fused
+        fused_before = fused[0]
+        pc = self.pc
+        limit = sys.maxsize if max_steps is None else max_steps
+        steps = limit
+        step = 0
+        try:
+            for step in range(limit):
+                pc = ops[pc]()
+        except _Stop as stop:
+            pc = stop.pc
+            steps = step + stop.ran
+            if stop.ran and max_steps is not None:
+                # a bounded run spends its remaining steps parked
+                steps = max_steps
+        steps += fused[0] - fused_before
+        self.pc = pc
+        self.steps += steps
+        return steps
+
+    def _run_profiled(self, max_steps, profiler):
+        ops = self.ops
+        counts = profiler.counts
+        entries = {index: name for name, index in self.functions.items()}
+        marks = set(entries) | self.returns
+        stack = profiler.stack
+        depth = profiler.depth
+        inclusive = profiler.inclusive
+        limit = sys.maxsize if max_steps is None else max_steps
+        pc = self.pc
+        steps = 0
+        try:
+            while steps < limit:
+                if pc in marks:
+                    now = profiler.steps + steps + 1
+                    if pc in entries:
+                        name = entries[pc]
+                        stack.append((name, now))
+                        depth[name] = depth.get(name, 0) + 1
+                    elif stack:
+                        name, start = stack.pop()
+                        depth[name] -= 1
+                        # recursive activations are inside the outermost one
+                        if not depth[name]:
+                            inclusive[name] = inclusive.get(name, 0) + now - start + 1
+                next_pc = ops[pc]()
+                counts[pc] += 1
+                steps += 1
+                pc = next_pc
+        except _Stop as stop:
+            counts[pc] += stop.ran
+            steps += stop.ran
+            if stop.ran and max_steps is not None:
+                steps = max_steps
+        profiler.steps += steps
+        self.pc = pc
+        self.steps += steps
+        return steps
+
+class Profiler:
+    # Per-op execution counts collected by VMInterpreter.run, summed per
+    # function (calls, self ops, inclusive ops) and per label
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.counts = [0] * len(interpreter.ops)
+        self.steps = 0
+        # open activations as (function, step it was entered at)
+        self.stack = []
+        self.depth = {}
+        self.inclusive = {}
+
+    def functions(self):
+        # [(name, calls, self ops, inclusive ops)], most self ops first
+        interpreter = self.interpreter
+        own = {}
+        for function, count in zip(interpreter.function_of, self.counts):
+            if count:
+                own[function] = own.get(function, 0) + count
+        inclusive = dict(self.inclusive)
+        # activations still open, e.g. Sys.init, count up to now
+        open_functions = set()
+        for name, start in self.stack:
+            if name not in open_functions:
+                open_functions.add(name)
+                inclusive[name] = inclusive.get(name, 0) + self.steps - start + 1
+        rows = []
+        for name, count in own.items():
+            entry = interpreter.functions.get(name)
+            calls = self.counts[entry] if entry is not None else 0
+            rows.append((name or "(top level)", calls, count, inclusive.get(name, count)))
+        rows.sort(key=lambda row: -row[2])
+        return rows
+
+    def hottest_labels(self, limit=10):
+        counts = self.counts
+        end = len(counts)
+        rows = [(label, counts[index]) for label, index in self.interpreter.labels
+                if index < end and counts[index]]
+        rows.sort(key=lambda row: -row[1])
+        return rows[:limit]
+
+class VMTestScript(TestScript):
+    # Runs a VM emulator (VME) .tst script: vmstep instead of ticktock, and
+    # sp/local/argument/this/that and segment[i] as script variables
+    STEP = "vmstep"
+
+    def load(self, name):
+        path = os.path.join(self.directory, name)
+        vm_files = list_vm_files(path) if os.path.isdir(path) else [path]
+        self.emulator = VMInterpreter(load_program(vm_files))
+
+    def step(self, count):
+        self.emulator.run(count)
+
+    def set(self, target, value):
+        ram = self.emulator.ram
+        name, _, index = target.partition("[")
+        if name == "sp":
+            ram[SP] = value
+        elif name in SEGMENT_REGISTERS:
+            register = SEGMENT_REGISTERS[name]
+            if index:
+                ram[ram[register] + int(index[:-1])] = value
+            else:
+                ram[register] = value
+        else:
+            super().set(target, value)
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Run VM code without translating it")
+    arg_parser.add_argument("input_path", help=".vm file, directory of .vm files, or a VME .tst script")
+    arg_parser.add_argument("--steps", type=int, default=None, metavar="N",
+                            help="stop after N VM commands instead of when the program parks")
+    arg_parser.add_argument("--profile", action="store_true",
+                            help="report calls and VM ops per function, and the hottest labels")
+    arg_parser.add_argument("--top", type=int, default=10, metavar="N",
+                            help="functions and labels to list with --profile")
+    args = arg_parser.parse_args()
+
+    if args.input_path.endswith(".tst"):
+        script = VMTestScript(args.input_path)
+        script.run()
+        mismatch = script.compare()
+        if mismatch is not None:
+            line, want, got = mismatch
+            print(f"Comparison failure at line {line}: expected {want.strip()}, got {got.strip()}")
+            sys.exit(1)
+        print("End of script - Comparison ended successfully")
+        return
+
+    if os.path.isdir(args.input_path):
+        interpreter = VMInterpreter(load_program(list_vm_files(args.input_path)), bootstrap=True)
+    else:
+        interpreter = VMInterpreter(load_program([args.input_path]))
+    profiler = Profiler(interpreter) if args.profile else None
+    start = time.perf_counter()
+    interpreter.run(args.steps, profiler)
+    elapsed = time.perf_counter() - start
+
+    print(f"VM commands: {interpreter.steps}")
+    print(f"SP: {interpreter.ram[SP]}")
+    if elapsed > 0:
+        print(f"speed: {interpreter.steps / elapsed / 1e6:.2f}M commands/s")
+    if profiler is not None:
+        print(f"{'function':32} {'calls':>10} {'self ops':>12} {'inclusive ops':>14}")
+        for name, calls, own, inclusive in profiler.functions()[:args.top]:
+            print(f"{name:32} {calls:10} {own:12} {inclusive:14}")
+        print(f"{'label':32} {'reached':>10}")
+        for label, count in profiler.hottest_labels(args.top):
+            print(f"{label:32} {count:10}")
+
+if __name__ == "__main__":
+    main()
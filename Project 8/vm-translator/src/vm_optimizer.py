@@ -0,0 +1,464 @@
+from parser import COMPARE, Opcode, Command, to_word
+
+# Whole-program passes over parsed VM code. A program is a list of
+# (file_name, commands) pairs in translation order; each pass takes the
+# program and the VMOptimizer running it (for the entry point and tuning
+# settings) and returns the rewritten program and a dict of statistics
+# for the report. Command records may be shared, so passes build new
+# lists instead of editing them.
+
+# Stack effect of the commands that only push or pop
+STACK_EFFECT = {
+    Opcode.PUSH: 1, Opcode.POP: -1, Opcode.IF_GOTO: -1,
+    Opcode.ADD: -1, Opcode.SUB: -1, Opcode.AND: -1, Opcode.OR: -1,
+    Opcode.EQ: -1, Opcode.GT: -1, Opcode.LT: -1,
+    Opcode.NEG: 0, Opcode.NOT: 0, Opcode.LABEL: 0, Opcode.GOTO: 0,
+}
+
+# Rough Hack instruction counts used by the inlining cost model
+COMMAND_COST = 10
+CALL_COST = 50
+
+def split_functions(commands):
+    # [(function command or None, body commands)] in order
+    functions = [(None, [])]
+    for command in commands:
+        if command.opcode is Opcode.FUNCTION:
+            functions.append((command, []))
+        else:
+            functions[-1][1].append(command)
+    if not functions[0][1]:
+        functions.pop(0)
+    return functions
+
+def _returns_single_value(body):
+    # True when the stack depth is consistent at every label and each
+    # return leaves exactly the return value on the function's stack
+    depth = 0
+    label_depths = {}
+    reachable = True
+    for command in body:
+        opcode = command.opcode
+        if opcode is Opcode.LABEL:
+            known = label_depths.get(command.arg1)
+            if reachable:
+                if known is not None and known != depth:
+                    return False
+                label_depths[command.arg1] = depth
+            elif known is None:
+                return False
+            else:
+                depth = known
+            reachable = True
+            continue
+        if not reachable:
+            continue
+        if opcode is Opcode.RETURN:
+            if depth != 1:
+                return False
+            reachable = False
+            continue
+        if opcode not in STACK_EFFECT:
+            return False
+        depth += STACK_EFFECT[opcode]
+        if depth < 0:
+            return False
+        if opcode in (Opcode.GOTO, Opcode.IF_GOTO):
+            known = label_depths.setdefault(command.arg1, depth)
+            if known != depth:
+                return False
+            if opcode is Opcode.GOTO:
+                reachable = False
+    return not reachable
+
+def _inline_candidate(function, body, file_name):
+    # A small leaf whose frame can move into its callers' frames
+    n_locals = function.arg2
+    n_args = 0
+    uses_static = False
+    for command in body:
+        if command.opcode is Opcode.CALL:
+            return None
+        if command.opcode in (Opcode.PUSH, Opcode.POP):
+            segment = command.arg1
+            if segment == "pointer" and command.opcode is Opcode.POP:
+                # THIS/THAT would not be restored by a return
+                return None
+            if segment == "local" and command.arg2 >= n_locals:
+                return None
+            if segment == "argument":
+                n_args = max(n_args, command.arg2 + 1)
+            uses_static = uses_static or segment == "static"
+    if not _returns_single_value(body):
+        return None
+    # n_args is the fewest arguments a call site must pass
+    return {"file_name": file_name, "n_args": n_args, "n_locals": n_locals,
+            "body": body, "uses_static": uses_static}
+
+def _inline_body(callee, candidate, n_args, site, base):
+    # The callee's body for one call site: arguments and locals move to the
+    # caller's locals from base on, labels get a per-site prefix, returns
+    # jump to the end
+    prefix = f"{callee}$inline.{site}."
+    end_label = f"{callee}$inline.{site}"
+    n_locals = candidate["n_locals"]
+    commands = [Command(Opcode.POP, "local", base + i) for i in reversed(range(n_args))]
+    for i in range(n_locals):
+        commands.append(Command(Opcode.PUSH, "constant", 0))
+        commands.append(Command(Opcode.POP, "local", base + n_args + i))
+
+    body = candidate["body"]
+    for i, command in enumerate(body):
+        opcode = command.opcode
+        if opcode in (Opcode.PUSH, Opcode.POP) and command.arg1 == "argument":
+            command = Command(opcode, "local", base + command.arg2)
+        elif opcode in (Opcode.PUSH, Opcode.POP) and command.arg1 == "local":
+            command = Command(opcode, "local", base + n_args + command.arg2)
+        elif opcode in (Opcode.LABEL, Opcode.GOTO, Opcode.IF_GOTO):
+            command = Command(opcode, prefix + command.arg1)
+        elif opcode is Opcode.RETURN:
+            if i == len(body) - 1:
+                break
+            command = Command(Opcode.GOTO, end_label)
+        commands.append(command)
+    commands.append(Command(Opcode.LABEL, end_label))
+    return commands
+
+def inline_leaf_functions(program, optimizer):
+    # Replaces calls to small leaf functions with their bodies. The callee's
+    # arguments and locals live on the caller's stack, in locals the
+    # caller's frame gains past its own (shared by its sites, since leaves
+    # never call).
+    candidates = {}
+    call_counts = {}
+    for file_name, commands in program:
+        for function, body in split_functions(commands):
+            if function is not None and len(body) <= optimizer.inline_max_size:
+                candidate = _inline_candidate(function, body, file_name)
+                if candidate is not None:
+                    candidates[function.arg1] = candidate
+        for command in commands:
+            if command.opcode is Opcode.CALL:
+                call_counts[command.arg1] = call_counts.get(command.arg1, 0) + 1
+
+    # Cost model: inline while the code growth over all call sites stays
+    # within budget, cheapest first; bodies cheaper than the call protocol
+    # shrink the code and always win
+    site_growth = {}
+    for name, candidate in candidates.items():
+        if name != optimizer.entry:
+            site_cost = COMMAND_COST * (len(candidate["body"]) + candidate["n_args"]
+                                        + 2 * candidate["n_locals"])
+            site_growth[name] = site_cost - CALL_COST
+    chosen = {}
+    budget = 0
+    for name in sorted(site_growth, key=lambda name: (call_counts.get(name, 0) * site_growth[name], name)):
+        growth = call_counts.get(name, 0) * site_growth[name]
+        if growth > 0 and budget + growth > optimizer.inline_max_growth:
+            break
+        chosen[name] = candidates[name]
+        budget += growth
+
+    sites = 0
+    inlined = set()
+    total_growth = 0
+    result = []
+    for file_name, commands in program:
+        rewritten = []
+        for function, body in split_functions(commands):
+            if function is None:
+                # code outside a function has no frame to lend
+                rewritten.extend(body)
+                continue
+            base = function.arg2
+            extra_locals = 0
+            inlined_body = []
+            for command in body:
+                candidate = chosen.get(command.arg1) if command.opcode is Opcode.CALL else None
+                # static symbols are named after the file translating them
+                if (candidate is not None and command.arg2 >= candidate["n_args"]
+                        and (candidate["file_name"] == file_name or not candidate["uses_static"])):
+                    inlined_body.extend(_inline_body(command.arg1, candidate, command.arg2, sites, base))
+                    extra_locals = max(extra_locals, command.arg2 + candidate["n_locals"])
+                    inlined.add(command.arg1)
+                    sites += 1
+                    total_growth += site_growth[command.arg1]
+                else:
+                    inlined_body.append(command)
+            if extra_locals:
+                function = Command(Opcode.FUNCTION, function.arg1, base + extra_locals)
+            rewritten.append(function)
+            rewritten.extend(inlined_body)
+        result.append((file_name, rewritten))
+    return result, {"functions inlined": len(inlined), "call sites inlined": sites,
+                    "estimated growth": total_growth}
+
+# Constant semantics of the arithmetic commands
+FOLD_BINARY = {
+    Opcode.ADD: lambda x, y: x + y,
+    Opcode.SUB: lambda x, y: x - y,
+    Opcode.AND: lambda x, y: x & y,
+    Opcode.OR: lambda x, y: x | y,
+    **COMPARE,
+}
+FOLD_UNARY = {
+    Opcode.NEG: lambda x: -x,
+    Opcode.NOT: lambda x: ~x,
+}
+# (operation, constant operand) pairs that leave the other operand as is
+IDENTITIES = {(Opcode.ADD, 0), (Opcode.SUB, 0), (Opcode.OR, 0), (Opcode.AND, -1)}
+# ...in either operand position
+COMMUTATIVE = {Opcode.ADD, Opcode.AND, Opcode.OR}
+
+class _Constant:
+    # a known value on top of the stack and the commands that pushed it
+    __slots__ = ("value", "commands")
+
+    def __init__(self, value, commands=None):
+        self.value = to_word(value)
+        self.commands = commands
+
+    def materialize(self):
+        if self.commands is None:
+            # push constant only takes 0..32767, so negatives push ~value
+            if self.value >= 0:
+                self.commands = [Command(Opcode.PUSH, "constant", self.value)]
+            else:
+                self.commands = [Command(Opcode.PUSH, "constant", ~self.value),
+                                 Command(Opcode.NOT, "not")]
+        return self.commands
+
+def _fold_commands(commands, stats):
+    # Works on a stack of emitted items, so folding only ever looks at what
+    # was pushed last; any other command (a label included) is a barrier
+    items = []
+    for command in commands:
+        opcode = command.opcode
+        top = items[-1] if items else None
+        if opcode is Opcode.PUSH and command.arg1 == "constant":
+            items.append(_Constant(command.arg2, [command]))
+            continue
+        if opcode in FOLD_UNARY:
+            if top.__class__ is _Constant:
+                value = FOLD_UNARY[opcode](top.value)
+                if top.commands is not None and len(top.commands) == 1:
+                    # push constant n / neg is already as short as it gets
+                    items[-1] = _Constant(value, top.commands + [command])
+                else:
+                    items[-1] = _Constant(value)
+                    stats["folded"] += 1
+                continue
+            if top.__class__ is Command and top.opcode is opcode:
+                # neg neg and not not cancel out
+                items.pop()
+                stats["simplified"] += 1
+                continue
+        elif opcode in FOLD_BINARY:
+            second = items[-2] if len(items) >= 2 else None
+            if top.__class__ is _Constant and second.__class__ is _Constant:
+                items[-2:] = [_Constant(FOLD_BINARY[opcode](second.value, top.value))]
+                stats["folded"] += 1
+                continue
+            if top.__class__ is _Constant and (opcode, top.value) in IDENTITIES:
+                items.pop()
+                stats["simplified"] += 1
+                continue
+            if (second.__class__ is _Constant and opcode in COMMUTATIVE
+                    and (opcode, second.value) in IDENTITIES
+                    and top.__class__ is Command and top.opcode is Opcode.PUSH):
+                del items[-2]
+                stats["simplified"] += 1
+                continue
+        items.append(command)
+
+    result = []
+    for item in items:
+        if item.__class__ is _Constant:
+            result.extend(item.materialize())
+        else:
+            result.append(item)
+    return result
+
+def fold_constants(program, optimizer):
+    # Evaluates arithmetic on constants at translation time with 16-bit
+    # wraparound and drops operations that leave their operand unchanged
+    stats = {"folded": 0, "simplified": 0}
+    result = [(file_name, _fold_commands(commands, stats)) for file_name, commands in program]
+    stats["commands removed"] = (sum(len(commands) for _, commands in program)
+                                 - sum(len(commands) for _, commands in result))
+    return result, stats
+
+JUMPS = (Opcode.GOTO, Opcode.IF_GOTO)
+
+def _thread_jumps(body, stats):
+    # Points jumps at the end of any goto chain they start
+    forwards = {}
+    for i, command in enumerate(body):
+        if command.opcode is Opcode.LABEL:
+            j = i + 1
+            while j < len(body) and body[j].opcode is Opcode.LABEL:
+                j += 1
+            if j < len(body) and body[j].opcode is Opcode.GOTO:
+                forwards[command.arg1] = body[j].arg1
+
+    result = []
+    for command in body:
+        if command.opcode in JUMPS and command.arg1 in forwards:
+            target = command.arg1
+            seen = {target}
+            while target in forwards and forwards[target] not in seen:
+                target = forwards[target]
+                seen.add(target)
+            if target != command.arg1:
+                command = Command(command.opcode, target)
+                stats["jumps threaded"] += 1
+        result.append(command)
+    return result
+
+def _remove_unreachable(body, stats):
+    # Keeps the commands some path from the function's entry reaches
+    labels = {command.arg1: i for i, command in enumerate(body) if command.opcode is Opcode.LABEL}
+    reachable = [False] * len(body)
+    pending = [0]
+    while pending:
+        i = pending.pop()
+        while i < len(body) and not reachable[i]:
+            reachable[i] = True
+            command = body[i]
+            if command.opcode in JUMPS and command.arg1 in labels:
+                pending.append(labels[command.arg1])
+            if command.opcode in (Opcode.GOTO, Opcode.RETURN):
+                break
+            i += 1
+    result = [command for i, command in enumerate(body) if reachable[i]]
+    stats["unreachable commands removed"] += len(body) - len(result)
+    return result
+
+def _remove_redundant_jumps(body, stats):
+    # Drops gotos to the label right after them (past any other labels),
+    # then labels nothing jumps to
+    result = []
+    for i, command in enumerate(body):
+        if command.opcode is Opcode.GOTO:
+            j = i + 1
+            while j < len(body) and body[j].opcode is Opcode.LABEL and body[j].arg1 != command.arg1:
+                j += 1
+            if j < len(body) and body[j].opcode is Opcode.LABEL:
+                stats["gotos removed"] += 1
+                continue
+        result.append(command)
+
+    targets = {command.arg1 for command in result if command.opcode in JUMPS}
+    body = result
+    result = [command for command in body
+              if command.opcode is not Opcode.LABEL or command.arg1 in targets]
+    stats["labels removed"] += len(body) - len(result)
+    return result
+
+def clean_control_flow(program, optimizer):
+    # Per function, since labels are scoped by function name: threads jump
+    # chains, removes unreachable code, redundant gotos and unused labels,
+    # repeating until nothing changes
+    stats = {"jumps threaded": 0, "unreachable commands removed": 0,
+             "gotos removed": 0, "labels removed": 0}
+    result = []
+    for file_name, commands in program:
+        rewritten = []
+        for function, body in split_functions(commands):
+            while True:
+                size = len(body)
+                threaded = stats["jumps threaded"]
+                body = _thread_jumps(body, stats)
+                body = _remove_unreachable(body, stats)
+                body = _remove_redundant_jumps(body, stats)
+                if len(body) == size and stats["jumps threaded"] == threaded:
+                    break
+            if function is not None:
+                rewritten.append(function)
+            rewritten.extend(body)
+        result.append((file_name, rewritten))
+    return result, stats
+
+def eliminate_dead_functions(program, optimizer):
+    # Keeps only functions reachable from the entry point (and from any
+    # code that sits outside a function)
+    entry = optimizer.entry
+    if entry is None:
+        return program, {}
+
+    calls = {}
+    roots = [entry]
+    for _, commands in program:
+        current = None
+        for command in commands:
+            if command.opcode is Opcode.FUNCTION:
+                current = calls.setdefault(command.arg1, [])
+            elif command.opcode is Opcode.CALL:
+                (roots if current is None else current).append(command.arg1)
+    if entry not in calls:
+        return program, {}
+
+    reachable = set()
+    pending = roots
+    while pending:
+        function_name = pending.pop()
+        if function_name not in reachable:
+            reachable.add(function_name)
+            pending.extend(calls.get(function_name, ()))
+
+    functions_removed = 0
+    commands_removed = 0
+    result = []
+    for file_name, commands in program:
+        kept = []
+        dropped = []
+        keep = True
+        for command in commands:
+            if command.opcode is Opcode.FUNCTION:
+                keep = command.arg1 in reachable
+                if not keep:
+                    functions_removed += 1
+            if keep:
+                kept.append(command)
+            else:
+                dropped.append(command)
+                commands_removed += 1
+        result.append((file_name, kept))
+        if dropped:
+            optimizer.removed.append((file_name, dropped))
+    return result, {"functions removed": functions_removed, "commands removed": commands_removed}
+
+# Passes in the order -O2 runs them
+PASSES = {
+    "inline": inline_leaf_functions,
+    "cfg-cleanup": clean_control_flow,
+    "constant-folding": fold_constants,
+    "dead-functions": eliminate_dead_functions,
+}
+
+class VMOptimizer:
+    def __init__(self, passes=None, entry=None, inline_max_size=12, inline_max_growth=1000):
+        # entry is the function the bootstrap calls, None without a bootstrap
+        self.passes = list(PASSES) if passes is None else passes
+        self.entry = entry
+        # largest callee body (in VM commands) and total estimated code
+        # growth (in Hack instructions) the inliner accepts
+        self.inline_max_size = inline_max_size
+        self.inline_max_growth = inline_max_growth
+        self.stats = {}
+        # the functions dead-functions dropped, as (file_name, commands),
+        # so the saving can be measured in Hack instructions
+        self.removed = []
+
+    def optimize(self, program):
+        for name in self.passes:
+            program, stats = PASSES[name](program, self)
+            totals = self.stats.setdefault(name, {})
+            for key, value in stats.items():
+                totals[key] = totals.get(key, 0) + value
+        return program
+
+    def report(self):
+        return "; ".join(
+            f"{name}: " + (", ".join(f"{key} {value}" for key, value in stats.items()) or "skipped")
+            for name, stats in self.stats.items())
@@ -0,0 +1,358 @@
+import os
+import re
+import shutil
+from main import translate
+
+# Shared by the tests: the course fixtures, translated into a scratch
+# directory so the tracked .asm files are never overwritten, and a small
+# program with known results. Translations run on the reference Hack CPU
+# below, a plain fetch-execute loop kept apart from the translator's code.
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+# fixture -> (directory, translated as a whole directory with the bootstrap)
+FIXTURES = {
+    "SimpleAdd": ("Project 7/vm-translator/StackArithmetic/SimpleAdd", False),
+    "StackTest": ("Project 7/vm-translator/StackArithmetic/StackTest", False),
+    "BasicTest": ("Project 7/vm-translator/MemoryAccess/BasicTest", False),
+    "PointerTest": ("Project 7/vm-translator/MemoryAccess/PointerTest", False),
+    "StaticTest": ("Project 7/vm-translator/MemoryAccess/StaticTest", False),
+    "BasicLoop": ("Project 8/vm-translator/ProgramFlow/BasicLoop", False),
+    "FibonacciSeries": ("Project 8/vm-translator/ProgramFlow/FibonacciSeries", False),
+    "SimpleFunction": ("Project 8/vm-translator/FunctionCalls/SimpleFunction", False),
+    "NestedCall": ("Project 8/vm-translator/FunctionCalls/NestedCall", True),
+    "FibonacciElement": ("Project 8/vm-translator/FunctionCalls/FibonacciElement", True),
+    "StaticsTest": ("Project 8/vm-translator/FunctionCalls/StaticsTest", True),
+}
+# the fixtures that need the bootstrap and the call protocol
+PROGRAM_FIXTURES = [name for name, (_, is_multi_file) in FIXTURES.items() if is_multi_file]
+
+def list_program(directory):
+    # the .vm files in directory in translation order: Sys.vm first
+    names = sorted(name for name in os.listdir(directory) if name.endswith(".vm"))
+    if "Sys.vm" in names:
+        names.remove("Sys.vm")
+        names.insert(0, "Sys.vm")
+    return [os.path.join(directory, name) for name in names]
+
+def copy_fixture(name, directory):
+    # the fixture's .vm files and its VME-free .tst/.cmp pair
+    source = os.path.join(REPOSITORY, FIXTURES[name][0])
+    target = os.path.join(directory, name)
+    os.makedirs(target)
+    for file_name in os.listdir(source):
+        if file_name.endswith((".vm", ".cmp")) or (file_name.endswith(".tst") and "VME" not in file_name):
+            shutil.copy(os.path.join(source, file_name), target)
+    return target
+
+def translate_fixture(name, directory, **options):
+    # Returns the path of the translated .asm
+    target = copy_fixture(name, directory)
+    if FIXTURES[name][1]:
+        vm_files, is_multi_file = list_program(target), True
+    else:
+        vm_files, is_multi_file = [os.path.join(target, name + ".vm")], False
+    output_path = os.path.join(target, name + ".asm")
+    translate(vm_files, output_path, is_multi_file, **options)
+    return output_path
+
+PREDEFINED_SYMBOLS = dict({"SP": 0, "LCL": 1, "ARG": 2, "THIS": 3, "THAT": 4,
+                           "SCREEN": 16384, "KBD": 24576},
+                          **{f"R{i}": i for i in range(16)})
+JUMPS = {
+    "JGT": lambda value: value > 0, "JEQ": lambda value: value == 0,
+    "JGE": lambda value: value >= 0, "JLT": lambda value: value < 0,
+    "JNE": lambda value: value != 0, "JLE": lambda value: value <= 0,
+    "JMP": lambda value: True,
+}
+
+def assemble(lines):
+    # (address,) per A-instruction and (comp, reads M, dest, jump) per
+    # C-instruction, with comp a function of A, D and M
+    symbols = dict(PREDEFINED_SYMBOLS)
+    instructions = []
+    for line in lines:
+        line = line.split("//")[0].strip()
+        if line.startswith("("):
+            symbols[line[1:-1]] = len(instructions)
+        elif line:
+            instructions.append(line)
+    program = []
+    comps = {}
+    next_variable = 16
+    for instruction in instructions:
+        if instruction.startswith("@"):
+            symbol = instruction[1:]
+            if symbol.isdigit():
+                program.append((int(symbol),))
+                continue
+            if symbol not in symbols:
+                symbols[symbol] = next_variable
+                next_variable += 1
+            program.append((symbols[symbol],))
+            continue
+        dest, _, rest = instruction.rpartition("=")
+        comp, _, jump = rest.partition(";")
+        if comp not in comps:
+            comps[comp] = eval("lambda A, D, M: " + comp.replace("!", "~"))
+        program.append((comps[comp], "M" in comp, dest, JUMPS.get(jump)))
+    return program
+
+class HackCPU:
+    def __init__(self, asm_path):
+        with open(asm_path, "r") as file:
+            self.program = assemble(file)
+        self.ram = [0] * 32768
+        self.a = self.d = self.pc = 0
+        self.cycles = 0
+
+    def run(self, max_cycles=None):
+        # Runs until the program ends, max_cycles pass or it parks in an
+        # idle loop ((X) @X 0;JMP), which is counted once round
+        program = self.program
+        ram = self.ram
+        a, d, pc = self.a, self.d, self.pc
+        cycles = 0
+        while pc < len(program) and cycles != max_cycles:
+            instruction = program[pc]
+            cycles += 1
+            if len(instruction) == 1:
+                a = instruction[0]
+                pc += 1
+                continue
+            comp, reads_m, dest, jump = instruction
+            value = (comp(a, d, ram[a] if reads_m else 0) + 32768 & 65535) - 32768
+            target = a
+            if "M" in dest:
+                ram[a] = value
+            if "A" in dest:
+                a = value
+            if "D" in dest:
+                d = value
+            if jump is not None and jump(value):
+                parked = target == pc - 1 and program[target] == (target,)
+                pc = target
+                if parked:
+                    break
+            else:
+                pc += 1
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += cycles
+        return self
+
+def run_script(tst_path):
+    # The RAM values a fixture's CPU emulator script outputs, run on the
+    # translated .asm: its set commands, then its repeat's cycles
+    with open(tst_path, "r") as file:
+        script = re.sub(r"//[^\n]*", "", file.read())
+    cpu = HackCPU(os.path.join(os.path.dirname(tst_path), re.search(r"load\s+([^\s,;]+)", script).group(1)))
+    for address, value in re.findall(r"set\s+RAM\[(\d+)\]\s+(-?\d+)", script):
+        cpu.ram[int(address)] = int(value)
+    cpu.run(int(re.search(r"repeat\s+(\d+)", script).group(1)))
+    return [cpu.ram[int(address)] for address in re.findall(r"RAM\[(\d+)\]%", script)]
+
+def fixture_mismatch(name, directory, **options):
+    # None when the fixture's script outputs the values its .cmp file
+    # holds, else (expected, actual)
+    output_path = translate_fixture(name, directory, **options)
+    base = os.path.splitext(output_path)[0]
+    actual = run_script(base + ".tst")
+    expected = []
+    with open(base + ".cmp", "r") as file:
+        for line in file:
+            if "RAM[" not in line:
+                expected += [int(cell) for cell in line.split("|") if cell.strip()]
+    return None if actual == expected else (expected, actual)
+
+# that[i] holds result i when Sys.init parks
+RESULTS_BASE = 3100
+PROGRAM = {
+    "Sys": """
+function Sys.init 0
+push constant 3000
+pop pointer 0
+push constant 3100
+pop pointer 1
+call Main.main 0
+pop temp 0
+label HALT
+goto HALT
+""",
+    "Main": """
+// 0: a counted loop over a small leaf function
+function Main.main 2
+push constant 0
+pop local 0
+push constant 0
+pop local 1
+label LOOP
+push local 0
+push constant 20
+lt
+not
+if-goto DONE
+push local 1
+push local 0
+push constant 7
+call Main.mix 2
+add
+pop local 1
+push local 0
+push constant 1
+add
+pop local 0
+goto LOOP
+label DONE
+push local 1
+pop that 0
+// 1: recursion
+push constant 10
+call Main.fib 1
+pop that 1
+// 2: a self tail call, 3: a tail call with a different argument count
+push constant 100
+push constant 0
+call Main.sum 2
+pop that 2
+push constant 10
+call Main.hop 1
+pop that 3
+// 4: a comparison whose difference overflows
+push constant 32767
+push constant 2
+neg
+gt
+pop that 4
+// 5: constant arithmetic
+push constant 3
+push constant 4
+add
+push constant 0
+add
+not
+pop that 5
+// 6, 7: static, temp and this round trips
+push constant 9
+pop static 3
+push static 3
+pop temp 6
+push temp 6
+push constant 1
+sub
+pop this 2
+push this 2
+pop that 6
+push that 6
+push constant 8
+eq
+pop that 7
+// 8: locals start at zero whatever the stack held before
+call Main.wide 0
+pop that 8
+push constant 0
+return
+
+function Main.mix 0
+push argument 0
+push argument 1
+and
+push argument 0
+or
+return
+
+function Main.fib 0
+push argument 0
+push constant 2
+lt
+if-goto BASE
+push argument 0
+push constant 1
+sub
+call Main.fib 1
+push argument 0
+push constant 2
+sub
+call Main.fib 1
+add
+return
+label BASE
+push argument 0
+return
+
+// sum(n, total) = total + n + ... + 1
+function Main.sum 0
+push argument 0
+push constant 0
+eq
+if-goto DONE
+push argument 0
+push constant 1
+sub
+push argument 1
+push argument 0
+add
+call Main.sum 2
+return
+label DONE
+push argument 1
+return
+
+function Main.hop 0
+push argument 0
+push constant 0
+call Main.sum 2
+return
+
+function Main.wide 12
+push local 0
+push local 5
+add
+push local 11
+or
+return
+
+function Main.unused 0
+push constant 1
+return
+""",
+}
+# what the program leaves in that[0..8], and in SP once Sys.init parks
+EXPECTED_RESULTS = [190, 55, 5050, 55, 0, -8, 8, -1, 0]
+EXPECTED_SP = 261
+
+def write_program(directory, files=PROGRAM):
+    for name, text in files.items():
+        with open(os.path.join(directory, name + ".vm"), "w") as file:
+            file.write(text.lstrip())
+    return str(directory)
+
+def run_translated(directory, **options):
+    # Translates the program in directory with the bootstrap and runs it
+    # until it parks; returns the CPU
+    output_path = os.path.join(directory, "Program.asm")
+    translate(list_program(directory), output_path, True, **options)
+    return HackCPU(output_path).run()
+
+def results(ram, count=len(EXPECTED_RESULTS)):
+    return [ram[address] for address in range(RESULTS_BASE, RESULTS_BASE + count)]
+
+def assert_results(directory, **options):
+    # The program, translated with options, ends with the known stack
+    # pointer and results; returns the CPU
+    write_program(directory)
+    cpu = run_translated(directory, **options)
+    assert cpu.ram[0] == EXPECTED_SP
+    assert results(cpu.ram) == EXPECTED_RESULTS
+    return cpu
+
+def command_code(asm_path):
+    # [(comment, instructions)] for each "// ..." comment the writer puts
+    # before a command's code, with the instructions up to the next one
+    sections = []
+    with open(asm_path, "r") as file:
+        for line in file:
+            line = line.strip()
+            if line.startswith("//"):
+                sections.append((line, []))
+            elif line and not line.startswith("(") and sections:
+                sections[-1][1].append(line)
+    return sections
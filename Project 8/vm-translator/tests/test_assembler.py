@@ -0,0 +1,54 @@
+import pytest
+from assembler import HackAssembler, assemble_file
+from helpers import assert_results, write_program
+from main import count_instructions, list_vm_files, translate
+
+SOURCE = """// comment
+(LOOP)
+@2
+D=A
+@x
+M=D   // trailing comment
+@LOOP
+0;JMP
+@y
+@x
+"""
+
+def test_assembles_labels_and_variables(tmp_path):
+    asm_path = tmp_path / "Prog.asm"
+    asm_path.write_text(SOURCE)
+    assemble_file(str(asm_path), str(tmp_path / "Prog.hack"))
+    assert (tmp_path / "Prog.hack").read_text().split() == [
+        "0000000000000010", "1110110000010000", "0000000000010000", "1110001100001000",
+        "0000000000000000", "1110101010000111", "0000000000010001", "0000000000010000"]
+
+def test_duplicate_label(tmp_path):
+    asm_path = tmp_path / "Prog.asm"
+    asm_path.write_text("(A)\n(A)\n")
+    with pytest.raises(ValueError, match="Duplicate label"):
+        assemble_file(str(asm_path), str(tmp_path / "Prog.hack"))
+
+def test_one_word_per_instruction(tmp_path):
+    assert_results(tmp_path)
+    asm_path = str(tmp_path / "Program.asm")
+    assemble_file(asm_path, str(tmp_path / "Program.hack"))
+    words = (tmp_path / "Program.hack").read_text().split()
+    assert len(words) == count_instructions(asm_path)
+    assert all(len(word) == 16 and set(word) <= {"0", "1"} for word in words)
+
+@pytest.mark.parametrize("options", [{}, {"jobs": 2}])
+def test_emit_hack_matches_assembling_the_asm(tmp_path, options):
+    # the writer's own lines, or whole per-file fragments with jobs
+    write_program(tmp_path)
+    vm_files = list_vm_files(tmp_path)
+    translate(vm_files, str(tmp_path / "Program.asm"), True, **options)
+    assemble_file(str(tmp_path / "Program.asm"), str(tmp_path / "Expected.hack"))
+    hack_path = str(tmp_path / "Program.hack")
+    packed_path = str(tmp_path / "Program.bin")
+    translate(vm_files, hack_path, True, output_file=HackAssembler(hack_path, packed_path), **options)
+    words = (tmp_path / "Program.hack").read_text().split()
+    assert words == (tmp_path / "Expected.hack").read_text().split()
+    packed = (tmp_path / "Program.bin").read_bytes()
+    unpacked = [int.from_bytes(packed[i:i + 2], "big") for i in range(0, len(packed), 2)]
+    assert unpacked == [int(word, 2) for word in words]
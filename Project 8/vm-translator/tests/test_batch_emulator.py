@@ -0,0 +1,69 @@
+import pytest
+from hack_emulator import HackEmulator, load_program
+from helpers import write_program
+from main import list_vm_files, translate
+
+np = pytest.importorskip("numpy")
+from batch_emulator import BatchEmulator
+
+# Sums n down to 1, reading n from RAM[5000] and leaving the sum in RAM[5001]
+SUM = {"Sys": """
+function Sys.init 1
+push constant 5000
+pop pointer 1
+label LOOP
+push that 0
+push constant 0
+gt
+not
+if-goto DONE
+push local 0
+push that 0
+add
+pop local 0
+push that 0
+push constant 1
+sub
+pop that 0
+goto LOOP
+label DONE
+push local 0
+pop that 1
+label HALT
+goto HALT
+"""}
+INPUTS = [0, 1, 5, 30, -3, 181]
+
+def translated(tmp_path):
+    write_program(tmp_path, SUM)
+    output_path = str(tmp_path / "Sum.asm")
+    translate(list_vm_files(tmp_path), output_path, True)
+    return load_program(output_path)
+
+def test_instances_match_the_emulator(tmp_path):
+    words = translated(tmp_path)
+    batch = BatchEmulator(words, len(INPUTS))
+    batch.ram[:, 5000] = INPUTS
+    batch.run()
+    assert not batch.running.any()
+    for instance, n in enumerate(INPUTS):
+        emulator = HackEmulator(words)
+        emulator.ram[5000] = n
+        emulator.run()
+        assert batch.ram[instance, 5001] == emulator.ram[5001] == max(n, 0) * (max(n, 0) + 1) // 2
+        # the emulator also runs the first trip round the idle loop
+        assert batch.cycles[instance] == emulator.cycles - 2
+
+def test_max_cycles(tmp_path):
+    words = translated(tmp_path)
+    batch = BatchEmulator(words, len(INPUTS))
+    batch.ram[:, 5000] = INPUTS
+    batch.run(500)
+    # the short sums park first; the long ones stop at the limit
+    assert list(batch.cycles) == [128, 238, 500, 500, 128, 500]
+    for instance, n in enumerate(INPUTS):
+        emulator = HackEmulator(words)
+        emulator.ram[5000] = n
+        emulator.run(int(batch.cycles[instance]))
+        assert batch.pc[instance] == emulator.pc
+        assert (batch.ram[instance] == np.array(emulator.ram, dtype=np.int16)).all()
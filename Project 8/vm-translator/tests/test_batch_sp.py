@@ -0,0 +1,42 @@
+import pytest
+from helpers import FIXTURES, assert_results, fixture_mismatch, write_program
+from code_writer import CodeWriter
+from main import list_vm_files, verify_stack
+from parser import Parser
+from peephole import PeepholeOptimizer
+from stack_check import check_stack_depths
+
+@pytest.mark.parametrize("name", list(FIXTURES))
+def test_fixtures_pass(tmp_path, name):
+    assert fixture_mismatch(name, tmp_path, batch_sp=True) is None
+
+@pytest.mark.parametrize("cache_top", [False, True])
+def test_program_results(tmp_path, cache_top):
+    assert_results(tmp_path, batch_sp=True, cache_top=cache_top)
+
+def test_verify_stack_counts_removed_updates(tmp_path):
+    write_program(tmp_path)
+    stats = verify_stack(list_vm_files(tmp_path), True)
+    assert 0 < stats["SP updates eliminated"] < stats["SP updates"]
+
+def test_unbalanced_join_is_rejected(tmp_path):
+    # each trip round the loop leaves one more value on the stack
+    path = tmp_path / "Main.vm"
+    path.write_text("function Main.f 0\nlabel LOOP\npush constant 1\npush constant 0\n"
+                    "if-goto LOOP\nreturn\n")
+    with pytest.raises(ValueError, match="stack depth at label LOOP"):
+        check_stack_depths([("Main", Parser(str(path)).commands)])
+
+def test_dead_store_is_off_with_batch_sp(tmp_path):
+    # the slot at RAM[SP] is still live while a push's adjustment is pending
+    optimizer = PeepholeOptimizer()
+    CodeWriter(str(tmp_path / "Out.asm"), optimizer=optimizer, batch_sp=True).close()
+    assert "dead_store" not in [name for name, _, _ in optimizer.rules]
+    assert fixture_mismatch("StackTest", tmp_path, batch_sp=True, optimizer=PeepholeOptimizer()) is None
+
+def test_operands_below_the_entry_depth_are_rejected(tmp_path):
+    # add reads two values where the function's stack holds one
+    path = tmp_path / "Main.vm"
+    path.write_text("function Main.f 0\npush constant 1\nadd\nreturn\n")
+    with pytest.raises(ValueError, match="below"):
+        check_stack_depths([("Main", Parser(str(path)).commands)])
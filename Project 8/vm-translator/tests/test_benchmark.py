@@ -0,0 +1,20 @@
+import pytest
+from benchmark import SUITE_CONFIGS, run_suite
+from helpers import run_translated
+from synthetic_programs import SHAPES, write_program
+
+@pytest.mark.parametrize("shape", list(SHAPES))
+def test_generated_programs_run_to_their_end(tmp_path, shape):
+    write_program(str(tmp_path), shape, 20)
+    plain = run_translated(str(tmp_path))
+    optimized = run_translated(str(tmp_path), **SUITE_CONFIGS["O2"]())
+    assert plain.ram[0] == optimized.ram[0]
+    assert plain.ram[16:256] == optimized.ram[16:256]
+
+def test_suite_reports_every_config():
+    results = run_suite(["calls"], 20, list(SUITE_CONFIGS), repeat=1)
+    assert [result["config"] for result in results] == list(SUITE_CONFIGS)
+    by_config = {result["config"]: result for result in results}
+    assert all(result["cycles"] is not None and result["seconds"] > 0 for result in results)
+    assert by_config["O1"]["instructions"] < by_config["O0"]["instructions"]
+    assert by_config["O2"]["cycles"] < by_config["O0"]["cycles"]
@@ -0,0 +1,32 @@
+import os
+import shutil
+import pytest
+from c_writer import CWriter, build_native, run_native
+from helpers import EXPECTED_RESULTS, EXPECTED_SP, FIXTURES, copy_fixture, results, write_program
+from main import list_vm_files, translate
+from native_runner import NativeTestScript
+from vm_optimizer import VMOptimizer
+
+pytestmark = pytest.mark.skipif(shutil.which("cc") is None, reason="needs a C compiler")
+
+def build(directory, **options):
+    c_path = os.path.join(directory, "program.c")
+    binary_path = os.path.join(directory, "program")
+    translate(list_vm_files(directory), c_path, True, code_writer=CWriter(c_path, is_sys_init=True),
+              **options)
+    build_native(c_path, binary_path)
+    return run_native(binary_path)
+
+@pytest.mark.parametrize("name", list(FIXTURES))
+def test_fixtures_pass(tmp_path, name):
+    directory = copy_fixture(name, tmp_path)
+    script = NativeTestScript(os.path.join(directory, name + ".tst"))
+    script.run()
+    assert script.compare() is None
+
+@pytest.mark.parametrize("optimize", [False, True])
+def test_program_results(tmp_path, optimize):
+    write_program(tmp_path)
+    ram = build(tmp_path, vm_optimizer=VMOptimizer(entry="Sys.init") if optimize else None)
+    assert results(ram) == EXPECTED_RESULTS
+    assert ram[0] == EXPECTED_SP
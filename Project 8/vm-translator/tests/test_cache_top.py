@@ -0,0 +1,37 @@
+import os
+import pytest
+from helpers import FIXTURES, HackCPU, assert_results, command_code, fixture_mismatch
+from main import translate
+
+@pytest.mark.parametrize("name", list(FIXTURES))
+def test_fixtures_pass(tmp_path, name):
+    assert fixture_mismatch(name, tmp_path, cache_top=True) is None
+
+def test_program_runs_in_fewer_cycles(tmp_path):
+    plain = tmp_path / "plain"
+    cached = tmp_path / "cached"
+    plain.mkdir()
+    cached.mkdir()
+    baseline = assert_results(plain)
+    emulator = assert_results(cached, cache_top=True)
+    assert emulator.cycles < baseline.cycles
+
+def test_top_of_stack_stays_in_d(tmp_path):
+    vm_path = tmp_path / "Snippet.vm"
+    vm_path.write_text("push constant 3\npush constant 4\nadd\nneg\npush constant 1\nsub\npop temp 0\n")
+    cycles = {}
+    for cache_top in (False, True):
+        asm_path = os.path.join(tmp_path, f"{cache_top}.asm")
+        translate([str(vm_path)], asm_path, False, cache_top=cache_top)
+        cpu = HackCPU(asm_path)
+        cpu.ram[0] = 256
+        cpu.run()
+        assert (cpu.ram[0], cpu.ram[5]) == (256, -8)
+        cycles[cache_top] = cpu.cycles
+    sections = dict(command_code(asm_path))
+    # pushes load D, operations work on D and pops store it
+    assert sections["// push constant 4"] == ["@4", "D=A"]
+    assert sections["// add"] == ["@SP", "AM=M-1", "D=D+M"]
+    assert sections["// neg"][0] == "D=-D"
+    assert sections["// pop temp 0"] == ["@5", "M=D"]
+    assert cycles[True] < cycles[False]
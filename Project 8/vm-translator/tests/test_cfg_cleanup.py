@@ -0,0 +1,38 @@
+from helpers import assert_results
+from parser import Parser
+from vm_optimizer import VMOptimizer
+
+SOURCE = """function Main.f 0
+push constant 1
+if-goto A
+goto B
+push constant 5
+pop static 0
+label A
+goto C
+label B
+push constant 2
+pop static 1
+label C
+push constant 0
+return
+"""
+
+def test_threads_jumps_and_drops_dead_code(tmp_path):
+    path = tmp_path / "Main.vm"
+    path.write_text(SOURCE)
+    optimizer = VMOptimizer(["cfg-cleanup"])
+    (_, commands), = optimizer.optimize([("Main", Parser(str(path)).commands)])
+    # if-goto A lands on goto C; goto B only skipped dead code
+    assert [repr(command) for command in commands] == [
+        "function Main.f 0", "push constant 1", "if-goto C", "push constant 2", "pop static 1",
+        "label C", "push constant 0", "return"]
+    stats = optimizer.stats["cfg-cleanup"]
+    assert stats["jumps threaded"] == 1
+    assert stats["unreachable commands removed"] == 4
+
+def test_program_results(tmp_path):
+    assert_results(tmp_path, vm_optimizer=VMOptimizer(["cfg-cleanup"]))
+
+def test_all_passes_keep_the_results(tmp_path):
+    assert_results(tmp_path, vm_optimizer=VMOptimizer(entry="Sys.init"))
@@ -0,0 +1,32 @@
+from helpers import assert_results
+from parser import Parser
+from vm_optimizer import VMOptimizer
+
+def fold(tmp_path, text):
+    path = tmp_path / "Main.vm"
+    path.write_text("function Main.f 0\n" + text + "return\n")
+    optimizer = VMOptimizer(["constant-folding"])
+    (_, commands), = optimizer.optimize([("Main", Parser(str(path)).commands)])
+    return [repr(command) for command in commands[1:-1]], optimizer.stats["constant-folding"]
+
+def test_folds_constant_arithmetic(tmp_path):
+    commands, stats = fold(tmp_path, "push constant 3\npush constant 4\nadd\npush constant 2\nsub\n")
+    assert commands == ["push constant 5"]
+    assert stats["folded"] == 2
+
+def test_negative_results_are_rebuilt_from_constants(tmp_path):
+    commands, _ = fold(tmp_path, "push constant 7\nnot\npush constant 0\nadd\n")
+    assert commands == ["push constant 7", "not"]
+
+def test_comparisons_follow_the_wrapped_difference(tmp_path):
+    # 32767 - (-2) overflows to a negative word, so gt is false
+    commands, _ = fold(tmp_path, "push constant 32767\npush constant 2\nneg\ngt\n")
+    assert commands == ["push constant 0"]
+
+def test_identities_leave_the_operand(tmp_path):
+    commands, stats = fold(tmp_path, "push local 0\npush constant 0\nadd\n")
+    assert commands == ["push local 0"]
+    assert stats["simplified"] == 1
+
+def test_program_results(tmp_path):
+    assert_results(tmp_path, vm_optimizer=VMOptimizer(["constant-folding"]))
@@ -0,0 +1,40 @@
+import pytest
+from helpers import assert_results, write_program
+from main import count_instructions, list_vm_files, removed_instructions, translate, vm_file_name
+from parser import Opcode, Parser
+from vm_optimizer import VMOptimizer
+
+def load_program(vm_files):
+    return [(vm_file_name(file_path), Parser(file_path).commands) for file_path in vm_files]
+
+def functions(program):
+    return {command.arg1 for _, commands in program for command in commands
+            if command.opcode is Opcode.FUNCTION}
+
+def test_removes_functions_unreachable_from_the_entry(tmp_path):
+    write_program(tmp_path)
+    optimizer = VMOptimizer(["dead-functions"], entry="Sys.init")
+    program = optimizer.optimize(load_program(list_vm_files(tmp_path)))
+    assert "Main.unused" not in functions(program)
+    assert {"Sys.init", "Main.main", "Main.sum", "Main.hop", "Main.wide"} <= functions(program)
+    assert optimizer.stats["dead-functions"]["functions removed"] == 1
+
+def test_keeps_everything_without_an_entry(tmp_path):
+    write_program(tmp_path)
+    program = load_program(list_vm_files(tmp_path))
+    optimized = VMOptimizer(["dead-functions"]).optimize(program)
+    assert functions(optimized) == functions(program)
+
+def test_program_results(tmp_path):
+    assert_results(tmp_path, vm_optimizer=VMOptimizer(["dead-functions"], entry="Sys.init"))
+
+@pytest.mark.parametrize("options", [{}, {"fuse_branches": True, "direct_moves": True}])
+def test_saving_is_measured_in_instructions(tmp_path, options):
+    write_program(tmp_path)
+    vm_files = list_vm_files(tmp_path)
+    optimizer = VMOptimizer(["dead-functions"], entry="Sys.init")
+    translate(vm_files, str(tmp_path / "with.asm"), True, vm_optimizer=optimizer, **options)
+    translate(vm_files, str(tmp_path / "without.asm"), True, **options)
+    removed = removed_instructions(optimizer.removed, **options)
+    assert functions(optimizer.removed) == {"Main.unused"}
+    assert removed == count_instructions(tmp_path / "without.asm") - count_instructions(tmp_path / "with.asm") > 0
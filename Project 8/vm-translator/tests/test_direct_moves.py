@@ -0,0 +1,25 @@
+import os
+import pytest
+from helpers import FIXTURES, assert_results, command_code, fixture_mismatch
+from main import count_instructions
+
+@pytest.mark.parametrize("name", list(FIXTURES))
+def test_fixtures_pass(tmp_path, name):
+    assert fixture_mismatch(name, tmp_path, direct_moves=True) is None
+
+def test_program_takes_less_code(tmp_path):
+    sizes = {}
+    for direct_moves in (False, True):
+        directory = tmp_path / str(direct_moves)
+        directory.mkdir()
+        assert_results(directory, direct_moves=direct_moves)
+        sizes[direct_moves] = count_instructions(os.path.join(directory, "Program.asm"))
+    assert sizes[True] < sizes[False]
+
+def test_moves_bypass_the_stack(tmp_path):
+    assert_results(tmp_path, direct_moves=True)
+    moves = {comment: code for comment, code in command_code(os.path.join(tmp_path, "Program.asm"))
+             if "+ pop" in comment}
+    assert moves["// push constant 3000 + pop pointer 0"] == ["@3000", "D=A", "@3", "M=D"]
+    assert moves["// push static 3 + pop temp 6"] == ["@Main.3", "D=M", "@11", "M=D"]
+    assert all("@SP" not in code for code in moves.values())
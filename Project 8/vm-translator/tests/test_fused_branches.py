@@ -0,0 +1,30 @@
+import os
+import pytest
+from helpers import FIXTURES, assert_results, command_code, fixture_mismatch
+from main import count_instructions
+
+@pytest.mark.parametrize("name", list(FIXTURES))
+def test_fixtures_pass(tmp_path, name):
+    assert fixture_mismatch(name, tmp_path, fuse_branches=True) is None
+
+@pytest.mark.parametrize("options", [{}, {"cache_top": True}, {"batch_sp": True}])
+def test_program_results(tmp_path, options):
+    assert_results(tmp_path, fuse_branches=True, **options)
+
+def test_loop_tests_branch_without_a_boolean(tmp_path):
+    plain = tmp_path / "plain"
+    fused = tmp_path / "fused"
+    plain.mkdir()
+    fused.mkdir()
+    baseline = assert_results(plain)
+    cpu = assert_results(fused, fuse_branches=True)
+    fused_path = os.path.join(fused, "Program.asm")
+    sections = dict(command_code(fused_path))
+    # the loop's exit test pops its two operands and jumps once, with no
+    # true/false pushed in between
+    code = sections["// lt + not + if-goto DONE"]
+    assert [line for line in code if ";J" in line] == ["D;JGE"]
+    assert code.count("AM=M-1") == 2
+    assert not {"M=-1", "M=0", "M=!M"} & set(code)
+    assert count_instructions(fused_path) < count_instructions(os.path.join(plain, "Program.asm"))
+    assert cpu.cycles < baseline.cycles
@@ -0,0 +1,46 @@
+import os
+import pytest
+import hack_emulator
+from hack_emulator import HackEmulator, load_program
+from helpers import FIXTURES, assert_results, translate_fixture
+
+def emulator_for(tmp_path, text):
+    path = tmp_path / "Prog.asm"
+    path.write_text(text)
+    return HackEmulator(load_program(str(path)))
+
+@pytest.mark.parametrize("name", list(FIXTURES))
+def test_fixtures_pass(tmp_path, name):
+    output_path = translate_fixture(name, tmp_path)
+    script = hack_emulator.TestScript(os.path.join(os.path.dirname(output_path), name + ".tst"))
+    script.run()
+    assert script.compare() is None
+
+def test_matches_the_reference_cpu(tmp_path):
+    cpu = assert_results(tmp_path)
+    emulator = HackEmulator(load_program(str(tmp_path / "Program.asm")))
+    emulator.run()
+    assert (emulator.pc, emulator.cycles) == (cpu.pc, cpu.cycles)
+    assert list(emulator.ram) == cpu.ram
+
+def test_stops_at_the_idle_loop(tmp_path):
+    emulator = emulator_for(tmp_path, "@5\nD=A\n@x\nM=D\n(END)\n@END\n0;JMP\n")
+    # the first trip round the loop runs; then it is seen to be parked
+    assert emulator.run() == 6
+    assert emulator.ram[16] == 5
+    assert emulator.pc == 4
+
+def test_bounded_runs_add_up(tmp_path):
+    assert_results(tmp_path)
+    whole = HackEmulator(load_program(str(tmp_path / "Program.asm")))
+    whole.run()
+    stepped = HackEmulator(load_program(str(tmp_path / "Program.asm")))
+    while stepped.cycles < whole.cycles:
+        stepped.run(min(997, whole.cycles - stepped.cycles))
+    assert (stepped.pc, stepped.a, stepped.d) == (whole.pc, whole.a, whole.d)
+    assert stepped.ram == whole.ram
+
+def test_stop_pc(tmp_path):
+    emulator = emulator_for(tmp_path, "@1\nD=A\n@2\nD=D+A\n@3\nD=D+A\n(END)\n@END\n0;JMP\n")
+    emulator.run(stop_pc=4)
+    assert (emulator.pc, emulator.d, emulator.cycles) == (4, 3, 4)
@@ -0,0 +1,53 @@
+from helpers import assert_results, write_program
+from main import list_vm_files, vm_file_name
+from parser import Opcode, Parser
+from vm_optimizer import VMOptimizer
+
+# a leaf bigger than the call protocol, called from five sites
+FILES = {
+    "Sys": "function Sys.init 0\n"
+           + "push constant 1\ncall Main.big 1\npop static 0\n" * 5
+           + "label HALT\ngoto HALT\n",
+    "Main": "function Main.big 0\npush argument 0\n"
+            + "".join(f"push constant {i}\nadd\n" for i in range(1, 5))
+            + "return\n",
+}
+
+def load_program(vm_files):
+    return [(vm_file_name(file_path), Parser(file_path).commands) for file_path in vm_files]
+
+def inline(directory, **options):
+    optimizer = VMOptimizer(["inline"], entry="Sys.init", **options)
+    program = optimizer.optimize(load_program(list_vm_files(directory)))
+    calls = sum(command.opcode is Opcode.CALL for _, commands in program for command in commands)
+    return optimizer.stats["inline"], calls
+
+def test_growth_budget_covers_every_call_site(tmp_path):
+    write_program(tmp_path, FILES)
+    stats, calls = inline(tmp_path, inline_max_growth=100)
+    assert stats["call sites inlined"] == 0
+    assert calls == 5
+    stats, calls = inline(tmp_path, inline_max_growth=1000)
+    assert stats["call sites inlined"] == 5
+    assert calls == 0
+    assert 0 < stats["estimated growth"] <= 1000
+
+def test_size_limit(tmp_path):
+    write_program(tmp_path, FILES)
+    stats, calls = inline(tmp_path, inline_max_size=4)
+    assert stats["call sites inlined"] == 0
+
+def test_program_results(tmp_path):
+    optimizer = VMOptimizer(["inline"], entry="Sys.init")
+    assert_results(tmp_path, vm_optimizer=optimizer)
+    assert optimizer.stats["inline"]["call sites inlined"] > 0
+
+def test_frame_moves_onto_the_callers_stack(tmp_path):
+    write_program(tmp_path, FILES)
+    optimizer = VMOptimizer(["inline"], entry="Sys.init", inline_max_growth=1000)
+    program = optimizer.optimize(load_program(list_vm_files(tmp_path)))
+    commands = dict(program)["Sys"]
+    # Main.big's argument becomes Sys.init's local 0, shared by the sites
+    assert commands[0].opcode is Opcode.FUNCTION and commands[0].arg2 == 1
+    segments = {command.arg1 for command in commands if command.opcode in (Opcode.PUSH, Opcode.POP)}
+    assert segments == {"constant", "local", "static"}
@@ -0,0 +1,42 @@
+import pytest
+from code_writer import PROFILE_BASE, PROFILE_SIZE, PROFILE_WORDS
+from hack_emulator import HackEmulator, load_program
+from helpers import EXPECTED_RESULTS, results, run_translated, write_program
+from main import list_vm_files, translate, write_profile_map
+from profile_report import profile, read_map
+from vm_interpreter import Profiler, VMInterpreter, load_program as load_vm_program
+
+def run_instrumented(tmp_path, **options):
+    # Returns (the emulator parked at the end, the counter slots from the map)
+    write_program(tmp_path)
+    output_path = str(tmp_path / "Program.asm")
+    code_writer = translate(list_vm_files(tmp_path), output_path, True, instrument=True, **options)
+    map_path = str(tmp_path / "Program.prof")
+    write_profile_map(map_path, code_writer.profile_slots)
+    emulator = HackEmulator(load_program(output_path))
+    emulator.run()
+    return emulator, read_map(map_path)
+
+def test_counters_sit_at_the_top_of_the_heap(tmp_path):
+    _, slots = run_instrumented(tmp_path)
+    addresses = sorted(address for _, address in slots)
+    # inside the heap (2048-16383), below the screen
+    assert 2048 <= PROFILE_BASE == addresses[0]
+    assert addresses[-1] + PROFILE_WORDS <= PROFILE_BASE + PROFILE_SIZE == 16384
+
+@pytest.mark.parametrize("options", [{}, {"tail_calls": True}])
+def test_calls_match_the_interpreter(tmp_path, options):
+    emulator, slots = run_instrumented(tmp_path, **options)
+    assert results(emulator.ram) == EXPECTED_RESULTS
+    interpreter = VMInterpreter(load_vm_program(list_vm_files(tmp_path)), bootstrap=True)
+    profiler = Profiler(interpreter)
+    interpreter.run(None, profiler)
+    expected = {name: calls for name, calls, _, _ in profiler.functions()}
+    counted = {name: calls for name, calls, _ in profile(slots, emulator.ram) if calls}
+    # the bootstrap counts as one call of OS
+    assert counted.pop("OS") == 1
+    assert counted == expected
+    # the instruction counts estimate the plain translation, whatever the
+    # options of the instrumented one
+    estimate = sum(instructions for _, _, instructions in profile(slots, emulator.ram))
+    assert abs(estimate - run_translated(tmp_path).cycles) < 0.05 * estimate
@@ -0,0 +1,45 @@
+import io
+import sys
+import pytest
+import main
+from benchmark import translate_unbuffered
+from helpers import write_program
+from main import list_vm_files, translate
+from output_buffer import OutputBuffer
+from peephole import PeepholeOptimizer
+
+LINES = ["@SP\n", "M=M+1\n", "@SP\n", "AM=M-1\n", "(L)\n", "D=M\n"]
+
+def test_without_optimizer_lines_go_straight_to_the_file():
+    file = io.StringIO()
+    buffer = OutputBuffer(file)
+    buffer.write("@SP\n")
+    assert file.getvalue() == "@SP\n"
+
+@pytest.mark.parametrize("flush_threshold", [None, 0, 2])
+def test_optimizer_sees_sections(flush_threshold):
+    file = io.StringIO()
+    buffer = OutputBuffer(file, flush_threshold=flush_threshold, optimizer=PeepholeOptimizer())
+    for line in LINES:
+        buffer.write(line)
+    buffer.end_section()
+    buffer.flush()
+    text = file.getvalue()
+    assert text.endswith("(L)\nD=M\n")
+    if flush_threshold is None:
+        assert text == "@SP\nA=M\n(L)\nD=M\n"
+
+def test_one_writer_matches_a_writer_per_file(tmp_path):
+    write_program(tmp_path)
+    vm_files = list_vm_files(tmp_path)
+    translate(vm_files, str(tmp_path / "buffered.asm"), True)
+    translate_unbuffered(vm_files, str(tmp_path / "unbuffered.asm"), True)
+    assert (tmp_path / "buffered.asm").read_text() == (tmp_path / "unbuffered.asm").read_text()
+
+def test_flush_threshold_needs_the_optimizer(tmp_path, monkeypatch):
+    write_program(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["main.py", str(tmp_path), "--flush-threshold", "10"])
+    with pytest.raises(SystemExit) as exit_info:
+        main.main()
+    assert exit_info.value.code == 2
+    assert not (tmp_path / (tmp_path.name + ".asm")).exists()
@@ -0,0 +1,21 @@
+from helpers import PROGRAM, write_program
+from main import list_vm_files, translate
+from peephole import PeepholeOptimizer
+
+# a third file, so more than one fragment goes to the pool
+FILES = dict(PROGRAM, Extra="function Extra.f 0\npush constant 3\nreturn\n")
+
+def test_parallel_output_matches_serial(tmp_path):
+    write_program(tmp_path, FILES)
+    vm_files = list_vm_files(tmp_path)
+    outputs = {}
+    saved = {}
+    for jobs in (1, 2):
+        optimizer = PeepholeOptimizer()
+        output_path = tmp_path / f"jobs{jobs}.asm"
+        translate(vm_files, str(output_path), True, jobs=jobs, optimizer=optimizer)
+        outputs[jobs] = output_path.read_text()
+        saved[jobs] = optimizer.saved
+    assert outputs[2] == outputs[1]
+    # savings made in the workers are merged back
+    assert saved[2] == saved[1]
@@ -0,0 +1,58 @@
+import pytest
+from parser import CommandType, Opcode, Parser
+
+SOURCE = """// a comment line
+
+push constant 7   // trailing comment
+push local 2
+add
+label LOOP
+if-goto LOOP
+function Main.f 3
+call Main.f 1
+return
+push local 2
+"""
+
+def parse(tmp_path, text=SOURCE):
+    path = tmp_path / "Main.vm"
+    path.write_text(text)
+    return Parser(str(path))
+
+def test_commands_are_tokenized_once(tmp_path):
+    commands = parse(tmp_path).commands
+    assert [command.opcode for command in commands] == [
+        Opcode.PUSH, Opcode.PUSH, Opcode.ADD, Opcode.LABEL, Opcode.IF_GOTO,
+        Opcode.FUNCTION, Opcode.CALL, Opcode.RETURN, Opcode.PUSH]
+    push = commands[0]
+    assert (push.command_type, push.arg1, push.arg2) == (CommandType.PUSH, "constant", 7)
+    assert commands[2].command_type == CommandType.ARITHMETIC
+    assert commands[2].arg1 == "add"
+    assert [repr(command) for command in commands[:3]] == ["push constant 7", "push local 2", "add"]
+    # repeated lines share one record
+    assert commands[-1] is commands[1]
+
+def test_accessors_walk_the_commands(tmp_path):
+    parser = parse(tmp_path)
+    seen = []
+    while parser.has_more_commands():
+        parser.advance()
+        seen.append((parser.command_type(), parser.arg1()))
+    assert len(seen) == 9
+    assert seen[5] == (CommandType.FUNCTION, "Main.f")
+
+def test_arg2_is_checked(tmp_path):
+    parser = parse(tmp_path, "add\n")
+    parser.advance()
+    with pytest.raises(ValueError):
+        parser.arg2()
+
+def test_unknown_command(tmp_path):
+    with pytest.raises(ValueError, match="Unknown command type: jump"):
+        parse(tmp_path, "jump LOOP\n")
+
+@pytest.mark.parametrize("line", ["push constant", "pop local", "function Main.f",
+                                  "call Main.f", "goto", "add 1"])
+def test_argument_count_is_checked(tmp_path, line):
+    with pytest.raises(ValueError, match=f"Wrong number of arguments: {line}"):
+        parse(tmp_path, line + "\n")
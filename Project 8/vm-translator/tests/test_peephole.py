@@ -0,0 +1,34 @@
+import pytest
+from helpers import FIXTURES, assert_results, fixture_mismatch
+from peephole import PeepholeOptimizer
+
+def optimize(instructions):
+    optimizer = PeepholeOptimizer()
+    lines = optimizer.optimize([instruction + "\n" for instruction in instructions])
+    return [line[:-1] for line in lines], optimizer
+
+def test_push_then_pop_cancels():
+    lines, optimizer = optimize(["@SP", "M=M+1", "@SP", "AM=M-1", "D=M"])
+    assert lines == ["@SP", "A=M", "D=M"]
+    assert optimizer.saved["push_pop"] == 2
+
+def test_rewrites_are_revisited():
+    # dropping the reload exposes a second @R13 after the store
+    lines, _ = optimize(["@R13", "M=D", "D=M", "@R13", "M=D+1"])
+    assert lines == ["@R13", "M=D", "M=D+1"]
+
+def test_patterns_do_not_cross_labels():
+    lines, optimizer = optimize(["@SP", "M=M+1", "(L)", "@SP", "AM=M-1"])
+    assert lines == ["@SP", "M=M+1", "(L)", "@SP", "AM=M-1"]
+    assert sum(optimizer.saved.values()) == 0
+
+def test_comments_are_kept():
+    lines, _ = optimize(["// push", "@SP", "M=M+1", "// pop", "@SP", "AM=M-1"])
+    assert lines == ["// push", "// pop", "@SP", "A=M"]
+
+@pytest.mark.parametrize("name", list(FIXTURES))
+def test_fixtures_pass(tmp_path, name):
+    assert fixture_mismatch(name, tmp_path, optimizer=PeepholeOptimizer()) is None
+
+def test_program_results(tmp_path):
+    assert_results(tmp_path, optimizer=PeepholeOptimizer())
@@ -0,0 +1,32 @@
+import os
+import pytest
+from helpers import PROGRAM_FIXTURES, assert_results, command_code, fixture_mismatch
+from main import count_instructions
+
+@pytest.mark.parametrize("name", PROGRAM_FIXTURES)
+def test_fixtures_pass(tmp_path, name):
+    assert fixture_mismatch(name, tmp_path, shared_calls=True) is None
+
+def test_program_results(tmp_path):
+    assert_results(tmp_path, shared_calls=True)
+
+def test_call_sites_jump_to_one_routine(tmp_path):
+    assert_results(tmp_path, shared_calls=True)
+    sections = command_code(os.path.join(tmp_path, "Program.asm"))
+    calls = [code for comment, code in sections if comment.startswith("// call ")]
+    returns = [code for comment, code in sections if comment == "// return"]
+    assert calls and returns
+    assert all(code[-2:] == ["@$$CALL", "0;JMP"] for code in calls)
+    assert all(code == ["@$$RETURN", "0;JMP"] for code in returns)
+    with open(os.path.join(tmp_path, "Program.asm"), "r") as file:
+        labels = [line.strip() for line in file if line.startswith("($$")]
+    assert labels == ["($$CALL)", "($$RETURN)"]
+
+def test_shrinks_every_call_site(tmp_path):
+    sizes = {}
+    for shared_calls in (False, True):
+        directory = tmp_path / str(shared_calls)
+        directory.mkdir()
+        assert_results(directory, shared_calls=shared_calls)
+        sizes[shared_calls] = count_instructions(os.path.join(directory, "Program.asm"))
+    assert sizes[True] < sizes[False]
@@ -0,0 +1,24 @@
+import pytest
+from helpers import assert_results, fixture_mismatch, translate_fixture
+from main import count_instructions
+
+@pytest.mark.parametrize("name", ["StackTest", "FibonacciElement"])
+def test_fixtures_pass(tmp_path, name):
+    assert fixture_mismatch(name, tmp_path, shared_compare=True) is None
+
+def test_program_results(tmp_path):
+    assert_results(tmp_path, shared_compare=True)
+
+def test_combines_with_shared_calls(tmp_path):
+    assert_results(tmp_path, shared_compare=True, shared_calls=True)
+
+def test_one_routine_per_comparison(tmp_path):
+    # StackTest compares nine times
+    plain_path = translate_fixture("StackTest", tmp_path / "plain")
+    shared_path = translate_fixture("StackTest", tmp_path / "shared", shared_compare=True)
+    assert count_instructions(shared_path) < count_instructions(plain_path)
+    with open(shared_path, "r") as file:
+        lines = [line.strip() for line in file]
+    for routine in ["$$EQ", "$$GT", "$$LT"]:
+        assert lines.count(f"({routine})") == 1
+    assert sum(lines.count(f"@{routine}") for routine in ["$$EQ", "$$GT", "$$LT"]) == 9
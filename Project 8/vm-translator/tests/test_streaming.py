@@ -0,0 +1,41 @@
+import pytest
+import main
+from helpers import assert_results, write_program
+from main import list_vm_files, translate
+from parser import Parser
+from peephole import PeepholeOptimizer
+
+def test_streamed_commands_match_the_list(tmp_path):
+    write_program(tmp_path)
+    path = str(tmp_path / "Main.vm")
+    streamed = Parser(path, streaming=True)
+    seen = []
+    while streamed.has_more_commands():
+        streamed.advance()
+        seen.append(streamed.current_command)
+    assert [repr(command) for command in seen] == [repr(command) for command in Parser(path).commands]
+
+@pytest.mark.parametrize("options", [{}, {"fuse_branches": True, "direct_moves": True, "tail_calls": True}])
+def test_small_chunks_give_the_same_output(tmp_path, monkeypatch, options):
+    # patterns spanning a chunk boundary are carried into the next chunk
+    monkeypatch.setattr(main, "STREAM_CHUNK", 5)
+    write_program(tmp_path)
+    vm_files = list_vm_files(tmp_path)
+    translate(vm_files, str(tmp_path / "list.asm"), True, **options)
+    translate(vm_files, str(tmp_path / "stream.asm"), True, streaming=True, **options)
+    assert (tmp_path / "stream.asm").read_text() == (tmp_path / "list.asm").read_text()
+
+def test_flushes_do_not_cost_peephole_savings(tmp_path):
+    write_program(tmp_path)
+    vm_files = list_vm_files(tmp_path)
+    whole = PeepholeOptimizer()
+    translate(vm_files, str(tmp_path / "list.asm"), True, optimizer=whole)
+    flushed = PeepholeOptimizer()
+    # several flushes, each held back to the last label before it
+    translate(vm_files, str(tmp_path / "stream.asm"), True, streaming=True, flush_threshold=300,
+              optimizer=flushed)
+    assert (tmp_path / "stream.asm").read_text() == (tmp_path / "list.asm").read_text()
+    assert flushed.saved == whole.saved
+
+def test_program_results(tmp_path):
+    assert_results(tmp_path, streaming=True, flush_threshold=16, optimizer=PeepholeOptimizer())
@@ -0,0 +1,34 @@
+import pytest
+from helpers import PROGRAM_FIXTURES, assert_results, fixture_mismatch, run_translated, write_program
+
+# a deep self tail call, which keeps its frame in place
+SUM_FILES = {
+    "Sys": "function Sys.init 0\npush constant 2000\npush constant 0\ncall Main.sum 2\n"
+           "pop static 0\nlabel HALT\ngoto HALT\n",
+    "Main": "function Main.sum 0\npush argument 0\npush constant 0\neq\nif-goto DONE\n"
+            "push argument 0\npush constant 1\nsub\npush argument 1\npush argument 0\nadd\n"
+            "call Main.sum 2\nreturn\nlabel DONE\npush argument 1\nreturn\n",
+}
+
+@pytest.mark.parametrize("name", PROGRAM_FIXTURES)
+def test_fixtures_pass(tmp_path, name):
+    assert fixture_mismatch(name, tmp_path, tail_calls=True) is None
+
+@pytest.mark.parametrize("options", [{}, {"cache_top": True}, {"batch_sp": True},
+                                     {"shared_calls": True}, {"fuse_branches": True}])
+def test_program_results(tmp_path, options):
+    # Main.sum calls itself with the same frame size and Main.hop calls it
+    # with a different one, which goes through the shared routine
+    assert_results(tmp_path, tail_calls=True, **options)
+
+def test_self_tail_call_beats_call_and_return(tmp_path):
+    cycles = {}
+    for tail_calls in (False, True):
+        directory = tmp_path / str(tail_calls)
+        directory.mkdir()
+        write_program(directory, SUM_FILES)
+        emulator = run_translated(directory, tail_calls=tail_calls)
+        # 2000 + 1999 + ... + 1 wraps to a 16-bit word
+        assert emulator.ram[16] == 2001000 % 65536 - 65536
+        cycles[tail_calls] = emulator.cycles
+    assert cycles[True] < cycles[False]
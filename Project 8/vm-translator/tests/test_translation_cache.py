@@ -0,0 +1,43 @@
+from helpers import write_program
+from main import list_vm_files, translate
+from peephole import PeepholeOptimizer
+from translation_cache import TranslationCache
+
+def build(directory, cache, **options):
+    output_path = directory / "Program.asm"
+    translate(list_vm_files(directory), str(output_path), True, cache=cache, **options)
+    return output_path.read_text()
+
+def test_second_build_comes_from_the_cache(tmp_path):
+    program = tmp_path / "program"
+    program.mkdir()
+    write_program(program)
+    cache = TranslationCache(str(tmp_path / "cache"))
+    first = build(program, cache, optimizer=PeepholeOptimizer())
+    assert (cache.hits, cache.misses) == (0, 2)
+    second = build(program, cache, optimizer=PeepholeOptimizer())
+    assert (cache.hits, cache.misses) == (2, 2)
+    assert second == first
+
+def test_edits_and_options_miss(tmp_path):
+    program = tmp_path / "program"
+    program.mkdir()
+    write_program(program)
+    cache = TranslationCache(str(tmp_path / "cache"))
+    build(program, cache)
+    build(program, cache, optimizer=PeepholeOptimizer())
+    assert cache.hits == 0
+    with open(program / "Main.vm", "a") as file:
+        file.write("function Main.extra 0\npush constant 1\nreturn\n")
+    text = build(program, cache)
+    # Sys.vm is unchanged, Main.vm is not
+    assert (cache.hits, cache.misses) == (1, 5)
+    assert "(Main.extra)" in text
+
+def test_eviction_keeps_the_cache_bounded(tmp_path):
+    program = tmp_path / "program"
+    program.mkdir()
+    write_program(program)
+    cache = TranslationCache(str(tmp_path / "cache"), max_bytes=1)
+    build(program, cache)
+    assert cache.evictions == 2
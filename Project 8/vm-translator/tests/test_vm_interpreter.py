@@ -0,0 +1,68 @@
+import os
+import shutil
+import pytest
+from helpers import EXPECTED_RESULTS, EXPECTED_SP, FIXTURES, REPOSITORY, results, write_program
+from main import list_vm_files
+from parser import COMPARE, Opcode
+from vm_interpreter import Profiler, VMInterpreter, VMTestScript, load_program
+from vm_optimizer import VMOptimizer
+
+@pytest.mark.parametrize("name", list(FIXTURES))
+def test_vm_emulator_scripts_pass(tmp_path, name):
+    directory = tmp_path / name
+    shutil.copytree(os.path.join(REPOSITORY, FIXTURES[name][0]), directory)
+    script = VMTestScript(str(directory / f"{name}VME.tst"))
+    script.run()
+    assert script.compare() is None
+
+def run_interpreted(directory):
+    interpreter = VMInterpreter(load_program(list_vm_files(directory)), bootstrap=True)
+    interpreter.run()
+    return interpreter
+
+def test_program_results(tmp_path):
+    write_program(tmp_path)
+    interpreter = run_interpreted(tmp_path)
+    assert interpreter.ram[0] == EXPECTED_SP
+    assert results(interpreter.ram) == EXPECTED_RESULTS
+
+def test_optimized_program_results(tmp_path):
+    # the -O2 passes, inlining included, leave plain VM code
+    write_program(tmp_path)
+    optimizer = VMOptimizer(entry="Sys.init")
+    program = optimizer.optimize(load_program(list_vm_files(tmp_path)))
+    assert optimizer.stats["inline"]["call sites inlined"] > 0
+    interpreter = VMInterpreter(program, bootstrap=True)
+    interpreter.run()
+    assert results(interpreter.ram) == EXPECTED_RESULTS
+
+def test_comparisons_wrap():
+    assert COMPARE[Opcode.GT](32767, -2) == 0
+    assert COMPARE[Opcode.LT](32767, -2) == -1
+    assert COMPARE[Opcode.EQ](5, 5) == -1
+
+def test_stepped_runs_match_a_whole_run(tmp_path):
+    # whole runs use fused ops, stepped ones single commands
+    write_program(tmp_path)
+    whole = run_interpreted(tmp_path)
+    stepped = VMInterpreter(load_program(list_vm_files(tmp_path)), bootstrap=True)
+    while stepped.steps < whole.steps:
+        stepped.run(min(97, whole.steps - stepped.steps))
+    assert stepped.pc == whole.pc
+    # values fused ops never push are missing above SP
+    sp = whole.ram[0]
+    assert stepped.ram[:sp] == whole.ram[:sp]
+    assert results(stepped.ram) == results(whole.ram)
+
+def test_profiler_counts_calls(tmp_path):
+    write_program(tmp_path)
+    interpreter = VMInterpreter(load_program(list_vm_files(tmp_path)), bootstrap=True)
+    profiler = Profiler(interpreter)
+    interpreter.run(None, profiler)
+    calls = {name: count for name, count, _, _ in profiler.functions()}
+    # fib(10) makes 2 * fib(11) - 1 calls
+    assert calls["Main.fib"] == 177
+    assert calls["Main.mix"] == 20
+    assert calls["Main.sum"] == 112
+    assert "Main.unused" not in calls
+    assert profiler.steps == run_interpreted(tmp_path).steps
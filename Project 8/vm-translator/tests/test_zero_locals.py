@@ -0,0 +1,22 @@
+import os
+import pytest
+from helpers import assert_results, fixture_mismatch
+from main import count_instructions
+
+@pytest.mark.parametrize("zero_loop_threshold", [None, 1, 4])
+def test_locals_start_at_zero(tmp_path, zero_loop_threshold):
+    # Main.wide reads locals from stack slots earlier calls left dirty
+    assert_results(tmp_path, zero_loop_threshold=zero_loop_threshold)
+
+@pytest.mark.parametrize("zero_loop_threshold", [None, 1])
+def test_fixtures_pass(tmp_path, zero_loop_threshold):
+    assert fixture_mismatch("SimpleFunction", tmp_path, zero_loop_threshold=zero_loop_threshold) is None
+
+def test_shared_loop_shrinks_wide_functions(tmp_path):
+    sizes = {}
+    for zero_loop_threshold in (None, 4):
+        directory = tmp_path / str(zero_loop_threshold)
+        directory.mkdir()
+        assert_results(directory, zero_loop_threshold=zero_loop_threshold)
+        sizes[zero_loop_threshold] = count_instructions(os.path.join(directory, "Program.asm"))
+    assert sizes[4] < sizes[None]